@@ -1,26 +1,34 @@
 from django.contrib import admin
-from .models import Proxy, CrawlJob, CrawledURL, CrawlStats
+from .models import Proxy, CrawlJob, CrawledURL, CrawlStats, PageBlob
 
 @admin.register(Proxy)
 class ProxyAdmin(admin.ModelAdmin):
-    list_display = ('ip_address', 'port', 'country_code', 'is_blocked', 'last_used')
-    list_filter = ('is_blocked', 'country_code')
+    list_display = ('ip_address', 'port', 'country_code', 'is_blocked', 'last_used',
+                    'success_ewma', 'latency_ewma', 'timeout_ewma', 'recent_blocks')
+    list_filter = ('is_blocked', 'is_stale', 'country_code')
     search_fields = ('ip_address', 'country_code')
 
 @admin.register(CrawlJob)
 class CrawlJobAdmin(admin.ModelAdmin):
-    list_display = ('id', 'status', 'urls_total', 'urls_processed', 'rate_limit_hits', 'current_rate', 'created_at')
-    list_filter = ('status',)
-    readonly_fields = ('created_at', 'updated_at')
+    list_display = ('id', 'status', 'fetch_mode', 'proxy_selection', 'screenshot_mode', 'follow_links', 'urls_total', 'urls_processed', 'rate_limit_hits', 'current_rate', 'supervisor_id', 'heartbeat_at', 'created_at')
+    list_filter = ('status', 'fetch_mode', 'screenshot_mode', 'follow_links')
+    readonly_fields = ('created_at', 'updated_at', 'supervisor_id', 'heartbeat_at')
 
 @admin.register(CrawledURL)
 class CrawledURLAdmin(admin.ModelAdmin):
-    list_display = ('url', 'job', 'status_code', 'crawled_at', 'retry_count')
-    list_filter = ('status_code', 'crawled_at', 'job')
+    list_display = ('url', 'job', 'depth', 'status_code', 'fetched_via', 'crawled_at', 'retry_count', 'unchanged')
+    list_filter = ('status_code', 'fetched_via', 'unchanged', 'depth', 'crawled_at', 'job')
     search_fields = ('url',)
-    readonly_fields = ('content_hash',)
+    readonly_fields = ('content_hash', 'page', 'url_key')
+
+@admin.register(PageBlob)
+class PageBlobAdmin(admin.ModelAdmin):
+    list_display = ('key', 'size', 'created_at')
+    exclude = ('data',)
+    readonly_fields = ('key', 'size', 'created_at')
 
 @admin.register(CrawlStats)
 class CrawlStatsAdmin(admin.ModelAdmin):
-    list_display = ('job', 'successful_requests', 'failed_requests', 'blocked_proxies_count', 'avg_response_time')
-    readonly_fields = ('successful_requests', 'failed_requests', 'avg_response_time')
+    list_display = ('job', 'successful_requests', 'failed_requests', 'blocked_proxies_count', 'blocked_requests', 'block_pages', 'unchanged_requests', 'avg_response_time')
+    readonly_fields = ('successful_requests', 'failed_requests', 'avg_response_time', 'response_time_total', 'response_count',
+                       'blocked_requests', 'blocked_bytes', 'unchanged_requests', 'block_pages')
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from django.conf import settings
+from playwright.async_api import async_playwright
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PooledBrowser:
+    """A Chromium instance owned by the pool plus its usage counters"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.active_contexts = 0
+        self.pages_served = 0
+        self.last_used = time.monotonic()
+        self.retiring = False
+
+    @property
+    def is_alive(self):
+        return self.browser.is_connected()
+
+
+class BrowserPool:
+    """
+    Pool of long-lived Chromium browsers shared by crawler workers.
+
+    Browsers are launched once and reused; every URL gets its own fresh
+    BrowserContext with the proxy configured at context level. A browser is
+    recycled after it has served `max_pages` contexts or has been idle for
+    `idle_timeout` seconds.
+    """
+
+    # Chromium only honours per-context proxies if the browser itself was
+    # launched with a proxy, so we launch with a placeholder server
+    PER_CONTEXT_PROXY = {"server": "http://per-context"}
+
+    def __init__(self, size=None, max_pages=None, idle_timeout=None, headless=True, job_id=None):
+        self.size = max(1, size or getattr(settings, 'CRAWLER_BROWSER_POOL_SIZE', 2))
+        self.max_pages = max_pages or getattr(settings, 'CRAWLER_BROWSER_MAX_PAGES', 100)
+        self.idle_timeout = idle_timeout or getattr(settings, 'CRAWLER_BROWSER_IDLE_TIMEOUT', 300)
+        self.headless = headless
+        self.job_label = job_id or 'shared'  # Job of the pool in the metrics, unless jobs share it
+        self._playwright = None
+        self._browsers = []
+        self._contexts = {}  # BrowserContext -> PooledBrowser
+        self._lock = asyncio.Lock()
+        self._reaper_task = None
+        self._closed = False
+
+    @property
+    def open_browsers(self):
+        return len(self._browsers)
+
+    async def start(self):
+        """Start Playwright and the idle reaper (browsers are launched lazily)"""
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+            self._closed = False
+            self._reaper_task = asyncio.create_task(self._reap_idle_browsers())
+            metrics.track('crawler_browsers_open', lambda: len(self._browsers), job=self.job_label)
+            logger.info(f"Browser pool started (size={self.size}, max_pages={self.max_pages}, "
+                        f"idle_timeout={self.idle_timeout}s)")
+        return self
+
+    async def close(self):
+        """Close every browser and stop Playwright"""
+        self._closed = True
+        metrics.untrack('crawler_browsers_open', job=self.job_label)
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+
+        async with self._lock:
+            browsers, self._browsers = self._browsers, []
+            for pooled in browsers:
+                await self._close_browser(pooled)
+            self._contexts.clear()
+
+            if self._playwright:
+                await self._playwright.stop()
+                self._playwright = None
+        logger.info("Browser pool closed")
+
+    async def acquire_context(self, proxy=None, **context_options):
+        """Create a fresh BrowserContext on the least loaded browser"""
+        if self._playwright is None:
+            await self.start()
+
+        async with self._lock:
+            pooled = await self._pick_browser()
+            pooled.active_contexts += 1
+            pooled.last_used = time.monotonic()
+
+        try:
+            if proxy:
+                context_options['proxy'] = proxy
+            context = await pooled.browser.new_context(**context_options)
+        except Exception:
+            async with self._lock:
+                pooled.active_contexts -= 1
+                await self._retire_if_done(pooled)
+            raise
+
+        self._contexts[context] = pooled
+        return context
+
+    async def release_context(self, context):
+        """Close a context and recycle its browser if it is due"""
+        pooled = self._contexts.pop(context, None)
+        try:
+            await context.close()
+        except Exception as e:
+            logger.warning(f"Error closing browser context: {str(e)}")
+
+        if pooled is None:
+            return
+
+        async with self._lock:
+            pooled.active_contexts -= 1
+            pooled.pages_served += 1
+            pooled.last_used = time.monotonic()
+            if pooled.pages_served >= self.max_pages:
+                pooled.retiring = True
+            await self._retire_if_done(pooled)
+
+    async def _pick_browser(self):
+        """Return a usable browser, launching a new one while under the pool size"""
+        # Forget browsers that crashed or were disconnected
+        for pooled in [b for b in self._browsers if not b.is_alive]:
+            logger.warning("Dropping disconnected browser from pool")
+            self._browsers.remove(pooled)
+
+        candidates = [b for b in self._browsers if not b.retiring]
+        idle = [b for b in candidates if b.active_contexts == 0]
+
+        if not idle and len(self._browsers) < self.size:
+            return await self._launch_browser()
+
+        if not candidates:
+            # Every browser is retiring but still busy; add one above the limit
+            # rather than stall until one of them drains
+            return await self._launch_browser()
+
+        return min(candidates, key=lambda b: b.active_contexts)
+
+    async def _launch_browser(self):
+        browser = await self._playwright.chromium.launch(
+            headless=self.headless,
+            proxy=self.PER_CONTEXT_PROXY
+        )
+        pooled = PooledBrowser(browser)
+        self._browsers.append(pooled)
+        logger.info(f"Launched pooled browser ({len(self._browsers)}/{self.size} open)")
+        return pooled
+
+    async def _retire_if_done(self, pooled):
+        if pooled.retiring and pooled.active_contexts == 0 and pooled in self._browsers:
+            self._browsers.remove(pooled)
+            await self._close_browser(pooled)
+            logger.info(f"Recycled browser after {pooled.pages_served} pages")
+
+    async def _close_browser(self, pooled):
+        try:
+            await pooled.browser.close()
+        except Exception as e:
+            logger.warning(f"Error closing pooled browser: {str(e)}")
+
+    async def _reap_idle_browsers(self):
+        """Close browsers that have had no contexts for longer than the idle timeout"""
+        interval = max(1, self.idle_timeout / 2)
+        while not self._closed:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            async with self._lock:
+                for pooled in list(self._browsers):
+                    if pooled.active_contexts == 0 and now - pooled.last_used >= self.idle_timeout:
+                        self._browsers.remove(pooled)
+                        await self._close_browser(pooled)
+                        logger.info("Closed idle pooled browser")
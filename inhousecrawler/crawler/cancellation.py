@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def control_dir():
+    """Directory through which the web process and crawler processes signal each other"""
+    return str(getattr(settings, 'CRAWLER_CONTROL_DIR', os.path.join(settings.BASE_DIR, 'run')))
+
+
+def kill_marker(job_id):
+    """Path of the file whose presence tells a job's crawlers to stop"""
+    return os.path.join(control_dir(), f'job-{job_id}.kill')
+
+
+def signal_kill(job_id):
+    """Tell every crawler of a job on this host (or sharing the control directory) to stop now"""
+    os.makedirs(control_dir(), exist_ok=True)
+    with open(kill_marker(job_id), 'w'):
+        pass
+
+
+def clear_kill(job_id):
+    """Let a killed job run again"""
+    try:
+        os.remove(kill_marker(job_id))
+    except FileNotFoundError:
+        pass
+
+
+class JobCancellation:
+    """
+    Kill switch of a job, shared by all of its crawlers in this process.
+
+    CrawlJob.kill() drops a marker file in CRAWLER_CONTROL_DIR; one task per
+    crawler process checks for it every `poll_interval` seconds, which costs a
+    stat() rather than a query, and sets `event`. run() cancels the work it
+    wraps as soon as that happens, so navigations in progress are aborted
+    instead of running to their timeout.
+    """
+
+    def __init__(self, job_id, poll_interval=None):
+        self.job_id = job_id
+        self.poll_interval = poll_interval or getattr(settings, 'CRAWLER_KILL_POLL_SECONDS', 0.5)
+        self.path = kill_marker(job_id)
+        self.event = asyncio.Event()
+        self._task = None
+
+    @property
+    def is_set(self):
+        return self.event.is_set()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self):
+        while not self.event.is_set():
+            if os.path.exists(self.path):
+                logger.info(f"Job {self.job_id} was killed")
+                self.event.set()
+                break
+            await asyncio.sleep(self.poll_interval)
+
+    async def run(self, awaitable):
+        """
+        Await `awaitable` unless the job is killed first, in which case it is
+        cancelled and None is returned
+        """
+        work = asyncio.ensure_future(awaitable)
+        killed = asyncio.create_task(self.event.wait())
+        try:
+            await asyncio.wait({work, killed}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # We are being stopped ourselves: stop the work too, and let it clean up
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            raise
+        finally:
+            killed.cancel()
+        if work.done():
+            return work.result()
+
+        work.cancel()
+        try:
+            await work
+        except asyncio.CancelledError:
+            pass
+        logger.info(f"Stopped the crawl of job {self.job_id} in progress")
+        return None
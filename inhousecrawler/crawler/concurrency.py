@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass
+from django.conf import settings
+from django.utils import timezone
+from .scheduler import registrable_domain
+
+logger = logging.getLogger(__name__)
+
+MAX_LOGGED_CHANGES = 50  # Limit changes kept in the job stats
+
+
+class AIMDLimit:
+    """
+    A limit on requests in flight that grows by one while requests go well
+    and is cut by a factor when they time out or get blocked.
+
+    Every change starts a new epoch. Outcomes of requests started in an
+    earlier epoch are ignored, so a burst of failures from requests that
+    were already in flight cuts the limit once, not once per failure.
+    """
+
+    def __init__(self, name, initial, minimum, maximum):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = max(self.minimum, min(self.maximum, initial))
+        self.in_flight = 0
+        self.epoch = 0
+        self.saturated = False  # The limit was reached this epoch, so raising it could help
+        self.latencies = []
+        self.failures = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self.saturated = True
+        return self.epoch
+
+    async def release(self):
+        async with self._changed:
+            self.in_flight -= 1
+            self._changed.notify_all()
+
+    async def set_limit(self, limit):
+        async with self._changed:
+            self.limit = limit
+            self.epoch += 1
+            self.saturated = False
+            self.latencies = []
+            self.failures = 0
+            # A higher limit lets waiting requests start right away
+            self._changed.notify_all()
+
+
+@dataclass
+class Slot:
+    """Permission to run one request, from acquire() to release()"""
+    domain: str
+    job_epoch: int
+    domain_epoch: int
+
+
+class ConcurrencyController:
+    """
+    Adaptive limits on the requests a job has in flight, overall and per
+    registrable domain.
+
+    Each limit grows by one after `window` requests in a row with a p95
+    latency under `target_latency` and a failure rate under
+    `target_error_rate`, provided it was actually reached; a window that
+    misses the targets multiplies it by `backoff`. A timeout or a block page
+    also cuts the limit of its domain at once, but counts against the job's
+    limit only as a failure in the window, so one struggling site does not
+    throttle the others. Changes are logged, and kept on the job stats
+    through the write buffer.
+    """
+
+    def __init__(self, maximum, initial=None, domain_initial=None, domain_maximum=None, minimum=1,
+                 target_latency=None, target_error_rate=None, window=None, backoff=None, on_change=None):
+        self.job = AIMDLimit('job', initial or getattr(settings, 'CRAWLER_CONCURRENCY_INITIAL', 2), minimum, maximum)
+        self.minimum = minimum
+        self.domain_initial = domain_initial or getattr(settings, 'CRAWLER_DOMAIN_CONCURRENCY_INITIAL', 2)
+        self.domain_maximum = domain_maximum or getattr(settings, 'CRAWLER_DOMAIN_CONCURRENCY_MAX', 8)
+        self.target_latency = target_latency or getattr(settings, 'CRAWLER_CONCURRENCY_TARGET_P95', 15.0)
+        self.target_error_rate = (target_error_rate if target_error_rate is not None
+                                  else getattr(settings, 'CRAWLER_CONCURRENCY_TARGET_ERROR_RATE', 0.1))
+        self.window = window or getattr(settings, 'CRAWLER_CONCURRENCY_WINDOW', 20)
+        self.backoff = backoff or getattr(settings, 'CRAWLER_CONCURRENCY_BACKOFF', 0.5)
+        self.on_change = on_change
+        self.domains = {}  # registrable domain -> AIMDLimit
+        self.changes = deque(maxlen=MAX_LOGGED_CHANGES)
+
+    def _domain_limit(self, domain):
+        limit = self.domains.get(domain)
+        if limit is None:
+            limit = self.domains[domain] = AIMDLimit(domain, self.domain_initial, self.minimum,
+                                                     min(self.domain_maximum, self.job.maximum))
+        return limit
+
+    async def acquire(self, url):
+        """Wait until the job and the URL's domain both have room for another request"""
+        domain = registrable_domain(url)
+        # The domain first, so requests waiting on a busy site do not hold job slots
+        domain_epoch = await self._domain_limit(domain).acquire()
+        job_epoch = await self.job.acquire()
+        return Slot(domain, job_epoch, domain_epoch)
+
+    async def release(self, slot, latency, outcome):
+        """
+        Hand back a slot with how its request went: 'success', 'error',
+        'timeout' or 'block', or None when the outcome says nothing about the
+        site (no proxy was free, the job was stopped).
+        """
+        domain_limit = self.domains[slot.domain]
+        await domain_limit.release()
+        await self.job.release()
+        if outcome is not None:
+            await self._observe(domain_limit, slot.domain_epoch, latency, outcome, immediate=True)
+            await self._observe(self.job, slot.job_epoch, latency, outcome, immediate=False)
+
+    async def _observe(self, limit, epoch, latency, outcome, immediate):
+        if epoch != limit.epoch:
+            return
+
+        if immediate and outcome in ('timeout', 'block'):
+            await self._change(limit, int(limit.limit * self.backoff), outcome)
+            return
+
+        if outcome == 'success':
+            limit.latencies.append(latency)
+        else:
+            limit.failures += 1
+        samples = len(limit.latencies) + limit.failures
+        if samples < self.window:
+            return
+
+        latencies = sorted(limit.latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else None
+        error_rate = limit.failures / samples
+        if p95 is None or p95 > self.target_latency or error_rate > self.target_error_rate:
+            await self._change(limit, int(limit.limit * self.backoff),
+                               f"p95 {p95 or 0:.1f}s, {error_rate:.0%} failed")
+        elif limit.saturated:
+            await self._change(limit, limit.limit + 1, f"p95 {p95:.1f}s, {error_rate:.0%} failed")
+        else:
+            # On target but the limit was never reached: keep it and start a new window
+            await limit.set_limit(limit.limit)
+
+    async def _change(self, limit, new_limit, reason):
+        old_limit = limit.limit
+        new_limit = max(limit.minimum, min(limit.maximum, new_limit))
+        await limit.set_limit(new_limit)
+        if new_limit == old_limit:
+            return
+
+        logger.info(f"Concurrency for {limit.name} changed from {old_limit} to {new_limit} ({reason})")
+        self.changes.append({
+            'at': timezone.now().isoformat(),
+            'scope': limit.name,
+            'from': old_limit,
+            'to': new_limit,
+            'reason': reason,
+        })
+        if self.on_change:
+            self.on_change(self)
+
+    @property
+    def log_json(self):
+        return json.dumps(list(self.changes))
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .metrics import metrics
+from .models import CrawledURL
+
+logger = logging.getLogger(__name__)
+
+
+def make_worker_id():
+    """Identify this crawler process in URL leases"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkDispatcher:
+    """
+    Hands out the URLs of a job to workers exactly once.
+
+    The frontier is leased from the database in batches and served through
+    an asyncio.Queue. Leases are renewed while URLs are queued or in flight
+    and released once they complete, so several crawler processes, on one
+    or many hosts, can share a job without crawling a URL twice. URLs held
+    by a crashed process become claimable again when their lease expires.
+
+    In-flight, done and failed URL ids are tracked in memory. URLs that time
+    out are held back and served once more, with `is_retry` set, after the
+    first pass over the frontier is finished.
+
+    `before_release` is awaited before any lease is released, so buffered
+    results of those URLs reach the database before another process can
+    claim them.
+
+    With `grows` set (link-following jobs), every successful URL may have
+    added new ones, so the frontier is claimed from again after each and
+    `before_release` is awaited before claiming, to write the new URLs first.
+    """
+
+    def __init__(self, job_id, chunk_size=None, worker_id=None, before_release=None, grows=False):
+        self.job_id = job_id
+        self.chunk_size = chunk_size or getattr(settings, 'CRAWLER_DISPATCH_CHUNK_SIZE', 100)
+        self.lease_seconds = getattr(settings, 'CRAWLER_LEASE_SECONDS', 180)
+        self.max_attempts = getattr(settings, 'CRAWLER_MAX_URL_ATTEMPTS', 3)
+        self.worker_id = worker_id or make_worker_id()
+        self.before_release = before_release
+        self.grows = grows
+        self.queue = asyncio.Queue()
+        self.in_flight = set()
+        self.done = set()
+        self.failed = set()
+        self._held = set()  # Ids we hold a lease on
+        self._to_release = set()
+        self._retries = deque()
+        self._retried = set()
+        self._exhausted = False
+        self._completions = 0  # Successful URLs so far; in growing jobs each may have added URLs
+        self._load_lock = asyncio.Lock()
+        self._changed = asyncio.Condition()
+        self._heartbeat_task = None
+
+    @property
+    def drained(self):
+        return (self._exhausted and self.queue.empty() and not self._retries
+                and not self.in_flight)
+
+    async def start(self):
+        """Start renewing our leases in the background"""
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+            metrics.track('crawler_queue_depth', self.queue.qsize, job=self.job_id)
+            metrics.track('crawler_pages_in_flight', lambda: len(self.in_flight), job=self.job_id)
+        return self
+
+    async def close(self):
+        """Stop the heartbeat and hand back every lease we still hold"""
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+            metrics.untrack('crawler_queue_depth', job=self.job_id)
+            metrics.untrack('crawler_pages_in_flight', job=self.job_id)
+        if self.before_release:
+            await self.before_release()
+        await self._release(self._held | self._to_release)
+        self._held.clear()
+        self._to_release.clear()
+
+    @sync_to_async
+    def _claim_chunk(self):
+        return CrawledURL.objects.claim_batch(
+            self.job_id, self.worker_id, self.chunk_size,
+            self.lease_seconds, max_attempts=self.max_attempts
+        )
+
+    @sync_to_async
+    def _others_hold_leases(self):
+        return CrawledURL.objects.leased_to_others(self.job_id, self.worker_id).exists()
+
+    @sync_to_async
+    def _renew(self, ids):
+        CrawledURL.objects.renew_leases(self.worker_id, ids, self.lease_seconds)
+
+    @sync_to_async
+    def _release(self, ids):
+        if ids:
+            CrawledURL.objects.release_leases(self.worker_id, ids)
+
+    async def _heartbeat(self):
+        """Renew held leases and release completed ones, a few times per lease period"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                to_release, self._to_release = self._to_release, set()
+                if to_release and self.before_release:
+                    await self.before_release()
+                await self._release(to_release)
+                if self._held:
+                    await self._renew(list(self._held))
+            except Exception as e:
+                logger.error(f"Error renewing leases for job {self.job_id}: {str(e)}")
+
+    async def _load_chunk(self):
+        async with self._load_lock:
+            # Another worker may have loaded a chunk while we waited for the lock
+            if not self.queue.empty() or self._exhausted:
+                return
+
+            completions = self._completions
+            if self.grows and self.before_release:
+                await self.before_release()
+            urls = await self._claim_chunk()
+            if not urls:
+                # Nothing left to claim; URLs leased to other processes may
+                # still come back if those processes die, so keep waiting
+                if await self._others_hold_leases():
+                    await asyncio.sleep(min(30, self.lease_seconds / 3))
+                elif not self.grows or completions == self._completions:
+                    # Unless a URL completed during the claim, adding URLs it could not see
+                    self._exhausted = True
+                return
+
+            for url in urls:
+                self._held.add(url.id)
+                # URLs left in a retry state by an earlier run go straight to the retry pass
+                if url.retry_status == 'pending':
+                    self.queue.put_nowait((url, False))
+                else:
+                    self._retried.add(url.id)
+                    self.queue.put_nowait((url, True))
+
+            logger.debug(f"Dispatcher {self.worker_id} claimed {len(urls)} URLs of job {self.job_id}")
+
+    async def next(self):
+        """
+        Get the next URL to crawl.
+
+        Returns a (CrawledURL, is_retry) tuple, or None once every URL has
+        been handed out and completed.
+        """
+        while True:
+            # Start the retry pass once nothing else is left to claim
+            if self.queue.empty() and self._exhausted:
+                while self._retries:
+                    self.queue.put_nowait((self._retries.popleft(), True))
+
+            if self.queue.empty() and not self._exhausted:
+                await self._load_chunk()
+                continue
+
+            if not self.queue.empty():
+                crawled_url, is_retry = self.queue.get_nowait()
+                self.in_flight.add(crawled_url.id)
+                return crawled_url, is_retry
+
+            if self.drained:
+                return None
+
+            # Wait for an in-flight URL to complete; it may be re-queued for retry
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: not self.in_flight or self._retries or not self.queue.empty() or not self._exhausted
+                )
+
+    async def complete(self, crawled_url, success, retry=False):
+        """
+        Record the outcome of a crawl.
+
+        A failed URL is scheduled for one retry pass when `retry` is set and it
+        has not been retried already; otherwise it is recorded as failed and
+        its lease is released.
+        """
+        self.in_flight.discard(crawled_url.id)
+
+        if retry and not success and crawled_url.id not in self._retried:
+            # Keep the lease until the retry pass has run
+            self._retried.add(crawled_url.id)
+            self._retries.append(crawled_url)
+        else:
+            if success:
+                self.done.add(crawled_url.id)
+                self.failed.discard(crawled_url.id)
+            else:
+                self.failed.add(crawled_url.id)
+            self._held.discard(crawled_url.id)
+            self._to_release.add(crawled_url.id)
+
+        if success and self.grows:
+            # The page's links may have joined the frontier
+            self._completions += 1
+            self._exhausted = False
+
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def requeue(self, crawled_url, is_retry=False):
+        """Put a URL that was handed out back in the queue, for one not attempted or to be tried again now"""
+        self.in_flight.discard(crawled_url.id)
+        self.queue.put_nowait((crawled_url, is_retry))
+
+        async with self._changed:
+            self._changed.notify_all()
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from urllib.parse import urljoin
+from django.conf import settings
+from django.utils import timezone
+from lxml import etree
+from lxml import html as lxml_html
+from .fingerprints import simhash
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Elements whose text is never visible
+INVISIBLE_TAGS = {'script', 'style', 'noscript', 'template', 'head', 'title', 'svg', 'iframe', 'object'}
+HIDDEN_STYLE_PATTERN = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+
+
+# Extracts the page HTML and every structured content field in a single
+# evaluate, for CRAWLER_EXTRACT_IN_BROWSER. Visible text comes from
+# innerText, which the browser computes from the layout it already has,
+# instead of calling getComputedStyle per element.
+PAGE_EXTRACTION_SCRIPT = r"""(limits) => {
+    const html = (document.doctype ? new XMLSerializer().serializeToString(document.doctype) : '')
+        + (document.documentElement ? document.documentElement.outerHTML : '');
+
+    const meta = {};
+    for (const tag of document.querySelectorAll('meta')) {
+        const name = tag.getAttribute('name') || tag.getAttribute('property');
+        const content = tag.getAttribute('content');
+        if (name && content) {
+            meta[name] = content;
+        }
+    }
+
+    const body = document.body;
+    const text = body ? (body.innerText || body.textContent || '') : '';
+
+    const links = [];
+    for (const a of document.querySelectorAll('a[href]')) {
+        if (links.length >= limits.links) break;
+        links.push({text: a.textContent.trim(), href: a.href, title: a.title || ''});
+    }
+
+    const images = [];
+    for (const img of document.querySelectorAll('img')) {
+        if (images.length >= limits.images) break;
+        images.push({src: img.src, alt: img.alt || '', width: img.width, height: img.height});
+    }
+
+    const tables = [];
+    for (const table of document.querySelectorAll('table')) {
+        if (tables.length >= limits.tables) break;
+        const rows = [];
+        for (const row of table.querySelectorAll('tr')) {
+            if (rows.length >= limits.table_rows) break;
+            rows.push(Array.from(row.querySelectorAll('td, th'), cell => cell.textContent.trim()));
+        }
+        tables.push(rows);
+    }
+
+    return {
+        html: html,
+        title: document.title,
+        url: location.href,
+        text_content: text.replace(/\s+/g, ' ').trim(),
+        meta: meta,
+        links: links,
+        images: images,
+        tables: tables,
+    };
+}"""
+
+
+def extraction_limits():
+    """Caps on the links, images, tables and table rows kept per page"""
+    return {
+        'links': getattr(settings, 'CRAWLER_EXTRACT_MAX_LINKS', 2000),
+        'images': getattr(settings, 'CRAWLER_EXTRACT_MAX_IMAGES', 500),
+        'tables': getattr(settings, 'CRAWLER_EXTRACT_MAX_TABLES', 50),
+        'table_rows': getattr(settings, 'CRAWLER_EXTRACT_MAX_TABLE_ROWS', 1000),
+    }
+
+
+def _clean(text):
+    return WHITESPACE_PATTERN.sub(' ', text or '').strip()
+
+
+def _to_int(value):
+    try:
+        return int(str(value).strip().rstrip('px'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _is_hidden(element):
+    return (
+        element.tag in INVISIBLE_TAGS
+        or element.get('hidden') is not None
+        or bool(HIDDEN_STYLE_PATTERN.search(element.get('style') or ''))
+    )
+
+
+def _visible_text(root):
+    """Text outside invisible elements, in document order (iterative, so deep DOMs are fine)"""
+    parts = []
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        # Comments and processing instructions have no visible text, but their tails do
+        if not isinstance(item.tag, str) or _is_hidden(item):
+            continue
+        if item.text:
+            parts.append(item.text)
+        for child in reversed(item):
+            if child.tail:
+                stack.append(child.tail)
+            stack.append(child)
+    return _clean(' '.join(parts))
+
+
+def _parse(html):
+    if not html or not html.strip():
+        return None
+    # lxml rejects str input carrying an XML encoding declaration, so hand it bytes
+    parser = lxml_html.HTMLParser(encoding='utf-8')
+    try:
+        return lxml_html.document_fromstring(html.encode('utf-8', 'replace'), parser=parser)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _extract(html, url, limits):
+    """
+    Structured content of an HTML document, without the timestamp.
+
+    Runs in extraction pool processes, so it only depends on its arguments.
+    """
+    data = {
+        'title': '',
+        'url': url,
+        'text_content': '',
+        'meta': {},
+        'links': [],
+        'images': [],
+        'tables': [],
+    }
+    doc = _parse(html)
+    if doc is None:
+        return data
+
+    base_url = url
+    base = doc.find('.//base[@href]')
+    if base is not None:
+        base_url = urljoin(url, base.get('href'))
+
+    title = doc.find('.//title')
+    if title is not None:
+        data['title'] = _clean(title.text_content())
+
+    for tag in doc.iter('meta'):
+        name = tag.get('name') or tag.get('property')
+        if name and tag.get('content'):
+            data['meta'][name] = tag.get('content')
+
+    data['text_content'] = _visible_text(doc)
+
+    for a in islice((a for a in doc.iter('a') if a.get('href') is not None), limits['links']):
+        data['links'].append({
+            'text': _clean(a.text_content()),
+            'href': urljoin(base_url, a.get('href')),
+            'title': a.get('title') or '',
+        })
+
+    for img in islice(doc.iter('img'), limits['images']):
+        data['images'].append({
+            'src': urljoin(base_url, img.get('src')) if img.get('src') else '',
+            'alt': img.get('alt') or '',
+            'width': _to_int(img.get('width')),
+            'height': _to_int(img.get('height')),
+        })
+
+    # Rows and cells include nested ones, like querySelectorAll in the browser script
+    for table in islice(doc.iter('table'), limits['tables']):
+        data['tables'].append([
+            [_clean(cell.text_content()) for cell in row.iter('td', 'th')]
+            for row in islice(table.iter('tr'), limits['table_rows'])
+        ])
+
+    return data
+
+
+def _extract_with_fingerprint(html, url, limits):
+    data = _extract(html, url, limits)
+    return data, simhash(data['text_content'])
+
+
+def _with_timestamp(data):
+    return {
+        'title': data['title'],
+        'url': data['url'],
+        'timestamp': timezone.now().isoformat(),
+        'text_content': data['text_content'],
+        'meta': data['meta'],
+        'links': data['links'],
+        'images': data['images'],
+        'tables': data['tables'],
+    }
+
+
+def extract_structured_content(html, url):
+    """
+    Build structured content from raw HTML without a browser.
+
+    Produces the same shape as CrawlerService._extract_content: title, url,
+    timestamp, text_content, meta, links, images and tables. Visibility is
+    judged from markup only (hidden attributes and inline styles), since no
+    stylesheet is applied.
+    """
+    return _with_timestamp(_extract(html, url, extraction_limits()))
+
+
+_pool = None
+
+
+def get_extraction_pool():
+    """The process pool shared by every crawler in this process"""
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: crawler processes run threads and an event loop
+        _pool = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'CRAWLER_EXTRACT_PROCESSES', None),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _pool
+
+
+def shutdown_extraction_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def extract_many_in_pool(pages):
+    """
+    (structured content, text fingerprint) of (html, url) pairs, parsed in
+    parallel on the pool, in input order
+    """
+    limits = extraction_limits()
+    htmls = [html for html, _ in pages]
+    urls = [url for _, url in pages]
+    return [
+        (_with_timestamp(data), fingerprint)
+        for data, fingerprint in get_extraction_pool().map(_extract_with_fingerprint, htmls, urls, [limits] * len(pages))
+    ]
+
+
+async def _run_in_pool(func, *args):
+    global _pool
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A worker died (out of memory on a huge page, killed...); start a new pool next time
+        logger.error(f"Extraction pool broke running {func.__name__}, running it in a thread")
+        # Its management thread and surviving workers go with it
+        pool.shutdown(wait=False, cancel_futures=True)
+        if _pool is pool:
+            _pool = None
+        return await asyncio.to_thread(func, *args)
+
+
+async def extract_in_pool(html, url):
+    """
+    extract_structured_content on a pool process, keeping parsing off the
+    event loop; returns the structured content and the SimHash of its text
+    """
+    data, fingerprint = await _run_in_pool(_extract_with_fingerprint, html, url, extraction_limits())
+    return _with_timestamp(data), fingerprint
+
+
+async def fingerprint_in_pool(text):
+    """SimHash of text extracted elsewhere (in the browser), computed on a pool process"""
+    return await _run_in_pool(simhash, text)
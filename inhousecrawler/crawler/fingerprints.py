@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import re
+from collections import Counter, defaultdict, deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r'\w+')
+DIGIT_PATTERN = re.compile(r'\d')
+SHINGLE_SIZE = 3
+MASK = (1 << 64) - 1
+
+
+def _to_signed(value):
+    # BigIntegerField is a signed 64-bit column
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def simhash(text):
+    """
+    64-bit SimHash of a page's text, over word 3-shingles weighted by count.
+
+    Words with digits in them (request ids, timestamps, counters) are all
+    treated as the same word, and pages that differ in only a few other
+    words get fingerprints a few bits apart. Returns a signed integer for
+    storage in a BigIntegerField, or None for pages without text.
+    """
+    words = [
+        '#' if DIGIT_PATTERN.search(word) else word
+        for word in WORD_PATTERN.findall((text or '').lower())
+    ]
+    if not words:
+        return None
+    shingles = Counter(
+        ' '.join(words[i:i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    )
+
+    # One 64-character bit string per shingle occurrence; bit columns are then
+    # counted with string slicing rather than a Python loop per bit
+    bits = ''.join(
+        format(int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big'), '064b') * count
+        for shingle, count in shingles.items()
+    )
+    total = len(bits) // 64
+
+    value = 0
+    for column in range(64):
+        if bits[column::64].count('1') * 2 > total:
+            value |= 1 << (63 - column)
+    return _to_signed(value)
+
+
+def hamming_distance(a, b):
+    return ((a ^ b) & MASK).bit_count()
+
+
+class BlockPageIndex:
+    """
+    Fingerprints of the block pages seen during a job, per registrable domain.
+
+    A page is learned as a block page when the crawler says so (challenge
+    markers, blocking status codes), or when short, near-identical text
+    comes back for `min_urls` different URLs of the same domain, which
+    real pages rarely do. Later pages within `threshold` bits of a learned
+    fingerprint are block pages too, whatever token or timestamp they carry.
+    """
+
+    def __init__(self, threshold=None, min_urls=None, max_chars=None, max_per_domain=50):
+        self.threshold = threshold if threshold is not None else getattr(settings, 'CRAWLER_SIMHASH_THRESHOLD', 3)
+        self.min_urls = min_urls or getattr(settings, 'CRAWLER_BLOCK_PAGE_MIN_URLS', 3)
+        self.max_chars = max_chars or getattr(settings, 'CRAWLER_BLOCK_PAGE_MAX_CHARS', 2000)
+        self.max_per_domain = max_per_domain
+        self._blocks = defaultdict(lambda: deque(maxlen=self.max_per_domain))  # domain -> fingerprints
+        self._candidates = defaultdict(lambda: deque(maxlen=self.max_per_domain))  # domain -> [fingerprint, url ids]
+
+    def _near(self, fingerprints, fingerprint):
+        return any(hamming_distance(f, fingerprint) <= self.threshold for f in fingerprints)
+
+    def matches(self, domain, fingerprint):
+        """Whether a page is near a known block page of its domain"""
+        return fingerprint is not None and self._near(self._blocks[domain], fingerprint)
+
+    def add(self, domain, fingerprint):
+        """Learn a block page"""
+        if fingerprint is not None and not self.matches(domain, fingerprint):
+            self._blocks[domain].append(fingerprint)
+            logger.info(f"Learned a block page fingerprint for {domain}")
+
+    def observe(self, domain, url_id, fingerprint, text_length):
+        """
+        Track a page that looked fine; returns True once its short text has been
+        seen on enough different URLs of the domain to be a block page
+        """
+        if fingerprint is None or text_length > self.max_chars:
+            return False
+
+        for candidate in self._candidates[domain]:
+            if hamming_distance(candidate[0], fingerprint) <= self.threshold:
+                candidate[1].add(url_id)
+                if len(candidate[1]) >= self.min_urls:
+                    self._candidates[domain].remove(candidate)
+                    self.add(domain, fingerprint)
+                    return True
+                return False
+
+        self._candidates[domain].append([fingerprint, {url_id}])
+        return False
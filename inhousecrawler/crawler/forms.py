@@ -1,12 +1,11 @@
 from django import forms
+import re
+from .frontier import compile_patterns
 from .models import CrawlJob
 from .services import WebshareProxyService
 
-class URLSubmissionForm(forms.Form):
-    urls = forms.CharField(
-        widget=forms.Textarea(attrs={'rows': 10, 'placeholder': 'Enter URLs, one per line'}),
-        help_text='Enter one URL per line'
-    )
+class JobOptionsForm(forms.Form):
+    """Settings of a new crawl job; the URLs are submitted separately"""
     
     proxy_countries = forms.MultipleChoiceField(
         required=False,
@@ -21,6 +20,90 @@ class URLSubmissionForm(forms.Form):
         help_text='Enable round-robin proxy rotation. Useful for large sites to avoid detection.'
     )
     
+    proxy_selection = forms.ChoiceField(
+        choices=CrawlJob.PROXY_SELECTION_CHOICES,
+        initial='lru',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        help_text='Health Scored prefers proxies with fewer failures, timeouts and blocks and lower latency.'
+    )
+    
+    fetch_mode = forms.ChoiceField(
+        choices=CrawlJob.FETCH_MODE_CHOICES,
+        initial='browser',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        help_text='Auto fetches pages over plain HTTP and only opens a browser for JavaScript apps and challenge pages.'
+    )
+    
+    follow_links = forms.BooleanField(
+        required=False,
+        initial=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        help_text='Also crawl links to the same sites found on crawled pages.'
+    )
+    
+    max_depth = forms.IntegerField(
+        required=False,
+        initial=2,
+        min_value=1,
+        max_value=20,
+        widget=forms.NumberInput(attrs={'class': 'form-control'}),
+        help_text='Links followed at most this far from the submitted URLs'
+    )
+    
+    max_pages = forms.IntegerField(
+        required=False,
+        min_value=1,
+        widget=forms.NumberInput(attrs={'class': 'form-control'}),
+        help_text='Stop adding links once the job has this many URLs (optional)'
+    )
+    
+    include_patterns = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 2, 'class': 'form-control', 'placeholder': r'/blog/'}),
+        help_text='Regular expressions, one per line; only links matching one are followed'
+    )
+    
+    exclude_patterns = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 2, 'class': 'form-control', 'placeholder': r'/(login|cart)\b'}),
+        help_text='Regular expressions, one per line; links matching any are not followed'
+    )
+    
+    blocked_resource_types = forms.MultipleChoiceField(
+        required=False,
+        choices=[
+            ('image', 'Images'),
+            ('font', 'Fonts'),
+            ('media', 'Audio/Video'),
+            ('stylesheet', 'Stylesheets'),
+        ],
+        widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
+        help_text='Resource types the browser should not download. Leave empty to block images, fonts and media '
+                  'unless the job takes screenshots. Analytics and ad trackers are always blocked.'
+    )
+    
+    screenshot_mode = forms.ChoiceField(
+        choices=CrawlJob.SCREENSHOT_MODE_CHOICES,
+        initial='on_failure',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        help_text='Full-page screenshots of every URL are slow; On Failure only captures pages that failed.'
+    )
+    
+    screenshot_format = forms.ChoiceField(
+        choices=CrawlJob.SCREENSHOT_FORMAT_CHOICES,
+        initial='png',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    
+    screenshot_quality = forms.IntegerField(
+        required=False,
+        initial=80,
+        min_value=1,
+        max_value=100,
+        widget=forms.NumberInput(attrs={'class': 'form-control'}),
+        help_text='JPEG quality (1-100)'
+    )
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Dynamically populate country choices
@@ -28,23 +111,51 @@ class URLSubmissionForm(forms.Form):
         country_choices = [(c, c) for c in countries]
         self.fields['proxy_countries'].choices = country_choices
     
-    def clean_urls(self):
-        data = self.cleaned_data['urls']
-        urls = [url.strip() for url in data.split('\n') if url.strip()]
-        
-        if not urls:
-            raise forms.ValidationError("Please enter at least one valid URL")
-        
-        # Basic URL validation
-        for url in urls:
-            if not url.startswith(('http://', 'https://')):
-                raise forms.ValidationError(f"Invalid URL format: {url}. URLs must start with http:// or https://")
-        
-        return urls
-        
+    def _clean_patterns(self, field):
+        """Check every line compiles as a regular expression (None when empty)"""
+        text = self.cleaned_data.get(field) or ''
+        try:
+            compile_patterns(text)
+        except re.error as e:
+            raise forms.ValidationError(f"Invalid pattern: {e}")
+        return text.strip() or None
+    
+    def clean_include_patterns(self):
+        return self._clean_patterns('include_patterns')
+    
+    def clean_exclude_patterns(self):
+        return self._clean_patterns('exclude_patterns')
+    
+    def clean_blocked_resource_types(self):
+        """Convert list of resource types to comma-separated string (None keeps the default policy)"""
+        resource_types = self.cleaned_data.get('blocked_resource_types', [])
+        if resource_types:
+            return ','.join(resource_types)
+        return None
+    
     def clean_proxy_countries(self):
         """Convert list of country codes to comma-separated string"""
         countries = self.cleaned_data.get('proxy_countries', [])
         if countries:
             return ','.join(countries)
-        return None 
\ No newline at end of file
+        return None 
+
+class URLSubmissionForm(JobOptionsForm):
+    """Job settings with the URLs typed in or uploaded as a file"""
+    urls = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 10, 'placeholder': 'Enter URLs, one per line'}),
+        help_text='Enter one URL per line'
+    )
+    
+    urls_file = forms.FileField(
+        required=False,
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control'}),
+        help_text='Or upload a file with one URL per line, or NDJSON. Files of millions of URLs are fine.'
+    )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if not (cleaned_data.get('urls') or '').strip() and not cleaned_data.get('urls_file'):
+            raise forms.ValidationError("Please enter at least one URL or upload a file")
+        return cleaned_data
@@ -0,0 +1,325 @@
+import hashlib
+import logging
+import math
+import re
+import string
+from collections import defaultdict
+from fnmatch import translate
+from functools import lru_cache
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+from django.conf import settings
+from django.db.models import F
+from .scheduler import registrable_domain
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+UNRESERVED = set(string.ascii_letters + string.digits + '-._~')
+ESCAPE_PATTERN = re.compile(r'%([0-9A-Fa-f]{2})')
+PATH_SAFE = "/%:@!$&'()*+,;=~"
+QUERY_SAFE = "/:@!$'()*,;~"
+MASK64 = (1 << 64) - 1
+MAX_URL_LENGTH = 2000  # CrawledURL.url max_length
+
+# Tracking parameters that never change the page served (shell-style patterns)
+DEFAULT_STRIP_QUERY_PARAMS = [
+    'utm_*', 'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_gl', 'ref_src',
+]
+
+
+def _normalize_escapes(part):
+    """Uppercase percent-escapes and decode the ones for unreserved characters"""
+    def fix(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED else '%' + match.group(1).upper()
+    return ESCAPE_PATTERN.sub(fix, part)
+
+
+def _remove_dot_segments(path):
+    segments = path.split('/')
+    output = []
+    for segment in segments:
+        if segment == '.':
+            continue
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+            continue
+        output.append(segment)
+    if segments[-1] in ('.', '..'):
+        output.append('')
+    return '/'.join(output) or '/'
+
+
+@lru_cache(maxsize=16)
+def _strip_pattern(patterns):
+    """One regex matching any of the shell-style parameter name patterns"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(translate(pattern.lower()) for pattern in patterns))
+
+
+def normalize_url(url, strip_params=None):
+    """
+    Canonical form of an http(s) URL, or None for anything else.
+
+    Lowercases the scheme and host, drops default ports and the fragment,
+    resolves dot segments, normalises percent-escapes, and sorts the query
+    parameters by name after removing those matching `strip_params`
+    (CRAWLER_STRIP_QUERY_PARAMS by default).
+    """
+    if strip_params is None:
+        strip_params = getattr(settings, 'CRAWLER_STRIP_QUERY_PARAMS', DEFAULT_STRIP_QUERY_PARAMS)
+
+    try:
+        parts = urlsplit((url or '').strip())
+        port = parts.port
+    except ValueError:
+        return None
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if scheme not in DEFAULT_PORTS or not host:
+        return None
+
+    netloc = f'[{host}]' if ':' in host else host
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{port}'
+    if '@' in parts.netloc:
+        netloc = f"{parts.netloc.rpartition('@')[0]}@{netloc}"
+
+    path = _remove_dot_segments(_normalize_escapes(quote(parts.path or '/', safe=PATH_SAFE)))
+
+    query = ''
+    if parts.query:
+        stripped = _strip_pattern(tuple(strip_params))
+        params = [
+            (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not (stripped and stripped.match(name.lower()))
+        ]
+        # By name only: the order of repeated parameters may matter to the site
+        params.sort(key=lambda param: param[0])
+        query = urlencode(params, quote_via=quote, safe=QUERY_SAFE)
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_key(url):
+    """Hash that identifies a normalized URL within its job"""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class BloomFilter:
+    """Fixed-capacity Bloom filter over 128-bit integer keys"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # Double hashing: the two halves of the key give every probe position
+        first, second = value & MASK64, (value >> 64) | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filter that grows as keys are added, keeping its overall false
+    positive rate under `error_rate`.
+
+    Each new filter has twice the capacity of the one before and half its
+    error rate, so the error rates sum to at most `error_rate` however many
+    filters are added (Almeida et al., Scalable Bloom Filters).
+    """
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, initial_capacity=100000, error_rate=0.0001):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.filters = []
+
+    def __contains__(self, value):
+        return any(value in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    @property
+    def nbytes(self):
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+    def add(self, value):
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            n = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * self.GROWTH ** n,
+                self.error_rate * (1 - self.TIGHTENING) * self.TIGHTENING ** n,
+            ))
+        self.filters[-1].add(value)
+
+
+class SeenURLs:
+    """
+    URL keys a job already has.
+
+    Keys are held exactly, as 64-bit integers, up to `exact_limit`; past
+    that only the scalable Bloom filter, filled all along, is kept, so
+    memory stays at a few bytes per URL for jobs of millions of URLs at the
+    cost of skipping an occasional new URL as already seen.
+    """
+
+    def __init__(self, exact_limit=None, error_rate=None):
+        self.exact_limit = exact_limit or getattr(settings, 'CRAWLER_FRONTIER_EXACT_LIMIT', 200000)
+        self.exact = set()
+        self.bloom = ScalableBloomFilter(
+            error_rate=error_rate or getattr(settings, 'CRAWLER_FRONTIER_ERROR_RATE', 0.0001)
+        )
+
+    def __contains__(self, value):
+        if self.exact is not None:
+            return (value & MASK64) in self.exact
+        return value in self.bloom
+
+    def __len__(self):
+        return len(self.bloom)
+
+    def add(self, value):
+        self.bloom.add(value)
+        if self.exact is not None:
+            self.exact.add(value & MASK64)
+            if len(self.exact) > self.exact_limit:
+                logger.info(f"Seen URL set passed {self.exact_limit} URLs, keeping the Bloom filter only")
+                self.exact = None
+
+
+def compile_patterns(text):
+    """Regular expressions from a newline separated list"""
+    return [re.compile(line.strip()) for line in (text or '').splitlines() if line.strip()]
+
+
+class LinkFrontier:
+    """
+    Picks the links of crawled pages that join a link-following job.
+
+    A link is followed when it is on the same site (registrable domain) as
+    one of the job's seed URLs, matches an include pattern if there are
+    any and no exclude pattern, comes from a page less than `max_depth`
+    links away from a seed, and the job has fewer than `max_pages` URLs.
+    Links are normalized and checked against the URLs the job already has;
+    new ones are returned as unsaved CrawledURLs for a batched insert.
+
+    The seen-set is per process; the unique (job, url_key) constraint
+    keeps processes sharing a job from inserting the same URL twice, and
+    `max_pages` is only approximate across processes.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.max_depth = job.max_depth
+        self.max_pages = job.max_pages
+        self.include = compile_patterns(job.include_patterns)
+        self.exclude = compile_patterns(job.exclude_patterns)
+        self.strip_params = getattr(settings, 'CRAWLER_STRIP_QUERY_PARAMS', DEFAULT_STRIP_QUERY_PARAMS)
+        self.seen = SeenURLs()
+        self.sites = set()
+        self.total = 0
+
+    @classmethod
+    def for_job(cls, job):
+        """Frontier of a link-following job loaded with its URLs, or None for other jobs"""
+        if not job.follow_links:
+            return None
+        return cls(job).load()
+
+    def load(self):
+        """Add the job's URLs to the seen-set, streaming them from the database"""
+        from .models import CrawledURL
+
+        urls = CrawledURL.objects.filter(job_id=self.job_id).values_list('url', 'url_key', 'depth')
+        for url, key, depth in urls.iterator(chunk_size=5000):
+            if key is None:
+                url = normalize_url(url, self.strip_params) or url
+                key = url_key(url)
+            self.seen.add(int(key, 16))
+            if depth == 0:
+                self.sites.add(registrable_domain(url))
+            self.total += 1
+
+        logger.info(f"Frontier of job {self.job_id} loaded {self.total} URLs on {len(self.sites)} sites")
+        return self
+
+    def allows(self, url):
+        if registrable_domain(url) not in self.sites:
+            return False
+        if any(pattern.search(url) for pattern in self.exclude):
+            return False
+        return not self.include or any(pattern.search(url) for pattern in self.include)
+
+    def discover(self, crawled_url, structured_content):
+        """New CrawledURLs for the links of a crawled page"""
+        from .models import CrawledURL
+
+        if crawled_url.depth >= self.max_depth or not structured_content:
+            return []
+
+        found = []
+        for link in structured_content.get('links') or []:
+            if self.max_pages and self.total >= self.max_pages:
+                break
+            url = normalize_url(link.get('href'), self.strip_params)
+            if not url or len(url) > MAX_URL_LENGTH or not self.allows(url):
+                continue
+
+            key = url_key(url)
+            value = int(key, 16)
+            if value in self.seen:
+                continue
+            self.seen.add(value)
+            self.total += 1
+            found.append(CrawledURL(job_id=self.job_id, url=url, url_key=key, depth=crawled_url.depth + 1))
+
+        return found
+
+
+def save_urls(urls, batch_size=500):
+    """
+    Insert discovered URLs, skipping those their job already has, and add
+    them to the jobs' URL totals. Returns the number of new URLs.
+    """
+    from .models import CrawlJob, CrawledURL
+
+    by_job = defaultdict(dict)
+    for crawled_url in urls:
+        by_job[crawled_url.job_id].setdefault(crawled_url.url_key, crawled_url)
+
+    added = 0
+    for job_id, by_key in by_job.items():
+        keys = list(by_key)
+        stored = set()
+        for i in range(0, len(keys), batch_size):
+            stored.update(CrawledURL.objects.filter(job_id=job_id, url_key__in=keys[i:i + batch_size])
+                          .values_list('url_key', flat=True))
+        new = [crawled_url for key, crawled_url in by_key.items() if key not in stored]
+        if not new:
+            continue
+
+        # Another process may insert the same URL in between; the unique constraint keeps one
+        CrawledURL.objects.bulk_create(new, batch_size=batch_size, ignore_conflicts=True)
+        CrawlJob.objects.filter(pk=job_id).update(urls_total=F('urls_total') + len(new))
+        added += len(new)
+
+    return added
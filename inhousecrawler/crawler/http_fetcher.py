@@ -0,0 +1,226 @@
+import logging
+import re
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import quote
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# Markers of bot challenges and interstitials that only a real browser gets past
+CHALLENGE_MARKERS = (
+    'cf-browser-verification',
+    'challenge-platform',
+    'cf-chl-',
+    '_cf_chl_opt',
+    'just a moment...',
+    'checking your browser',
+    'attention required! | cloudflare',
+    'ddos-guard',
+    'px-captcha',
+    'g-recaptcha',
+    'h-captcha',
+    'hcaptcha.com',
+    'captcha-delivery.com',
+    '/_incapsula_resource',
+    'distil_r_captcha',
+    'please enable javascript and cookies',
+)
+
+# Empty mount points left by client-side rendered apps
+APP_SHELL_PATTERN = re.compile(
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt|svelte|main-app)["\'][^>]*>\s*</div>',
+    re.IGNORECASE
+)
+NOSCRIPT_JS_PATTERN = re.compile(
+    r'<noscript[^>]*>[^<]*(?:enable|requires?|turn on)\s+javascript',
+    re.IGNORECASE
+)
+SCRIPT_STYLE_PATTERN = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+ESCALATE_STATUS_CODES = {403, 429, 503}
+
+
+@dataclass
+class HttpFetchResult:
+    url: str
+    status_code: int
+    text: str
+    headers: dict = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def content_type(self):
+        return self.headers.get('content-type', '')
+
+
+def response_validators(headers):
+    """ETag and Last-Modified of a response, from its lower-cased headers"""
+    return {
+        'etag': headers.get('etag') or None,
+        'last_modified': headers.get('last-modified') or None,
+    }
+
+
+def conditional_headers(crawled_url):
+    """Request headers that revalidate a URL's stored page, or None if it has no validators"""
+    if not crawled_url.page_id:
+        return None
+    headers = {}
+    if crawled_url.etag:
+        headers['If-None-Match'] = crawled_url.etag
+    if crawled_url.last_modified:
+        headers['If-Modified-Since'] = crawled_url.last_modified
+    return headers or None
+
+
+def visible_text_length(html):
+    """Rough length of the text a visitor would see, without parsing the DOM"""
+    text = SCRIPT_STYLE_PATTERN.sub(' ', html)
+    text = TAG_PATTERN.sub(' ', text)
+    return len(WHITESPACE_PATTERN.sub(' ', text).strip())
+
+
+def blocked_reason(status_code, html):
+    """Why a final response (after any browser escalation) is a block page, or None"""
+    if status_code in ESCALATE_STATUS_CODES:
+        return f"status {status_code}"
+    lowered = html[:200000].lower()
+    for marker in CHALLENGE_MARKERS:
+        if marker in lowered:
+            return f"challenge page ({marker})"
+    return None
+
+
+def needs_browser(result, min_text_chars=None):
+    """
+    Decide whether an HTTP response has to be fetched again with a browser.
+
+    Returns the reason as a short string, or None when the response is good
+    enough to keep.
+    """
+    if min_text_chars is None:
+        min_text_chars = getattr(settings, 'CRAWLER_HTTP_MIN_TEXT_CHARS', 200)
+
+    if result.status_code in ESCALATE_STATUS_CODES:
+        return f"status {result.status_code}"
+
+    content_type = result.content_type.lower()
+    if content_type and 'html' not in content_type:
+        # Not a page (JSON, PDF, feeds...); a browser would not render more of it
+        return None
+
+    html = result.text
+    lowered = html[:200000].lower()
+
+    for marker in CHALLENGE_MARKERS:
+        if marker in lowered:
+            return f"challenge page ({marker})"
+
+    if APP_SHELL_PATTERN.search(html) or NOSCRIPT_JS_PATTERN.search(html):
+        if visible_text_length(html) < min_text_chars * 5:
+            return "JavaScript app shell"
+
+    if visible_text_length(html) < min_text_chars:
+        return "near-empty body"
+
+    return None
+
+
+class HttpFetcher:
+    """
+    Pooled async HTTP client used to fetch pages without a browser.
+
+    httpx binds a proxy to a client, so one keep-alive client is kept per
+    proxy and the least recently used clients are evicted once more than
+    `max_clients` are open. An evicted client is closed when the last
+    request still using it finishes.
+    """
+
+    def __init__(self, max_clients=None, max_connections=None):
+        self.max_clients = max_clients or getattr(settings, 'CRAWLER_HTTP_MAX_CLIENTS', 50)
+        self.max_connections = max_connections or getattr(settings, 'CRAWLER_HTTP_MAX_CONNECTIONS', 20)
+        self._clients = OrderedDict()
+        self._in_use = Counter()  # client -> requests in flight on it
+        self._evicted = set()  # Clients out of the pool, waiting for their last request
+
+    @staticmethod
+    def proxy_url(proxy):
+        credentials = f"{quote(proxy.username, safe='')}:{quote(proxy.password, safe='')}"
+        return f"http://{credentials}@{proxy.ip_address}:{proxy.port}"
+
+    def _client(self, proxy):
+        key = proxy.id if proxy else None
+        client = self._clients.get(key)
+        if client is not None:
+            self._clients.move_to_end(key)
+            return client
+
+        client = httpx.AsyncClient(
+            proxy=self.proxy_url(proxy) if proxy else None,
+            headers=DEFAULT_HEADERS,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            ),
+        )
+        self._clients[key] = client
+
+        if len(self._clients) > self.max_clients:
+            _, evicted = self._clients.popitem(last=False)
+            self._evicted.add(evicted)
+        return client
+
+    async def _close_idle_evicted(self):
+        idle = [client for client in self._evicted if not self._in_use[client]]
+        for client in idle:
+            self._evicted.discard(client)
+            await self._close_client(client)
+
+    @staticmethod
+    async def _close_client(client):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing HTTP client: {str(e)}")
+
+    async def fetch(self, url, proxy=None, timeout=30, headers=None):
+        """GET a URL through the proxy and return an HttpFetchResult"""
+        client = self._client(proxy)
+        self._in_use[client] += 1
+        try:
+            await self._close_idle_evicted()
+            response = await client.get(url, timeout=timeout, headers=headers)
+        finally:
+            self._in_use[client] -= 1
+            if not self._in_use[client]:
+                del self._in_use[client]
+            if client in self._evicted:
+                await self._close_idle_evicted()
+
+        return HttpFetchResult(
+            url=str(response.url),
+            status_code=response.status_code,
+            text=response.text,
+            headers={k.lower(): v for k, v in response.headers.items()},
+            elapsed=response.elapsed.total_seconds(),
+        )
+
+    async def close(self):
+        clients = list(self._clients.values()) + list(self._evicted)
+        self._clients, self._evicted = OrderedDict(), set()
+        for client in clients:
+            await self._close_client(client)
@@ -0,0 +1,286 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .cancellation import control_dir
+
+logger = logging.getLogger(__name__)
+
+# Counters the crawler keeps on the job and its stats, by field name; they
+# have the same names in the job stats payload
+JOB_COUNTERS = ('urls_processed', 'rate_limit_hits', 'timeout_urls', 'retry_pending_urls', 'failed_urls',
+                'http_fetches', 'browser_fetches')
+STATS_COUNTERS = ('successful_requests', 'failed_requests', 'blocked_requests', 'blocked_bytes',
+                  'unchanged_requests', 'block_pages', 'concurrency_changes', 'response_time_total', 'response_count')
+
+FINAL_STATUSES = ('completed', 'failed', 'killed')
+KEEPALIVE_SECONDS = 15  # Comment lines keep idle streams open through proxies
+
+
+def _live_pattern(job_id):
+    return os.path.join(control_dir(), f'job-{job_id}.*.stats.json')
+
+
+def clear_live_stats(job_id):
+    """Forget what crawlers published for a job whose counters start again from zero"""
+    for path in glob.glob(_live_pattern(job_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _payload_value(field, value):
+    """A plain value written by the crawler, as it appears in the job stats payload"""
+    if field == 'current_proxy':
+        if value is None:
+            return None
+        return {'ip': value.ip_address, 'port': value.port, 'country': value.country_code}
+    if field == 'concurrency_log':
+        return json.loads(value) if value else []
+    if field == 'last_request_time':
+        return value.isoformat() if value else None
+    return value
+
+
+class LiveStatsPublisher:
+    """
+    Publishes the counters one crawler process writes for a job, so the
+    dashboard can follow them without querying the database.
+
+    It listens to the write buffer and, after each flush, writes the job's
+    counters as read when the crawler started (`base`), what it has added
+    since (`added`) and the latest plain values to a JSON file of its own in
+    CRAWLER_CONTROL_DIR. The base of the crawler that started first plus
+    what every crawler added is the job's current count, however many
+    processes crawl it; resetting the job removes the files.
+    """
+
+    def __init__(self, job, stats):
+        self.job_id = job.id
+        self.rows = {('crawljob', job.id), ('crawlstats', stats.id)}
+        self.base = {field: getattr(job, field) for field in JOB_COUNTERS}
+        self.base.update({field: getattr(stats, field) for field in STATS_COUNTERS})
+        self.added = dict.fromkeys(self.base, 0)
+        self.values = {}
+        self.started_at = time.time()
+        # One file per crawler run, so a process that stopped still counts what it wrote
+        self.path = os.path.join(control_dir(), f'job-{job.id}.{os.getpid()}-{uuid.uuid4().hex[:8]}.stats.json')
+        self._lock = threading.Lock()
+
+    def record_flush(self, counters, values):
+        """Write buffer listener: take in the counters and values a flush just wrote"""
+        with self._lock:
+            for (model, pk), deltas in counters.items():
+                if (model._meta.model_name, pk) in self.rows:
+                    for field, delta in deltas.items():
+                        if field in self.added:
+                            self.added[field] += delta
+            for (model, pk), fields in values.items():
+                if (model._meta.model_name, pk) in self.rows:
+                    for field, value in fields.items():
+                        self.values[field] = _payload_value(field, value)
+            self._write()
+
+    def publish_status(self, status, cooloff_until=None):
+        """Publish a status change of the job"""
+        with self._lock:
+            self.values['status'] = status
+            self.values['cooloff_until'] = cooloff_until.isoformat() if cooloff_until else None
+            self.values['status_at'] = time.time()
+            self._write()
+
+    def _write(self):
+        data = {'base': self.base, 'added': self.added, 'values': self.values, 'started_at': self.started_at,
+                'updated_at': time.time()}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Readers never see a half-written file
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.path + '.tmp', self.path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not publish live stats of job {self.job_id}: {str(e)}")
+
+
+def read_live_stats(job_id):
+    """Combine what the crawler processes of a job published; None if none did"""
+    published = []
+    for path in glob.glob(_live_pattern(job_id)):
+        try:
+            with open(path) as f:
+                published.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    if not published:
+        return None
+
+    # Counts read by later crawlers at start include what earlier ones had added, so only the first base counts
+    first = min(published, key=lambda p: p['started_at'])
+    counters = {field: base + sum(p['added'].get(field, 0) for p in published)
+                for field, base in first['base'].items()}
+
+    values = {}
+    for p in sorted(published, key=lambda p: p['updated_at']):
+        values.update({k: v for k, v in p['values'].items() if k not in ('status', 'cooloff_until', 'status_at')})
+    # The status is the one set last, which is not always in the file written last
+    with_status = [p['values'] for p in published if 'status_at' in p['values']]
+    if with_status:
+        latest = max(with_status, key=lambda v: v['status_at'])
+        values.update({k: latest[k] for k in ('status', 'cooloff_until', 'status_at')})
+    return {'counters': counters, 'values': values}
+
+
+class JobStatsFeed:
+    """
+    The stats of one job as pushed to its dashboards, shared by every viewer
+    in this web process.
+
+    The full payload is built by `build` from the database when the first
+    viewer connects and every `refresh_interval` seconds after that; every
+    `interval` seconds in between, the counters published by the job's
+    crawlers are laid over it, which reads a few small files and no rows.
+    Ten viewers of a job cost what one does.
+    """
+
+    _feeds = {}  # job id -> JobStatsFeed
+    _feeds_lock = threading.Lock()
+
+    def __init__(self, job_id, build, interval=None, refresh_interval=None):
+        self.job_id = job_id
+        self.build = build
+        self.interval = interval or getattr(settings, 'CRAWLER_LIVE_STATS_SECONDS', 1)
+        self.refresh_interval = refresh_interval or getattr(settings, 'CRAWLER_LIVE_STATS_REFRESH_SECONDS', 10)
+        self.viewers = 0
+        self.payload = None
+        self._built_at = 0
+        self._read_at = 0
+        self._overlaid = False  # The payload holds counters read from published files
+        self._lock = threading.Lock()
+
+    @classmethod
+    def attach(cls, job_id, build):
+        """The feed of a job, shared with any other viewer of it"""
+        with cls._feeds_lock:
+            feed = cls._feeds.get(job_id)
+            if feed is None:
+                feed = cls._feeds[job_id] = cls(job_id, build)
+            feed.viewers += 1
+        return feed
+
+    def detach(self):
+        with self._feeds_lock:
+            self.viewers -= 1
+            if self.viewers <= 0 and self._feeds.get(self.job_id) is self:
+                del self._feeds[self.job_id]
+
+    def current(self):
+        """The latest payload, brought up to date at most once per interval for all viewers"""
+        with self._lock:
+            now = time.time()
+            if self.payload is None or now - self._built_at >= self.refresh_interval:
+                self._rebuild(now)
+            elif now - self._read_at >= self.interval:
+                # Once the job has stopped, the database has its final counts
+                live = None if self.payload.get('status') in FINAL_STATUSES else read_live_stats(self.job_id)
+                if live:
+                    self.payload = self._overlay(dict(self.payload), live)
+                    self._overlaid = True
+                elif self._overlaid:
+                    # The crawlers removed their files because the job stopped, or it was reset
+                    self._rebuild(now)
+                self._read_at = now
+            return self.payload
+
+    def _rebuild(self, now):
+        self.payload = self.build()
+        self._built_at = self._read_at = now
+        self._overlaid = False
+
+    def _overlay(self, payload, live):
+        counters = dict(live['counters'])
+        # The mean is sent rather than the totals it comes from
+        response_time_total = counters.pop('response_time_total', None)
+        response_count = counters.pop('response_count', None)
+        if response_count:
+            payload['avg_response_time'] = round(response_time_total / response_count, 3)
+        payload.update(counters)
+        values = live['values']
+        for field in ('current_rate', 'current_proxy', 'concurrency_limit', 'concurrency_log'):
+            if field in values:
+                payload[field] = values[field]
+        if 'last_request_time' in values:
+            payload['last_updated'] = values['last_request_time']
+        if payload.get('urls_total'):
+            payload['progress_percent'] = round(payload['urls_processed'] / payload['urls_total'] * 100, 1)
+
+        # A status the crawler set after the payload was built is newer than the database's
+        if values.get('status_at', 0) > self._built_at:
+            payload['status'] = values['status']
+            payload['cooloff_remaining'] = None
+            if values['status'] == 'cooloff' and values.get('cooloff_until'):
+                remaining = (datetime.fromisoformat(values['cooloff_until']) - timezone.now()).total_seconds()
+                payload['cooloff_remaining'] = remaining if remaining > 0 else None
+        return payload
+
+    def _next_event(self, sent, payload, quiet):
+        """
+        What to send a viewer who last got `sent`: (what they now have, the
+        event or None, seconds without an event)
+        """
+        delta = {key: value for key, value in payload.items() if sent.get(key) != value}
+        if delta:
+            return payload, f"event: delta\ndata: {json.dumps(delta)}\n\n", 0
+        quiet += self.interval
+        if quiet >= KEEPALIVE_SECONDS:
+            return sent, ": keepalive\n\n", 0
+        return sent, None, quiet
+
+    @classmethod
+    def stream(cls, job_id, build, max_seconds=None):
+        """
+        Server-Sent Events for one viewer: the whole payload, then only the
+        keys that changed; ends once the job has stopped.
+
+        Each open stream holds a WSGI worker, so it also ends after
+        `max_seconds`; EventSource then reconnects and gets a new snapshot.
+        """
+        max_seconds = max_seconds or getattr(settings, 'CRAWLER_LIVE_STATS_STREAM_SECONDS', 300)
+        feed = cls.attach(job_id, build)
+        try:
+            sent = feed.current()
+            yield f"event: snapshot\ndata: {json.dumps(sent)}\n\n"
+            ends_at = time.monotonic() + max_seconds
+            quiet = 0
+            while sent.get('status') not in FINAL_STATUSES and time.monotonic() < ends_at:
+                time.sleep(feed.interval)
+                sent, event, quiet = feed._next_event(sent, feed.current(), quiet)
+                if event:
+                    yield event
+        finally:
+            feed.detach()
+
+    @classmethod
+    async def astream(cls, job_id, build):
+        """stream() for ASGI servers, where an open stream waits on the event loop instead of holding a thread"""
+        feed = cls.attach(job_id, build)
+        current = sync_to_async(feed.current)
+        try:
+            sent = await current()
+            yield f"event: snapshot\ndata: {json.dumps(sent)}\n\n"
+            quiet = 0
+            while sent.get('status') not in FINAL_STATUSES:
+                await asyncio.sleep(feed.interval)
+                sent, event, quiet = feed._next_event(sent, await current(), quiet)
+                if event:
+                    yield event
+        finally:
+            feed.detach()
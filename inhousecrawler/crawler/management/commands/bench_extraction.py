@@ -0,0 +1,92 @@
+import asyncio
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from crawler.extraction import PAGE_EXTRACTION_SCRIPT, extract_structured_content, extraction_limits
+from crawler.models import CrawledURL
+
+
+class Command(BaseCommand):
+    help = (
+        'Time content extraction on large saved pages: the bundled in-browser '
+        'extraction script and the HTML parser used by HTTP fetches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Saved HTML files to benchmark')
+        parser.add_argument('--job', type=int, help='Also benchmark the largest pages saved by this job')
+        parser.add_argument('--limit', type=int, default=5, help='Number of pages to take from --job')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per page')
+        parser.add_argument('--no-browser', action='store_true', help='Only benchmark the HTML parser')
+
+    def _load_pages(self, options):
+        pages = []
+        for path in options['files']:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    pages.append((path, f'file://{path}', f.read()))
+            except OSError as e:
+                raise CommandError(f'Cannot read {path}: {str(e)}')
+
+        if options.get('job'):
+            largest = (
+                CrawledURL.objects.filter(job_id=options['job'], page__isnull=False)
+                .select_related('page')
+                .order_by('-page__size')[:options['limit']]
+            )
+            pages.extend((u.url, u.url, u.content) for u in largest)
+
+        if not pages:
+            raise CommandError('Give saved HTML files or --job')
+        return pages
+
+    def _report(self, label, name, size, timings):
+        self.stdout.write(
+            f'{label:<8} {name[:60]:<60} {size / 1024:>8.0f} KB  '
+            f'median {statistics.median(timings) * 1000:>8.1f} ms  '
+            f'min {min(timings) * 1000:>8.1f} ms'
+        )
+
+    def _bench_parser(self, pages, repeat):
+        for name, url, html in pages:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extract_structured_content(html, url)
+                timings.append(time.perf_counter() - start)
+            self._report('parser', name, len(html), timings)
+
+    async def _bench_browser(self, pages, repeat):
+        from playwright.async_api import async_playwright
+
+        limits = extraction_limits()
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(headless=True)
+            try:
+                page = await browser.new_page()
+                # Saved pages are rendered offline; subresources would only add noise
+                await page.route('**/*', lambda route: route.abort() if route.request.resource_type != 'document' else route.continue_())
+
+                for name, _, html in pages:
+                    await page.set_content(html, wait_until='domcontentloaded')
+                    timings = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        data = await page.evaluate(PAGE_EXTRACTION_SCRIPT, limits)
+                        timings.append(time.perf_counter() - start)
+                    self._report('browser', name, len(html), timings)
+                    self.stdout.write(
+                        f'         {len(data["links"])} links, {len(data["images"])} images, '
+                        f'{len(data["tables"])} tables, {len(json.dumps(data)) / 1024:.0f} KB returned'
+                    )
+            finally:
+                await browser.close()
+
+    def handle(self, *args, **options):
+        pages = self._load_pages(options)
+        repeat = max(1, options['repeat'])
+
+        self._bench_parser(pages, repeat)
+        if not options['no_browser']:
+            asyncio.run(self._bench_browser(pages, repeat))
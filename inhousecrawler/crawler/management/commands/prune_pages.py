@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from crawler.models import PageBlob
+
+class Command(BaseCommand):
+    help = 'Delete stored pages that no crawled URL refers to any more, such as those of deleted jobs'
+
+    def handle(self, *args, **options):
+        deleted = PageBlob.delete_orphans()
+        remaining = PageBlob.objects.aggregate(html=Sum('size'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} unreferenced pages; {PageBlob.objects.count()} pages '
+            f'({(remaining["html"] or 0) / 1024 / 1024:.1f} MB of HTML) remain'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from crawler.live_stats import clear_live_stats
+from crawler.models import CrawlJob, CrawledURL
+
+class Command(BaseCommand):
+    help = (
+        'Recount the URLs of jobs in each state (timeout, retry pending, failed, with content, with structured '
+        'content, fetched over HTTP or with the browser) from their rows, repairing the counters the crawler keeps'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Jobs to recount; all jobs if none are given')
+
+    def handle(self, *args, **options):
+        jobs = CrawlJob.objects.order_by('id')
+        if options['job_ids']:
+            jobs = jobs.filter(id__in=options['job_ids'])
+            missing = set(options['job_ids']) - set(jobs.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f'Jobs with ids {sorted(missing)} do not exist')
+
+        repaired = 0
+        for job in jobs:
+            before = {name: getattr(job, name) for name in ['urls_total', *CrawledURL.JOB_COUNTERS]}
+            counts = job.recount_urls()
+            # Counts published by its crawlers were added to the old ones
+            clear_live_stats(job.id)
+            changed = {name: (before[name], count) for name, count in counts.items() if before[name] != count}
+            if changed:
+                repaired += 1
+                details = ', '.join(f'{name} {old} -> {new}' for name, (old, new) in changed.items())
+                self.stdout.write(f'Job {job.id}: {details}')
+
+        self.stdout.write(self.style.SUCCESS(f'Recounted {jobs.count()} jobs; {repaired} had wrong counts'))
@@ -0,0 +1,81 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from crawler.extraction import extract_many_in_pool, shutdown_extraction_pool
+from crawler.models import CrawlJob, CrawledURL
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild structured_content and text fingerprints for every crawled page of a job from its stored HTML, '
+        'in parallel on the extraction process pool. Nothing is fetched again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_id', type=int, help='ID of the crawl job to re-extract')
+        parser.add_argument('--batch-size', type=int, default=200, help='Pages parsed and saved per batch')
+
+    def _extract_batch(self, job_id, batch):
+        """Parse a batch of pages on the pool and save their structured content"""
+        pages = []
+        for crawled_url in batch:
+            # Links were resolved against the final URL of the page, which the old content recorded
+            base_url = crawled_url.url
+            if crawled_url.structured_content:
+                try:
+                    base_url = json.loads(crawled_url.structured_content).get('url') or base_url
+                except ValueError:
+                    pass
+            pages.append((crawled_url.content, base_url))
+
+        added = 0
+        for crawled_url, (structured_content, fingerprint) in zip(batch, extract_many_in_pool(pages)):
+            if crawled_url.structured_content is None:
+                added += 1
+            crawled_url.structured_content = json.dumps(structured_content, ensure_ascii=False)
+            crawled_url.simhash = fingerprint
+
+        with transaction.atomic():
+            CrawledURL.objects.bulk_update(batch, ['structured_content', 'simhash'])
+            if added:
+                CrawlJob.objects.filter(id=job_id).update(
+                    urls_with_structured_content=F('urls_with_structured_content') + added
+                )
+
+    def handle(self, *args, **options):
+        job_id = options['job_id']
+        batch_size = max(1, options['batch_size'])
+
+        if not CrawlJob.objects.filter(id=job_id).exists():
+            raise CommandError(f'Job with id {job_id} does not exist')
+
+        urls = (
+            CrawledURL.objects.filter(job_id=job_id, page__isnull=False)
+            .select_related('page')
+            .only('id', 'url', 'structured_content', 'page')
+            .order_by('id')
+        )
+        total = urls.count()
+        self.stdout.write(f'Re-extracting {total} pages of job {job_id}')
+
+        start = time.time()
+        done = 0
+        batch = []
+        try:
+            for crawled_url in urls.iterator(chunk_size=batch_size):
+                batch.append(crawled_url)
+                if len(batch) >= batch_size:
+                    self._extract_batch(job_id, batch)
+                    done += len(batch)
+                    batch = []
+                    self.stdout.write(f'  {done}/{total}')
+            if batch:
+                self._extract_batch(job_id, batch)
+                done += len(batch)
+        finally:
+            shutdown_extraction_pool()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Re-extracted {done} pages of job {job_id} in {time.time() - start:.1f}s'
+        ))
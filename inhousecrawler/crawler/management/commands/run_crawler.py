@@ -1,17 +1,31 @@
-import asyncio
 import logging
+import multiprocessing
+import os
+import signal
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from crawler.extraction import shutdown_extraction_pool
+from crawler.metrics import metrics
 from crawler.models import CrawlJob
-from crawler.services import CrawlerService, WebshareProxyService
+from crawler.services import WebshareProxyService
+from crawler.sharding import run_job, run_shard
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Run the crawler for a specific job ID'
+    help = (
+        'Run the crawler for a specific job ID. URLs are leased from the job, '
+        'so several run_crawler processes, on one or many hosts, can work the same job'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('job_id', type=int, help='ID of the crawl job to process')
         parser.add_argument('--sync-proxies', action='store_true', help='Sync proxies from WebShare before running the crawler')
+        parser.add_argument('--recrawl', action='store_true', help='Queue every URL of the job again first, revalidating stored pages')
+        parser.add_argument('--workers', '--workers-per-process', dest='workers', type=int, default=None,
+                            help='Parallel workers in each process (defaults to the job\'s parallel_workers)')
+        parser.add_argument('--processes', type=int, default=1, help='Crawler processes to start, each with its own event loop and browsers')
+        parser.add_argument('--progress-interval', type=float, default=5, help='Seconds between progress reports with --processes')
 
     def handle(self, *args, **options):
         job_id = options['job_id']
@@ -20,15 +34,32 @@ class Command(BaseCommand):
         try:
             if sync_proxies:
                 self.stdout.write(self.style.SUCCESS('Syncing proxies from WebShare...'))
-                count = WebshareProxyService.sync_proxies()
-                self.stdout.write(self.style.SUCCESS(f'Synced {count} proxies from WebShare'))
+                result = WebshareProxyService.sync_proxies()
+                if result.ok:
+                    self.stdout.write(self.style.SUCCESS(f'Synced {result} from WebShare'))
+                else:
+                    self.stdout.write(self.style.WARNING(f'Proxy {result}; using the proxies already stored'))
             
             job = CrawlJob.objects.get(id=job_id)
-            self.stdout.write(self.style.SUCCESS(f'Starting crawler for job {job_id}'))
+            if options.get('recrawl'):
+                job.recrawl()
+                self.stdout.write(self.style.SUCCESS(f'Queued {job.urls_total} URLs of job {job_id} for recrawl'))
             
             # Run the crawler
-            crawler = CrawlerService(job_id)
-            asyncio.run(crawler.process_job())
+            workers = options.get('workers') or job.parallel_workers
+            processes = max(1, options.get('processes') or 1)
+            if processes > 1:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Starting crawler for job {job_id} in {processes} processes of {workers} workers'
+                ))
+                finished = self._run_processes(job, processes, workers, options['progress_interval'])
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Starting crawler for job {job_id}'))
+                metrics.start()
+                finished = run_job(job, workers)
+            if not finished:
+                self.stdout.write(self.style.WARNING(f'Crawler for job {job_id} stopped'))
+                return
             
             self.stdout.write(self.style.SUCCESS(f'Crawler completed for job {job_id}'))
             
@@ -36,4 +67,63 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f'Job with id {job_id} does not exist'))
         except Exception as e:
             logger.exception(f"Error running crawler: {str(e)}")
-            self.stdout.write(self.style.ERROR(f'Error running crawler: {str(e)}')) 
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f'Error running crawler: {str(e)}'))
+        finally:
+            shutdown_extraction_pool()
+
+    def _run_processes(self, job, processes, workers, progress_interval):
+        """
+        Crawl the job in `processes` spawned processes and report their progress.
+        Returns False if the processes were stopped by a signal.
+
+        The processes split the job's URLs by leasing them, so a process that
+        finishes early does not leave work behind for the others. Ctrl-C or
+        SIGTERM is passed on to them as SIGTERM, so each writes its results
+        and releases its leases; a second one kills them outright.
+        """
+        extract_processes = getattr(settings, 'CRAWLER_EXTRACT_PROCESSES', None) or max(1, (os.cpu_count() or 1) // processes)
+        context = multiprocessing.get_context('spawn')
+        shards = [
+            context.Process(target=run_shard, args=(job.id, workers, extract_processes), name=f'crawler-{job.id}-{i + 1}')
+            for i in range(processes)
+        ]
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            for shard in shards:
+                if not shard.is_alive():
+                    continue
+                if stopping:
+                    shard.kill()
+                else:
+                    shard.terminate()
+            if not stopping:
+                self.stdout.write(self.style.WARNING('Stopping crawler processes; press Ctrl-C again to kill them'))
+            stopping = True
+
+        previous = {sig: signal.signal(sig, stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            for shard in shards:
+                shard.start()
+            
+            last_report = None
+            while any(shard.is_alive() for shard in shards):
+                next(shard for shard in shards if shard.is_alive()).join(progress_interval)
+                job.refresh_from_db(fields=['status', 'urls_processed', 'urls_total'])
+                alive = sum(shard.is_alive() for shard in shards)
+                report = (job.status, job.urls_processed, job.urls_total, alive)
+                if report != last_report:
+                    self.stdout.write(f'Job {job.id} {job.status}: {job.urls_processed}/{job.urls_total} URLs, '
+                                      f'{alive}/{processes} processes running')
+                    last_report = report
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        
+        if stopping:
+            return False
+        failed = [shard.name for shard in shards if shard.exitcode != 0]
+        if failed:
+            raise RuntimeError(f'crawler processes {", ".join(failed)} exited with an error')
+        return True
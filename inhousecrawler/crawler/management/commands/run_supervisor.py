@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import signal
+from django.core.management.base import BaseCommand
+from crawler.extraction import shutdown_extraction_pool
+from crawler.metrics import metrics
+from crawler.supervisor import CrawlSupervisor
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = (
+        'Run queued crawl jobs until stopped, several at once within a shared worker and browser budget. '
+        'Running jobs whose supervisor stopped sending heartbeats are resumed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-jobs', type=int, default=None, help='Jobs run at once (defaults to CRAWLER_SUPERVISOR_MAX_JOBS)')
+        parser.add_argument('--max-workers', type=int, default=None, help='Workers across all jobs (defaults to CRAWLER_SUPERVISOR_MAX_WORKERS)')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds between heartbeats (defaults to CRAWLER_SUPERVISOR_POLL_SECONDS)')
+
+    def handle(self, *args, **options):
+        supervisor = CrawlSupervisor(
+            max_jobs=options.get('max_jobs'),
+            max_workers=options.get('max_workers'),
+            poll_interval=options.get('poll_interval')
+        )
+
+        async def run():
+            # Stop cleanly on SIGTERM and Ctrl-C: running jobs are queued again
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, supervisor.stop)
+            await supervisor.run()
+
+        self.stdout.write(self.style.SUCCESS(f'Supervisor {supervisor.supervisor_id} running; stop it with Ctrl-C'))
+        metrics.start()
+        try:
+            asyncio.run(run())
+            self.stdout.write(self.style.SUCCESS('Supervisor stopped'))
+        except Exception as e:
+            logger.exception(f"Error running supervisor: {str(e)}")
+            self.stdout.write(self.style.ERROR(f'Error running supervisor: {str(e)}'))
+        finally:
+            shutdown_extraction_pool()
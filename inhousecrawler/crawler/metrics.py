@@ -0,0 +1,304 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from .cancellation import control_dir
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the buckets of every duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120)
+
+# File that keeps the counters and histograms of crawler processes that have exited
+RETIRED_FILE = 'metrics-retired.json'
+# Intervals without a write after which the file of a process is taken to be
+# left by one that died without folding it into RETIRED_FILE
+ABANDONED_AFTER = 60
+
+# Every metric the crawler exports: name -> (type, help)
+METRICS = {
+    'crawler_navigation_seconds': ('histogram', 'Time from requesting a page to its response (DOMContentLoaded in a browser)'),
+    'crawler_networkidle_wait_seconds': ('histogram', 'Time spent waiting for the network to go idle after navigation'),
+    'crawler_extraction_seconds': ('histogram', 'Time to extract structured content from a page'),
+    'crawler_screenshot_seconds': ('histogram', 'Time to capture a screenshot'),
+    'crawler_db_flush_seconds': ('histogram', 'Time to write a batch of buffered results to the database'),
+    'crawler_requests_total': ('counter', 'Crawl attempts by outcome'),
+    'crawler_responses_total': ('counter', 'Responses by HTTP status code'),
+    'crawler_proxy_requests_total': ('counter', 'Crawl attempts by proxy and outcome'),
+    'crawler_domain_requests_total': ('counter', 'Crawl attempts by registrable domain and outcome'),
+    'crawler_pages_in_flight': ('gauge', 'URLs being crawled'),
+    'crawler_browsers_open': ('gauge', 'Browsers open in the pool'),
+    'crawler_queue_depth': ('gauge', 'URLs leased by a crawler and waiting for a worker'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Counters, histograms and gauges of one crawler process, labelled by job.
+
+    Recording only updates memory. Once start() has been called, which the
+    crawler commands do, a background thread writes everything to a JSON
+    file of this process in CRAWLER_CONTROL_DIR every
+    CRAWLER_METRICS_SECONDS; the web process's /metrics merges the files of
+    all crawler processes sharing the directory. At exit, retire() adds the
+    counters and histograms to RETIRED_FILE and removes the file, so the
+    directory holds one file per live process. Gauges are read from
+    callbacks when the file is written.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket..., sum]
+        self._gauges = {}  # (name, labels) -> callable returning the value
+        self.path = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._write_lock = threading.Lock()  # No write lands after retire() folded the file
+
+    def inc(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(DURATION_BUCKETS)] += 1  # +Inf
+            histogram[-1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the block takes, also when it raises"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def track(self, name, read, **labels):
+        """Report the gauge `name` as whatever `read()` returns, until untrack()"""
+        with self._lock:
+            self._gauges[_key(name, labels)] = read
+
+    def untrack(self, name, **labels):
+        with self._lock:
+            self._gauges.pop(_key(name, labels), None)
+
+    def snapshot(self):
+        """Everything recorded so far, in the form written to the metrics file"""
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, list(values)) for key, values in self._histograms.items()]
+            gauges = list(self._gauges.items())
+
+        samples = []
+        for (name, labels), value in counters:
+            samples.append({'name': name, 'labels': dict(labels), 'value': value})
+        for (name, labels), values in histograms:
+            samples.append({'name': name, 'labels': dict(labels), 'buckets': values[:-1], 'sum': values[-1]})
+        for (name, labels), read in gauges:
+            try:
+                samples.append({'name': name, 'labels': dict(labels), 'value': read()})
+            except Exception as e:
+                logger.debug(f"Could not read gauge {name}: {str(e)}")
+        return {'pid': os.getpid(), 'updated_at': time.time(), 'samples': samples}
+
+    def start(self, interval=None):
+        """Write this process's metrics for /metrics in the background"""
+        if self._thread is not None:
+            return self
+        interval = interval or getattr(settings, 'CRAWLER_METRICS_SECONDS', 5)
+        self.path = os.path.join(control_dir(), f'metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='metrics-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.retire)
+        return self
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            self.write()
+
+    def write(self):
+        with self._write_lock:
+            if self.path is None:
+                return
+            try:
+                _write_json(self.path, self.snapshot())
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not write crawler metrics: {str(e)}")
+
+    def retire(self):
+        """Write the metrics of this process a last time and fold them into RETIRED_FILE"""
+        self._stopped.set()
+        self.write()
+        with self._write_lock:
+            path, self.path = self.path, None
+        if path:
+            _fold([path])
+
+
+# The registry of this process
+metrics = MetricsRegistry()
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Readers never see a half-written file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(values, data, gauges=True):
+    """Add the samples of a metrics file to `values`: (name, labels) -> value, or [bucket counts..., sum]"""
+    for sample in data.get('samples', []):
+        kind = METRICS.get(sample['name'], ('untyped',))[0]
+        if kind == 'gauge' and not gauges:
+            continue
+        key = _key(sample['name'], sample['labels'])
+        if kind == 'histogram':
+            merged = values.setdefault(key, [0] * len(sample['buckets']) + [0.0])
+            for i, count in enumerate(sample['buckets']):
+                merged[i] += count
+            merged[-1] += sample['sum']
+        else:
+            values[key] = values.get(key, 0) + sample['value']
+
+
+@contextmanager
+def _files_lock(directory, operation):
+    """
+    Hold the lock on the metrics files in `directory`: exclusive to fold
+    files, shared to read them, so a scrape never sees a file both before
+    and after its fold
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'metrics.lock'), 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+def _fold(paths):
+    """
+    Add the counters and histograms of the given process files to
+    RETIRED_FILE and remove them; their gauges are dropped
+    """
+    # The directory the files were written to, even if the settings have changed since
+    directory = os.path.dirname(paths[0])
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    try:
+        with _files_lock(directory, fcntl.LOCK_EX):
+            values = {}
+            _merge(values, _read_json(retired_path) or {})
+            folded = []
+            for path in paths:
+                data = _read_json(path)
+                if data is not None:
+                    _merge(values, data, gauges=False)
+                    folded.append(path)
+            if not folded:
+                return
+            samples = []
+            for (name, labels), value in values.items():
+                if isinstance(value, list):
+                    samples.append({'name': name, 'labels': dict(labels), 'buckets': value[:-1], 'sum': value[-1]})
+                else:
+                    samples.append({'name': name, 'labels': dict(labels), 'value': value})
+            _write_json(retired_path, {'pid': None, 'updated_at': time.time(), 'samples': samples})
+            for path in folded:
+                os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not fold crawler metrics: {str(e)}")
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in sorted(labels.items())
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def collect(stale_after=None):
+    """
+    Merge the metrics files of every crawler process into the Prometheus
+    text exposition format.
+
+    Counters and histograms are summed over the files of running processes
+    and RETIRED_FILE, so they never go backwards; gauges only count for
+    processes that wrote their file in the last `stale_after` seconds. Files
+    of processes that died without retiring are folded into RETIRED_FILE.
+    """
+    interval = getattr(settings, 'CRAWLER_METRICS_SECONDS', 5)
+    stale_after = stale_after or 3 * interval
+    now = time.time()
+    directory = control_dir()
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    abandoned = []
+    values = {}  # (name, labels) -> value, or [bucket counts..., sum] for histograms
+    with _files_lock(directory, fcntl.LOCK_SH):
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            data = _read_json(path)
+            if data is None:
+                continue
+            age = now - data.get('updated_at', 0)
+            if path != retired_path and age > ABANDONED_AFTER * interval:
+                abandoned.append(path)
+            _merge(values, data, gauges=age <= stale_after)
+    if abandoned:
+        _fold(abandoned)
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (sample_name, labels), value in sorted(values.items()):
+            if sample_name != name:
+                continue
+            labels = dict(labels)
+            if kind != 'histogram':
+                lines.append(f'{name}{_label_text(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_label_text({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{name}_sum{_label_text(labels)} {_number(round(value[-1], 6))}')
+            lines.append(f'{name}_count{_label_text(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0008_crawljob_reshuffle_proxies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledurl',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledurl',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='crawledurl',
+            index=models.Index(fields=['job', 'retry_status', 'lease_expires_at'], name='crawledurl_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0009_crawledurl_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledurl',
+            name='fetched_via',
+            field=models.CharField(blank=True, choices=[('http', 'HTTP'), ('browser', 'Browser')], max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='fetch_mode',
+            field=models.CharField(choices=[('browser', 'Browser'), ('http', 'HTTP'), ('auto', 'Auto')], default='browser', max_length=10),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0010_fetch_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='blocked_domains',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='blocked_resource_types',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='blocked_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='blocked_requests',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0011_resource_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='screenshot_format',
+            field=models.CharField(choices=[('png', 'PNG'), ('jpeg', 'JPEG')], default='png', max_length=4),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='screenshot_mode',
+            field=models.CharField(choices=[('off', 'Off'), ('on_failure', 'On Failure'), ('viewport', 'Viewport'), ('full_page', 'Full Page')], default='on_failure', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='screenshot_quality',
+            field=models.PositiveSmallIntegerField(default=80),
+        ),
+    ]
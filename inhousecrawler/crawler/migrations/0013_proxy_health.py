@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0012_screenshot_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='proxy_selection',
+            field=models.CharField(choices=[('lru', 'Least Recently Used'), ('health', 'Health Scored')], default='lru', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='health_samples',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='latency_ewma',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='recent_blocks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='success_ewma',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='timeout_ewma',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+def merge_duplicate_proxies(apps, schema_editor):
+    """Keep the oldest row of each address and point references to its duplicates at it"""
+    Proxy = apps.get_model('crawler', 'Proxy')
+    CrawledURL = apps.get_model('crawler', 'CrawledURL')
+    CrawlStats = apps.get_model('crawler', 'CrawlStats')
+
+    kept = {}
+    duplicates = {}
+    for proxy in Proxy.objects.order_by('id'):
+        key = (proxy.ip_address, proxy.port)
+        if key in kept:
+            duplicates[proxy.id] = kept[key]
+        else:
+            kept[key] = proxy.id
+
+    for duplicate_id, kept_id in duplicates.items():
+        CrawledURL.objects.filter(proxy_used_id=duplicate_id).update(proxy_used_id=kept_id)
+        CrawlStats.objects.filter(current_proxy_id=duplicate_id).update(current_proxy_id=kept_id)
+    Proxy.objects.filter(id__in=list(duplicates)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0013_proxy_health'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_proxies, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='proxy',
+            name='is_stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='proxy',
+            constraint=models.UniqueConstraint(fields=('ip_address', 'port'), name='unique_proxy_address'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:32
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_content_to_page_store(apps, schema_editor):
+    """Store each distinct page once, compressed, and point its URLs at it"""
+    CrawledURL = apps.get_model('crawler', 'CrawledURL')
+    PageBlob = apps.get_model('crawler', 'PageBlob')
+
+    stored = set()
+    batch = []
+
+    def flush():
+        blobs = {}
+        for crawled_url in batch:
+            content = crawled_url.content
+            key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+            crawled_url.page_id = key
+            crawled_url.content_hash = key
+            if key not in stored:
+                blobs[key] = PageBlob(key=key, data=zlib.compress(content.encode('utf-8'), 6), size=len(content))
+                stored.add(key)
+        PageBlob.objects.bulk_create(blobs.values())
+        CrawledURL.objects.bulk_update(batch, ['page', 'content_hash'])
+        batch.clear()
+
+    urls = CrawledURL.objects.filter(content__isnull=False).only('id', 'content').order_by('id')
+    for crawled_url in urls.iterator(chunk_size=200):
+        batch.append(crawled_url)
+        if len(batch) >= 200:
+            flush()
+    if batch:
+        flush()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0014_proxy_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageBlob',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='crawledurl',
+            name='page',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='crawled_urls', to='crawler.pageblob'),
+        ),
+        migrations.RunPython(move_content_to_page_store, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='crawledurl',
+            name='content',
+        ),
+    ]
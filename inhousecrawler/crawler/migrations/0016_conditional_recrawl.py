@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0015_page_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledurl',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledurl',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledurl',
+            name='unchanged',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='unchanged_requests',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0016_conditional_recrawl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledurl',
+            name='simhash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='block_pages',
+            field=models.IntegerField(default=0),
+        ),
+    ]
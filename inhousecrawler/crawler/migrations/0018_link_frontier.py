@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0017_block_page_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledurl',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawledurl',
+            name='url_key',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='exclude_patterns',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='follow_links',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='include_patterns',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='max_depth',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='max_pages',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='crawledurl',
+            constraint=models.UniqueConstraint(fields=('job', 'url_key'), name='unique_job_url_key'),
+        ),
+    ]
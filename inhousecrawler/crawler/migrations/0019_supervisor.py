@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0018_link_frontier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='supervisor_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='crawljob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('cooloff', 'In Cooloff'), ('killed', 'Killed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0019_supervisor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlstats',
+            name='concurrency_changes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='concurrency_limit',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='concurrency_log',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
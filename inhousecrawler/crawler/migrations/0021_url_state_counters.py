@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:21
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_urls(apps, schema_editor):
+    """Start the counters of existing jobs from their URLs"""
+    CrawlJob = apps.get_model('crawler', 'CrawlJob')
+    for job in CrawlJob.objects.all():
+        counts = job.urls.aggregate(
+            timeout_urls=Count('id', filter=Q(retry_status='timeout')),
+            retry_pending_urls=Count('id', filter=Q(retry_status='retry_pending')),
+            failed_urls=Count('id', filter=Q(retry_status='failed')),
+            urls_with_content=Count('id', filter=Q(page__isnull=False)),
+            urls_with_structured_content=Count('id', filter=Q(structured_content__isnull=False)),
+            http_fetches=Count('id', filter=Q(fetched_via='http')),
+            browser_fetches=Count('id', filter=Q(fetched_via='browser')),
+        )
+        CrawlJob.objects.filter(pk=job.pk).update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0020_concurrency_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='browser_fetches',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='failed_urls',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='http_fetches',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='retry_pending_urls',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='timeout_urls',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='urls_with_content',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='urls_with_structured_content',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_urls, migrations.RunPython.noop),
+    ]
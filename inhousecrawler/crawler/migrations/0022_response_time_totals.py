@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:40
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def totals_from_averages(apps, schema_editor):
+    """Treat the old average as the mean of every successful request, which is the best there is"""
+    CrawlStats = apps.get_model('crawler', 'CrawlStats')
+    CrawlStats.objects.filter(avg_response_time__gt=0, successful_requests__gt=0).update(
+        response_time_total=F('avg_response_time') * F('successful_requests'),
+        response_count=F('successful_requests'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0021_url_state_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlstats',
+            name='response_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='crawlstats',
+            name='response_time_total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(totals_from_averages, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='crawlstats',
+            name='avg_response_time',
+        ),
+    ]
@@ -1,5 +1,11 @@
-from django.db import models
+from datetime import timedelta
+from django.db import models, connection, transaction
+from django.db.models import Count, Q
 from django.utils import timezone
+from django.utils.functional import cached_property
+from .cancellation import clear_kill, signal_kill
+from .live_stats import clear_live_stats
+from .page_store import decompress
 
 class Proxy(models.Model):
     ip_address = models.CharField(max_length=255)
@@ -10,6 +16,19 @@ class Proxy(models.Model):
     is_blocked = models.BooleanField(default=False)
     blocked_at = models.DateTimeField(null=True, blank=True)
     last_used = models.DateTimeField(null=True, blank=True)
+    # Health, as exponentially weighted moving averages of crawl outcomes
+    success_ewma = models.FloatField(default=1.0)  # Share of successful requests
+    latency_ewma = models.FloatField(null=True, blank=True)  # Seconds until the page responded
+    timeout_ewma = models.FloatField(default=0.0)  # Share of requests that timed out
+    recent_blocks = models.IntegerField(default=0)  # Blocks within CRAWLER_PROXY_BLOCK_WINDOW
+    health_samples = models.IntegerField(default=0)
+    is_stale = models.BooleanField(default=False)  # No longer listed by WebShare; never picked
+    synced_at = models.DateTimeField(null=True, blank=True)  # Last WebShare sync that listed this proxy
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ip_address', 'port'], name='unique_proxy_address'),
+        ]
     
     def __str__(self):
         return f"{self.ip_address}:{self.port}"
@@ -29,6 +48,7 @@ class Proxy(models.Model):
 class CrawlJob(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
+        ('queued', 'Queued'),  # Waiting for a supervisor to start it
         ('running', 'Running'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -36,6 +56,29 @@ class CrawlJob(models.Model):
         ('killed', 'Killed'),
     )
     
+    FETCH_MODE_CHOICES = (
+        ('browser', 'Browser'),      # Always render with Playwright
+        ('http', 'HTTP'),            # Plain HTTP client only
+        ('auto', 'Auto'),            # HTTP first, Playwright when the response needs it
+    )
+    
+    PROXY_SELECTION_CHOICES = (
+        ('lru', 'Least Recently Used'),
+        ('health', 'Health Scored'),  # Best of two random proxies by success rate, latency and blocks
+    )
+    
+    SCREENSHOT_MODE_CHOICES = (
+        ('off', 'Off'),
+        ('on_failure', 'On Failure'),  # Viewport capture of failed URLs only
+        ('viewport', 'Viewport'),
+        ('full_page', 'Full Page'),
+    )
+    
+    SCREENSHOT_FORMAT_CHOICES = (
+        ('png', 'PNG'),
+        ('jpeg', 'JPEG'),
+    )
+    
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -48,53 +91,225 @@ class CrawlJob(models.Model):
     parallel_workers = models.IntegerField(default=1)  # Number of parallel IP addresses to use
     proxy_countries = models.CharField(max_length=100, null=True, blank=True)  # Comma-separated country codes for filtering proxies
     reshuffle_proxies = models.BooleanField(default=False)  # Enable round-robin proxy rotation
+    proxy_selection = models.CharField(max_length=10, choices=PROXY_SELECTION_CHOICES, default='lru')  # Ignored when reshuffling
+    fetch_mode = models.CharField(max_length=10, choices=FETCH_MODE_CHOICES, default='browser')
+    blocked_resource_types = models.CharField(max_length=200, null=True, blank=True)  # Comma-separated Playwright resource types; unset uses the default policy
+    blocked_domains = models.TextField(null=True, blank=True)  # Comma or newline separated domain denylist; unset uses the default tracker list
+    screenshot_mode = models.CharField(max_length=10, choices=SCREENSHOT_MODE_CHOICES, default='on_failure')
+    screenshot_format = models.CharField(max_length=4, choices=SCREENSHOT_FORMAT_CHOICES, default='png')
+    screenshot_quality = models.PositiveSmallIntegerField(default=80)  # JPEG quality, 0-100
+    follow_links = models.BooleanField(default=False)  # Add same-site links of crawled pages to the job
+    max_depth = models.PositiveSmallIntegerField(default=2)  # Links followed at most this far from a seed URL
+    max_pages = models.PositiveIntegerField(null=True, blank=True)  # Stop adding links once the job has this many URLs
+    include_patterns = models.TextField(null=True, blank=True)  # Newline separated regexes; followed links must match one
+    exclude_patterns = models.TextField(null=True, blank=True)  # Newline separated regexes; matching links are not followed
+    supervisor_id = models.CharField(max_length=100, null=True, blank=True)  # Supervisor process running the job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Last sign of life from that supervisor
+    # URLs in each state, counted as the crawler writes them; the recount_urls command repairs them
+    timeout_urls = models.IntegerField(default=0)
+    retry_pending_urls = models.IntegerField(default=0)
+    failed_urls = models.IntegerField(default=0)
+    urls_with_content = models.IntegerField(default=0)  # Crawled, with a stored page
+    urls_with_structured_content = models.IntegerField(default=0)
+    http_fetches = models.IntegerField(default=0)  # Last fetched with the HTTP client
+    browser_fetches = models.IntegerField(default=0)  # Last fetched with the browser
     
     def __str__(self):
         return f"Crawl Job {self.id} - {self.status}"
     
+    def recount_urls(self):
+        """Count the job's URLs in each state again, in one scan; returns the counts"""
+        counts = self.urls.aggregate(urls_total=Count('id'), **{
+            name: Count('id', filter=condition) for name, condition in CrawledURL.JOB_COUNTERS.items()
+        })
+        CrawlJob.objects.filter(pk=self.pk).update(**counts)
+        for name, count in counts.items():
+            setattr(self, name, count)
+        return counts
+    
+    @property
+    def takes_screenshots(self):
+        """Whether pages of this job are captured on success, so images should load"""
+        return self.debug_mode or self.screenshot_mode in ('viewport', 'full_page')
+    
     def kill(self):
-        """Kill the job (safely stop it)"""
+        """Kill the job (safely stop it); its crawlers stop within a second"""
         self.status = 'killed'
         self.save(update_fields=['status'])
+        signal_kill(self.id)
         return True
     
-    def reset(self):
-        """Reset the job to pending state and clear all crawled data"""
-        # Reset job state
+    def _reset_progress(self):
+        """Put the job back to pending with fresh counters"""
         self.status = 'pending'
         self.urls_processed = 0
         self.rate_limit_hits = 0
         self.current_rate = 1.0
         self.cooloff_until = None
+        self.supervisor_id = None
+        self.heartbeat_at = None
+        # Every URL goes back to pending
+        self.timeout_urls = 0
+        self.retry_pending_urls = 0
+        self.failed_urls = 0
         self.save()
+        clear_kill(self.id)
+        clear_live_stats(self.id)
         
         # Reset stats
         try:
             stats = self.stats
             stats.current_proxy = None
             stats.blocked_proxies_count = 0
-            stats.avg_response_time = 0
+            stats.response_time_total = 0
+            stats.response_count = 0
             stats.last_request_time = None
             stats.successful_requests = 0
             stats.failed_requests = 0
+            stats.blocked_requests = 0
+            stats.blocked_bytes = 0
+            stats.unchanged_requests = 0
+            stats.block_pages = 0
+            stats.concurrency_limit = 0
+            stats.concurrency_changes = 0
+            stats.concurrency_log = None
             stats.save()
         except CrawlStats.DoesNotExist:
             CrawlStats.objects.create(job=self)
+    
+    def reset(self):
+        """Reset the job to pending state and clear all crawled data"""
+        with transaction.atomic():
+            self._reset_progress()
+            
+            # Links found by the last run are found again
+            discovered = self.urls.filter(depth__gt=0)
+            if discovered.exists():
+                discovered.delete()
+                self.urls_total = self.urls.count()
+                self.urls_with_structured_content = self.urls.filter(structured_content__isnull=False).count()
+            
+            # Clear content from URLs
+            self.urls.all().update(
+                page=None,
+                content_hash=None,
+                etag=None,
+                last_modified=None,
+                unchanged=False,
+                simhash=None,
+                status_code=None,
+                crawled_at=None,
+                proxy_used=None,
+                retry_count=0,
+                retry_status='pending',
+                screenshot_path=None,
+                fetched_via=None,
+                claimed_by=None,
+                lease_expires_at=None
+            )
+            self.urls_with_content = 0
+            self.http_fetches = 0
+            self.browser_fetches = 0
+            self.save(update_fields=['urls_total', 'urls_with_content', 'urls_with_structured_content',
+                                     'http_fetches', 'browser_fetches'])
+        PageBlob.delete_orphans()
         
-        # Clear content from URLs
-        self.urls.all().update(
-            content=None,
-            content_hash=None,
-            status_code=None,
-            crawled_at=None,
-            proxy_used=None,
-            retry_count=0,
-            retry_status='pending',
-            screenshot_path=None
-        )
+        return True
+    
+    def recrawl(self):
+        """
+        Queue every URL of the job to be fetched again, keeping the stored pages.
+        
+        Pages that came with an ETag or Last-Modified are revalidated, and a
+        304 Not Modified keeps the stored page without downloading it again.
+        """
+        with transaction.atomic():
+            self._reset_progress()
+            
+            self.urls.all().update(
+                retry_count=0,
+                retry_status='pending',
+                unchanged=False,
+                claimed_by=None,
+                lease_expires_at=None
+            )
         
         return True
 
+class CrawledURLQuerySet(models.QuerySet):
+    # URLs in these states still need a crawler to work on them
+    CLAIMABLE_STATUSES = ['pending', 'retry_pending', 'timeout']
+    
+    def claimable(self, job_id, max_attempts=3):
+        """URLs of a job that still need work and are not leased to a live worker"""
+        now = timezone.now()
+        return self.filter(
+            job_id=job_id,
+            retry_status__in=self.CLAIMABLE_STATUSES,
+            retry_count__lt=max_attempts,
+        ).filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+    
+    def claim_batch(self, job_id, owner, limit, lease_seconds, max_attempts=3):
+        """
+        Atomically lease up to `limit` URLs of a job to `owner`.
+        
+        Expired leases are claimable again, so URLs held by a crashed worker
+        come back once their lease runs out. Returns the claimed URLs.
+        """
+        lease_expires_at = timezone.now() + timedelta(seconds=lease_seconds)
+        claimable = self.claimable(job_id, max_attempts)
+        
+        if connection.features.has_select_for_update_skip_locked:
+            # Row locks let concurrent claimers skip each other's batches
+            with transaction.atomic():
+                ids = list(claimable.order_by('id').select_for_update(skip_locked=True)
+                           .values_list('id', flat=True)[:limit])
+                self.filter(id__in=ids).update(claimed_by=owner, lease_expires_at=lease_expires_at)
+        else:
+            # No row locks (SQLite): re-check the claim condition in the UPDATE
+            # itself, so rows taken by another claimer in between are skipped
+            ids = list(claimable.order_by('id').values_list('id', flat=True)[:limit])
+            claimable.filter(id__in=ids).update(claimed_by=owner, lease_expires_at=lease_expires_at)
+        
+        return list(self.filter(id__in=ids, claimed_by=owner).order_by('id'))
+    
+    def renew_leases(self, owner, ids, lease_seconds):
+        """Extend the leases `owner` holds on the given URLs"""
+        return self.filter(id__in=ids, claimed_by=owner).update(
+            lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds)
+        )
+    
+    def release_leases(self, owner, ids):
+        """Give up the leases `owner` holds on the given URLs"""
+        return self.filter(id__in=ids, claimed_by=owner).update(claimed_by=None, lease_expires_at=None)
+    
+    def leased_to_others(self, job_id, owner):
+        """Unfinished URLs of a job currently leased to other workers"""
+        return self.filter(
+            job_id=job_id,
+            retry_status__in=self.CLAIMABLE_STATUSES,
+            lease_expires_at__gte=timezone.now(),
+        ).exclude(claimed_by=owner)
+
+class PageBlob(models.Model):
+    """Compressed HTML of a crawled page, stored once however many URLs served it"""
+    key = models.CharField(max_length=64, primary_key=True)  # page_store.content_key() of the HTML
+    data = models.BinaryField()  # zlib-compressed UTF-8 HTML
+    size = models.IntegerField()  # Length of the HTML in characters
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.key
+    
+    @cached_property
+    def text(self):
+        return decompress(self.data)
+    
+    @classmethod
+    def delete_orphans(cls):
+        """Delete pages no crawled URL refers to any more"""
+        return cls.objects.filter(crawled_urls__isnull=True).delete()[0]
+
 class CrawledURL(models.Model):
     RETRY_STATUS_CHOICES = (
         ('pending', 'Pending'),          # Initial state, no attempt yet
@@ -106,8 +321,14 @@ class CrawledURL(models.Model):
     
     job = models.ForeignKey(CrawlJob, on_delete=models.CASCADE, related_name='urls')
     url = models.URLField(max_length=2000)
-    content = models.TextField(null=True, blank=True)
-    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    url_key = models.CharField(max_length=32, null=True, blank=True)  # frontier.url_key() of the normalized URL, for link-following jobs
+    depth = models.PositiveSmallIntegerField(default=0)  # Links followed from a seed URL to reach this one
+    page = models.ForeignKey(PageBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='crawled_urls')  # Set once crawled
+    content_hash = models.CharField(max_length=64, null=True, blank=True)  # PageBlob key (page_store.content_key()) of the page last crawled
+    etag = models.CharField(max_length=255, null=True, blank=True)  # Validators of the stored page, sent when recrawling
+    last_modified = models.CharField(max_length=64, null=True, blank=True)
+    unchanged = models.BooleanField(default=False)  # The last recrawl found the stored page unchanged
+    simhash = models.BigIntegerField(null=True, blank=True)  # fingerprints.simhash() of the page's text
     content_type = models.CharField(max_length=10, choices=[('html', 'HTML'), ('markdown', 'Markdown')], default='html')
     status_code = models.IntegerField(null=True, blank=True)
     crawled_at = models.DateTimeField(null=True, blank=True)
@@ -116,18 +337,93 @@ class CrawledURL(models.Model):
     retry_status = models.CharField(max_length=15, choices=RETRY_STATUS_CHOICES, default='pending')
     screenshot_path = models.CharField(max_length=255, null=True, blank=True)  # Path to screenshot image
     structured_content = models.TextField(null=True, blank=True)  # JSON-formatted structured content
+    fetched_via = models.CharField(max_length=10, choices=[('http', 'HTTP'), ('browser', 'Browser')], null=True, blank=True)
+    claimed_by = models.CharField(max_length=100, null=True, blank=True)  # Crawler process holding the lease
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # Lease is reclaimable after this time
+    
+    objects = CrawledURLQuerySet.as_manager()
+    
+    # CrawlJob counter -> the URLs it counts
+    JOB_COUNTERS = {
+        'timeout_urls': Q(retry_status='timeout'),
+        'retry_pending_urls': Q(retry_status='retry_pending'),
+        'failed_urls': Q(retry_status='failed'),
+        'urls_with_content': Q(page__isnull=False),
+        'urls_with_structured_content': Q(structured_content__isnull=False),
+        'http_fetches': Q(fetched_via='http'),
+        'browser_fetches': Q(fetched_via='browser'),
+    }
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['job', 'retry_status', 'lease_expires_at'], name='crawledurl_claim_idx'),
+        ]
+        constraints = [
+            # Seeds of other jobs have no key, and NULLs never conflict
+            models.UniqueConstraint(fields=['job', 'url_key'], name='unique_job_url_key'),
+        ]
     
     def __str__(self):
         return self.url
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted_in = instance.counted_in()
+        return instance
+    
+    def counted_in(self):
+        """The JOB_COUNTERS this URL counts towards as it is now; deferred fields count towards none"""
+        fields = self.__dict__
+        counters = set()
+        if fields.get('retry_status') in ('timeout', 'retry_pending', 'failed'):
+            counters.add(f"{fields['retry_status']}_urls")
+        if fields.get('page_id') is not None:
+            counters.add('urls_with_content')
+        if fields.get('structured_content') is not None:
+            counters.add('urls_with_structured_content')
+        if fields.get('fetched_via') in ('http', 'browser'):
+            counters.add(f"{fields['fetched_via']}_fetches")
+        return counters
+    
+    def take_counter_changes(self):
+        """
+        Changes to the job's counters since the URL was loaded or this was last
+        called, such as {'timeout_urls': -1, 'failed_urls': 1}
+        """
+        before = getattr(self, '_counted_in', set())  # URLs not loaded from the database are new
+        after = self.counted_in()
+        self._counted_in = after
+        changes = {name: 1 for name in after - before}
+        changes.update({name: -1 for name in before - after})
+        return changes
+    
+    @property
+    def content(self):
+        """HTML of the crawled page, or None if not crawled yet"""
+        return self.page.text if self.page_id else None
 
 class CrawlStats(models.Model):
     job = models.OneToOneField(CrawlJob, on_delete=models.CASCADE, related_name='stats')
     current_proxy = models.ForeignKey(Proxy, on_delete=models.SET_NULL, null=True, blank=True)
     blocked_proxies_count = models.IntegerField(default=0)
-    avg_response_time = models.FloatField(default=0)
+    response_time_total = models.FloatField(default=0)  # Seconds over all successful responses
+    response_count = models.IntegerField(default=0)  # Responses timed in response_time_total
     last_request_time = models.DateTimeField(null=True, blank=True)
     successful_requests = models.IntegerField(default=0)
     failed_requests = models.IntegerField(default=0)
+    blocked_requests = models.IntegerField(default=0)  # Subresource requests aborted by the resource policy
+    blocked_bytes = models.BigIntegerField(default=0)  # Estimated bytes those requests would have transferred
+    unchanged_requests = models.IntegerField(default=0)  # Recrawls that found the stored page unchanged
+    block_pages = models.IntegerField(default=0)  # Responses recognised as block pages
+    concurrency_limit = models.IntegerField(default=0)  # Requests a parallel job may have in flight right now
+    concurrency_changes = models.IntegerField(default=0)
+    concurrency_log = models.TextField(null=True, blank=True)  # JSON list of the latest limit changes
     
     def __str__(self):
         return f"Stats for {self.job}"
+    
+    @property
+    def avg_response_time(self):
+        """Mean seconds per successful response"""
+        return self.response_time_total / self.response_count if self.response_count else 0
@@ -0,0 +1,37 @@
+import hashlib
+import zlib
+from django.conf import settings
+
+
+def content_key(content):
+    """Hash that identifies a page's HTML in the page store"""
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def compress(content):
+    level = getattr(settings, 'CRAWLER_PAGE_COMPRESSION_LEVEL', 6)
+    return zlib.compress(content.encode('utf-8'), level)
+
+
+def decompress(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def save_pages(pages):
+    """
+    Store HTML by content key, skipping pages that are already stored.
+
+    `pages` maps content_key() to HTML. Returns the number of new pages.
+    """
+    from .models import PageBlob
+
+    if not pages:
+        return 0
+    stored = set(PageBlob.objects.filter(key__in=list(pages)).values_list('key', flat=True))
+    blobs = [
+        PageBlob(key=key, data=compress(content), size=len(content))
+        for key, content in pages.items() if key not in stored
+    ]
+    # A concurrent writer may store the same page in between; identical content, so either row will do
+    PageBlob.objects.bulk_create(blobs, batch_size=100, ignore_conflicts=True)
+    return len(blobs)
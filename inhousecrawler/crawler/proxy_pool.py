@@ -0,0 +1,368 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import deque
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .models import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Fields the pool writes back to the Proxy table
+HEALTH_FIELDS = ['success_ewma', 'latency_ewma', 'timeout_ewma', 'recent_blocks', 'health_samples']
+HEALTH_SYNC_FIELDS = ['last_used', 'is_blocked', 'blocked_at'] + HEALTH_FIELDS
+
+
+def parse_countries(countries):
+    """Normalise a list or comma-separated string of country codes (None means every country)"""
+    if not countries:
+        return None
+    if isinstance(countries, str):
+        countries = countries.split(',')
+    codes = tuple(sorted({c.strip() for c in countries if c and c.strip()}))
+    return codes or None
+
+
+def _last_used_key(proxy):
+    return proxy.last_used.timestamp() if proxy.last_used else 0.0
+
+
+def _ewma(previous, value, alpha):
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+class _SubPool:
+    """The proxies of one country selection: an LRU heap, a round-robin ring and a list to sample from"""
+
+    def __init__(self, proxies, stamps):
+        proxies = sorted(proxies, key=_last_used_key)
+        self.members = [proxy.id for proxy in proxies]
+        self.ring = deque(proxy.id for proxy in proxies)
+        self.heap = [(_last_used_key(p), stamps[p.id], p.id) for p in proxies if not p.is_blocked]
+        heapq.heapify(self.heap)
+
+
+class ProxyPool:
+    """
+    In-memory view of the Proxy table shared by all workers of a process.
+
+    Picking a proxy touches no database: least-recently-used picks pop an
+    LRU heap, `reshuffle_proxies` jobs rotate through a ring, and blocked
+    proxies come back on their own when their cooldown timer runs out.
+    Each `proxy_countries` selection gets its own sub-pool.
+
+    With the `health` strategy, picks are the better of two random proxies
+    scored by moving averages of their success rate, latency and timeout
+    rate and by how often they were blocked in the last
+    CRAWLER_PROXY_BLOCK_WINDOW seconds, so slow or failing proxies are
+    used less without being starved of the traffic that measures them.
+
+    Heap entries are invalidated lazily: every proxy carries a stamp that
+    is bumped when it is used or blocked, and entries with an old stamp
+    are dropped when they reach the top or when a heap grows too large.
+
+    last_used, block state and health are written back to the Proxy table every
+    `sync_interval` seconds, and the table is read back at the same time
+    to pick up new proxies and changes made by other processes.
+    """
+
+    EXPLORE_RATE = 0.05  # Share of health-scored picks that skip the comparison
+
+    def __init__(self, cooloff_minutes=None, sync_interval=None):
+        self.cooloff = timedelta(minutes=cooloff_minutes or getattr(settings, 'CRAWLER_COOLOFF_MINUTES', 5))
+        self.sync_interval = sync_interval or getattr(settings, 'CRAWLER_PROXY_SYNC_SECONDS', 30)
+        self.alpha = getattr(settings, 'CRAWLER_PROXY_HEALTH_ALPHA', 0.2)
+        self.block_window = getattr(settings, 'CRAWLER_PROXY_BLOCK_WINDOW', 3600)
+        self.min_timeout = getattr(settings, 'CRAWLER_PROXY_MIN_TIMEOUT', 10)
+        self.timeout_factor = getattr(settings, 'CRAWLER_PROXY_TIMEOUT_FACTOR', 4)
+        self._proxies = {}  # id -> Proxy
+        self._blocks = {}  # id -> deque of block timestamps within the block window
+        self._stamps = {}  # id -> stamp of its valid heap entries
+        self._cooldowns = []  # Heap of (unblock timestamp, id)
+        self._subpools = {}  # parse_countries() key -> _SubPool, built on first use
+        self._dirty = set()
+        self._loaded = False
+        self._sync_lock = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._proxies)
+
+    async def start(self):
+        """Load the Proxy table and start syncing in the background"""
+        if self._sync_lock is None:
+            self._sync_lock = asyncio.Lock()
+        if not self._loaded:
+            await self.sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        """Stop syncing and write back the latest state"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._loaded:
+            await self.sync()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing proxy pool: {str(e)}")
+
+    def _includes(self, key, proxy):
+        return key is None or proxy.country_code in key
+
+    def _subpool(self, key):
+        sub = self._subpools.get(key)
+        if sub is None:
+            members = [p for p in self._proxies.values() if self._includes(key, p)]
+            sub = self._subpools[key] = _SubPool(members, self._stamps)
+        return sub
+
+    def _push(self, proxy):
+        """Make a proxy pickable in every sub-pool that includes it, with its current last_used"""
+        self._stamps[proxy.id] += 1
+        entry = (_last_used_key(proxy), self._stamps[proxy.id], proxy.id)
+        for key, sub in self._subpools.items():
+            if self._includes(key, proxy):
+                heapq.heappush(sub.heap, entry)
+                # Sub-pools that are not picked from never pop their stale entries; drop them
+                if len(sub.heap) > 4 * len(sub.ring) + 64:
+                    sub.heap = [e for e in sub.heap if e[1] == self._stamps.get(e[2])]
+                    heapq.heapify(sub.heap)
+
+    def _schedule_unblock(self, proxy):
+        blocked_at = proxy.blocked_at or timezone.now()
+        heapq.heappush(self._cooldowns, ((blocked_at + self.cooloff).timestamp(), proxy.id))
+
+    def _release_cooled(self, now):
+        """Unblock proxies whose cooldown has run out"""
+        while self._cooldowns and self._cooldowns[0][0] <= now:
+            _, proxy_id = heapq.heappop(self._cooldowns)
+            proxy = self._proxies.get(proxy_id)
+            # Skip timers made stale by a later block or an unblock elsewhere
+            if proxy is None or not proxy.is_blocked:
+                continue
+            if proxy.blocked_at and (proxy.blocked_at + self.cooloff).timestamp() > now:
+                continue
+            proxy.is_blocked = False
+            proxy.blocked_at = None
+            self._dirty.add(proxy.id)
+            self._push(proxy)
+            logger.info(f"Proxy {proxy} is out of cooldown")
+
+    def _next_lru(self, sub):
+        while sub.heap:
+            _, stamp, proxy_id = heapq.heappop(sub.heap)
+            proxy = self._proxies.get(proxy_id)
+            if proxy is not None and stamp == self._stamps[proxy_id] and not proxy.is_blocked:
+                return proxy
+        return None
+
+    def _recent_blocks(self, proxy):
+        blocks = self._blocks.get(proxy.id)
+        if not blocks:
+            return 0
+        cutoff = time.time() - self.block_window
+        while blocks and blocks[0] < cutoff:
+            blocks.popleft()
+        return len(blocks)
+
+    def score(self, proxy):
+        """Higher is better: successes per second of latency, discounted by timeouts and recent blocks"""
+        latency = proxy.latency_ewma if proxy.latency_ewma is not None else 2.0
+        return (proxy.success_ewma * (1 - proxy.timeout_ewma)
+                / (latency + 0.5) / (1 + self._recent_blocks(proxy)))
+
+    def _next_scored(self, sub):
+        """Power of two choices: the better scored of two random available proxies"""
+        candidates = []
+        for _ in range(8):
+            if len(candidates) == 2 or not sub.members:
+                break
+            proxy = self._proxies.get(random.choice(sub.members))
+            if proxy is not None and not proxy.is_blocked and proxy not in candidates:
+                candidates.append(proxy)
+        if not candidates:
+            # Mostly blocked sub-pool, sampling keeps missing; let the heap find a free proxy
+            return self._next_lru(sub)
+        if random.random() < self.EXPLORE_RATE:
+            # The worst proxy never wins a comparison; an occasional blind pick lets it prove it has recovered
+            return candidates[0]
+        # Ties go to the least recently used
+        return max(candidates, key=lambda p: (self.score(p), -_last_used_key(p)))
+
+    def _next_round_robin(self, sub):
+        for _ in range(len(sub.ring)):
+            proxy_id = sub.ring[0]
+            sub.ring.rotate(-1)
+            proxy = self._proxies.get(proxy_id)
+            if proxy is not None and not proxy.is_blocked:
+                return proxy
+        return None
+
+    def acquire(self, countries=None, reshuffle=False, strategy='lru'):
+        """
+        Pick a proxy without touching the database.
+
+        Returns the next one in the rotation when `reshuffle` is set, else
+        the best of two random proxies for the `health` strategy or the
+        least recently used one, or None if every matching proxy is blocked.
+        """
+        now = timezone.now()
+        self._release_cooled(now.timestamp())
+
+        sub = self._subpool(parse_countries(countries))
+        if reshuffle:
+            proxy = self._next_round_robin(sub)
+        elif strategy == 'health':
+            proxy = self._next_scored(sub)
+        else:
+            proxy = self._next_lru(sub)
+        if proxy is None:
+            return None
+
+        proxy.last_used = now
+        self._dirty.add(proxy.id)
+        self._push(proxy)
+        return proxy
+
+    def mark_blocked(self, proxy):
+        """Take a proxy out of rotation until its cooldown runs out"""
+        proxy = self._proxies.get(proxy.id, proxy)
+        proxy.is_blocked = True
+        proxy.blocked_at = timezone.now()
+        if proxy.id in self._stamps:
+            self._stamps[proxy.id] += 1
+            self._blocks.setdefault(proxy.id, deque()).append(time.time())
+            proxy.recent_blocks = self._recent_blocks(proxy)
+            self._dirty.add(proxy.id)
+            self._schedule_unblock(proxy)
+
+    def _record(self, proxy, success, timed_out, latency=None):
+        proxy = self._proxies.get(proxy.id)
+        if proxy is None:
+            return
+        proxy.success_ewma = _ewma(proxy.success_ewma, 1.0 if success else 0.0, self.alpha)
+        proxy.timeout_ewma = _ewma(proxy.timeout_ewma, 1.0 if timed_out else 0.0, self.alpha)
+        if latency is not None:
+            proxy.latency_ewma = _ewma(proxy.latency_ewma, latency, self.alpha)
+        proxy.health_samples += 1
+        self._dirty.add(proxy.id)
+
+    def record_success(self, proxy, latency):
+        """Feed a successful fetch and the seconds the page took to respond into the proxy's health"""
+        self._record(proxy, True, False, latency)
+
+    def record_failure(self, proxy, timeout=False):
+        """Feed a failed fetch into the proxy's health"""
+        self._record(proxy, False, timeout)
+
+    def timeout_for(self, proxy, default):
+        """
+        Seconds to wait for a response through this proxy: a multiple of its
+        average latency once it has enough samples, never more than `default`
+        """
+        proxy = self._proxies.get(proxy.id, proxy)
+        if proxy.latency_ewma is None or proxy.health_samples < 5:
+            return default
+        return min(default, max(self.min_timeout, proxy.latency_ewma * self.timeout_factor))
+
+    def available_count(self, countries=None):
+        key = parse_countries(countries)
+        return sum(1 for p in self._proxies.values() if not p.is_blocked and self._includes(key, p))
+
+    @sync_to_async
+    def _write_and_reload(self, changes):
+        if changes:
+            Proxy.objects.bulk_update(
+                [Proxy(id=proxy_id, **fields) for proxy_id, fields in changes.items()],
+                HEALTH_SYNC_FIELDS
+            )
+        # Proxies WebShare no longer lists drop out of the pool
+        return list(Proxy.objects.filter(is_stale=False))
+
+    async def sync(self):
+        """Write local changes to the Proxy table and read it back"""
+        if self._sync_lock is None:
+            self._sync_lock = asyncio.Lock()
+
+        async with self._sync_lock:
+            dirty, self._dirty = self._dirty, set()
+            changes = {}
+            for proxy_id in dirty:
+                proxy = self._proxies.get(proxy_id)
+                if proxy is not None:
+                    proxy.recent_blocks = self._recent_blocks(proxy)
+                    changes[proxy_id] = {field: getattr(proxy, field) for field in HEALTH_SYNC_FIELDS}
+            try:
+                rows = await self._write_and_reload(changes)
+            except Exception:
+                self._dirty |= dirty
+                raise
+
+            self._apply(rows)
+            self._loaded = True
+
+    def _seed_blocks(self, proxy):
+        """Count blocks recorded in the table but not seen here, spread over the block window"""
+        blocks = self._blocks.setdefault(proxy.id, deque())
+        missing = proxy.recent_blocks - self._recent_blocks(proxy)
+        if missing > 0:
+            now = time.time()
+            blocks.extend(now - self.block_window * (i + 1) / (missing + 1) for i in range(missing))
+            self._blocks[proxy.id] = deque(sorted(blocks))
+
+    def _apply(self, rows):
+        """Merge a fresh read of the Proxy table into the pool"""
+        seen = set()
+        for row in rows:
+            seen.add(row.id)
+            proxy = self._proxies.get(row.id)
+            if proxy is None:
+                self._proxies[row.id] = row
+                self._stamps[row.id] = 0
+                self._seed_blocks(row)
+                if row.is_blocked:
+                    self._schedule_unblock(row)
+                continue
+
+            # Credentials and location may have been changed by a WebShare sync
+            proxy.ip_address = row.ip_address
+            proxy.port = row.port
+            proxy.username = row.username
+            proxy.password = row.password
+            proxy.country_code = row.country_code
+
+            # Changes made here since the write above win over the table
+            if proxy.id in self._dirty:
+                continue
+            if row.last_used and (proxy.last_used is None or row.last_used > proxy.last_used):
+                proxy.last_used = row.last_used
+            if row.is_blocked != proxy.is_blocked:
+                # Blocked or unblocked by another process or an admin
+                proxy.is_blocked = row.is_blocked
+                proxy.blocked_at = row.blocked_at
+                if proxy.is_blocked:
+                    self._schedule_unblock(proxy)
+            # Health measured by other processes
+            for field in HEALTH_FIELDS:
+                setattr(proxy, field, getattr(row, field))
+            self._seed_blocks(proxy)
+
+        for proxy_id in set(self._proxies) - seen:
+            del self._proxies[proxy_id]
+            del self._stamps[proxy_id]
+            self._blocks.pop(proxy_id, None)
+
+        # Sub-pools are rebuilt on next use, picking up added, removed and moved proxies
+        self._subpools = {}
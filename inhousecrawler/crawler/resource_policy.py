@@ -0,0 +1,129 @@
+import logging
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Resource types blocked by default for jobs that do not need screenshots
+DEFAULT_BLOCKED_RESOURCE_TYPES = {'image', 'font', 'media'}
+
+# Analytics, ad and session-recording hosts that never carry page content
+DEFAULT_BLOCKED_DOMAINS = {
+    'google-analytics.com', 'googletagmanager.com', 'googleadservices.com',
+    'googlesyndication.com', 'doubleclick.net', 'adservice.google.com',
+    'connect.facebook.net', 'facebook.net', 'analytics.tiktok.com',
+    'hotjar.com', 'hotjar.io', 'clarity.ms', 'fullstory.com', 'mouseflow.com',
+    'segment.com', 'segment.io', 'mixpanel.com', 'amplitude.com', 'heap.io',
+    'nr-data.net', 'newrelic.com', 'bat.bing.com', 'ads-twitter.com',
+    'analytics.twitter.com', 'criteo.com', 'criteo.net', 'taboola.com',
+    'outbrain.com', 'quantserve.com', 'scorecardresearch.com', 'optimizely.com',
+    'adnxs.com', 'moatads.com', 'branch.io', 'intercom.io', 'snap.licdn.com',
+}
+
+# Aborted requests never transfer anything, so blocked bytes are estimated
+# from typical sizes of each resource type
+BLOCKED_BYTES_ESTIMATE = {
+    'image': 40_000,
+    'media': 500_000,
+    'font': 30_000,
+    'stylesheet': 20_000,
+    'script': 30_000,
+    'xhr': 2_000,
+    'fetch': 2_000,
+    'ping': 500,
+    'beacon': 500,
+}
+DEFAULT_BYTES_ESTIMATE = 5_000
+
+
+def parse_list(value):
+    """Split a comma or newline separated setting into a set of lowercase items"""
+    if not value:
+        return set()
+    return {item.strip().lower() for item in value.replace('\n', ',').split(',') if item.strip()}
+
+
+class BlockedRequestCounter:
+    """Requests and estimated bytes blocked while crawling one URL"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+
+    def add(self, resource_type):
+        self.requests += 1
+        self.bytes += BLOCKED_BYTES_ESTIMATE.get(resource_type, DEFAULT_BYTES_ESTIMATE)
+
+
+class ResourcePolicy:
+    """
+    Decides which subresources a page may load.
+
+    Installed on a BrowserContext with Playwright's routing, it aborts
+    requests of blocked resource types and requests to denylisted domains
+    (and their subdomains). The top-level document is always allowed.
+    """
+
+    def __init__(self, resource_types=None, domains=None):
+        self.resource_types = set(resource_types or ())
+        self.domains = set(domains or ())
+
+    @classmethod
+    def for_job(cls, job):
+        """
+        Build the policy of a job.
+
+        Unset fields fall back to the defaults: trackers are always blocked,
+        and images, fonts and media are blocked unless the job takes
+        screenshots. An empty string blocks nothing.
+        """
+        if job.blocked_resource_types is None:
+            resource_types = set() if job.takes_screenshots else DEFAULT_BLOCKED_RESOURCE_TYPES
+        else:
+            resource_types = parse_list(job.blocked_resource_types)
+
+        if job.blocked_domains is None:
+            domains = DEFAULT_BLOCKED_DOMAINS
+        else:
+            domains = parse_list(job.blocked_domains)
+
+        return cls(resource_types, domains)
+
+    @property
+    def is_empty(self):
+        return not self.resource_types and not self.domains
+
+    def _blocked_domain(self, url):
+        host = (urlsplit(url).hostname or '').lower()
+        while host:
+            if host in self.domains:
+                return True
+            _, _, host = host.partition('.')
+        return False
+
+    def should_block(self, request, main_frame=None):
+        # Never block the page itself
+        if request.resource_type == 'document' and (main_frame is None or request.frame == main_frame):
+            return False
+        if request.resource_type in self.resource_types:
+            return True
+        return bool(self.domains) and self._blocked_domain(request.url)
+
+    async def install(self, context, counter):
+        """Route every request of the context through the policy"""
+        if self.is_empty:
+            return
+
+        async def handle(route):
+            request = route.request
+            try:
+                main_frame = request.frame.page.main_frame if request.resource_type == 'document' else None
+            except Exception:
+                main_frame = None
+
+            if self.should_block(request, main_frame):
+                counter.add(request.resource_type)
+                await route.abort('blockedbyclient')
+            else:
+                await route.continue_()
+
+        await context.route('**/*', handle)
@@ -0,0 +1,136 @@
+import asyncio
+import ipaddress
+import logging
+import time
+from urllib.parse import urlsplit
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Public suffixes with two labels that are common in our jobs. Hosts under
+# these keep three labels as their registrable domain (shop.example.co.uk ->
+# example.co.uk). This is a heuristic, not the full public suffix list.
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au',
+    'co.in', 'net.in', 'org.in', 'firm.in', 'gen.in', 'ind.in',
+    'co.jp', 'ne.jp', 'or.jp', 'co.nz', 'co.za', 'co.kr', 'co.id', 'co.il',
+    'com.br', 'com.cn', 'com.mx', 'com.sg', 'com.tr', 'com.tw', 'com.hk',
+    'com.ar', 'com.my', 'com.ph', 'com.vn', 'com.pk', 'com.ng', 'com.eg',
+}
+
+
+def registrable_domain(url):
+    """Return the registrable domain of a URL, used as the politeness key"""
+    host = (urlsplit(url).hostname or '').lower().rstrip('.')
+    if not host:
+        return ''
+
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+
+    labels = host.split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out start times.
+
+    Tokens may go negative: every reservation takes its slot immediately and
+    is told how long to wait for it, so start times stay evenly paced no
+    matter how long each fetch takes.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost=1.0):
+        """Take `cost` tokens and return the delay before they are available"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def set_rate(self, rate):
+        self._refill(time.monotonic())
+        self.rate = rate
+
+
+class PolitenessScheduler:
+    """
+    Paces request start times per registrable domain, and optionally per proxy.
+
+    Each domain gets its own token bucket and its own rate, so a job that
+    mixes many sites is no longer throttled as if it were one. The rate of a
+    domain goes up slowly while it keeps succeeding and down when it blocks
+    or times out.
+    """
+
+    def __init__(self, default_rate=None, min_rate=None, max_rate=None, proxy_rate=None, burst=None):
+        self.default_rate = default_rate or getattr(settings, 'CRAWLER_HOST_RATE', 1.0)
+        self.min_rate = min_rate or getattr(settings, 'CRAWLER_HOST_MIN_RATE', 0.2)
+        self.max_rate = max_rate or getattr(settings, 'CRAWLER_HOST_MAX_RATE', 5.0)
+        self.proxy_rate = proxy_rate or getattr(settings, 'CRAWLER_PROXY_RATE', None)
+        self.burst = burst or getattr(settings, 'CRAWLER_HOST_BURST', 1.0)
+        self.increase_every = 10  # Successes on a domain before its rate goes up
+        self._hosts = {}
+        self._proxies = {}
+        self._successes = {}
+
+    def _host_bucket(self, host):
+        bucket = self._hosts.get(host)
+        if bucket is None:
+            bucket = self._hosts[host] = TokenBucket(self.default_rate, self.burst)
+        return bucket
+
+    async def acquire(self, url, cost=1.0):
+        """Wait until a request to the URL's domain may start"""
+        delay = self._host_bucket(registrable_domain(url)).reserve(cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire_proxy(self, proxy_id, cost=1.0):
+        """Wait until a request through the proxy may start (no-op without a proxy rate)"""
+        if not self.proxy_rate or proxy_id is None:
+            return
+        bucket = self._proxies.get(proxy_id)
+        if bucket is None:
+            bucket = self._proxies[proxy_id] = TokenBucket(self.proxy_rate, self.burst)
+        delay = bucket.reserve(cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def rate(self, url):
+        """Current request rate for the URL's domain"""
+        return self._host_bucket(registrable_domain(url)).rate
+
+    def adjust(self, url, factor):
+        """Scale the rate of the URL's domain, within the configured limits"""
+        host = registrable_domain(url)
+        bucket = self._host_bucket(host)
+        new_rate = max(self.min_rate, min(self.max_rate, bucket.rate * factor))
+        if new_rate != bucket.rate:
+            bucket.set_rate(new_rate)
+            logger.info(f"Rate for {host} changed to {new_rate:.2f} req/s")
+        return new_rate
+
+    def record_success(self, url):
+        """Count a success; returns True when the domain has earned a rate increase"""
+        host = registrable_domain(url)
+        self._successes[host] = self._successes.get(host, 0) + 1
+        return self._successes[host] % self.increase_every == 0
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Ensure the screenshots directory exists
+SCREENSHOTS_DIR = os.path.join(settings.BASE_DIR, 'static', 'screenshots')
+os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+
+
+class ScreenshotPolicy:
+    """
+    When and how the pages of a job are captured.
+
+    - off: never
+    - on_failure: a viewport capture when a URL fails, nothing on success
+    - viewport: the visible part of every page
+    - full_page: the whole scrollable page
+    """
+
+    def __init__(self, mode='on_failure', image_format='png', quality=None):
+        self.mode = mode
+        self.image_format = image_format
+        self.quality = quality
+
+    @classmethod
+    def for_job(cls, job):
+        return cls(job.screenshot_mode, job.screenshot_format, job.screenshot_quality)
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @property
+    def on_success(self):
+        return self.mode in ('viewport', 'full_page')
+
+    @property
+    def on_failure(self):
+        return self.enabled
+
+    @property
+    def extension(self):
+        return 'jpg' if self.image_format == 'jpeg' else 'png'
+
+    @property
+    def options(self):
+        """Keyword arguments for Playwright's page.screenshot()"""
+        options = {'type': self.image_format, 'full_page': self.mode == 'full_page'}
+        if self.image_format == 'jpeg' and self.quality:
+            options['quality'] = self.quality
+        return options
+
+
+class ScreenshotWriter:
+    """
+    Writes screenshot bytes to disk on background threads.
+
+    `submit` returns the relative path right away so the crawl can carry on;
+    files are written to a temporary name and renamed into place, so the
+    dashboard never serves a half-written image.
+    """
+
+    def __init__(self, directory=None, max_workers=None):
+        self.directory = directory or SCREENSHOTS_DIR
+        max_workers = max_workers or getattr(settings, 'CRAWLER_SCREENSHOT_WRITERS', 2)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='screenshot-writer')
+
+    @staticmethod
+    def _write(filepath, data):
+        tmp_path = f"{filepath}.part"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, filepath)
+        except OSError as e:
+            logger.error(f"Error writing screenshot {filepath}: {str(e)}")
+
+    def submit(self, url_id, data, extension='png'):
+        """Queue raw image bytes for writing and return the path to store in the database"""
+        filename = f"screenshot_{url_id}_{time.time_ns() // 1_000_000}.{extension}"
+        self._executor.submit(self._write, os.path.join(self.directory, filename), data)
+        return f"screenshots/{filename}"
+
+    async def close(self):
+        """Wait for queued writes to finish"""
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
@@ -1,67 +1,135 @@
-import requests
-import hashlib
 import time
 import random
 import asyncio
 import logging
-import os
-import base64
 import json
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from django.utils import timezone
 from django.conf import settings
 from django.db import transaction
 from asgiref.sync import sync_to_async
-from playwright.async_api import async_playwright
+from .browser_pool import BrowserPool
+from .cancellation import JobCancellation, clear_kill
+from .concurrency import ConcurrencyController
+from .dispatcher import WorkDispatcher
+from .extraction import PAGE_EXTRACTION_SCRIPT, extract_in_pool, extraction_limits, fingerprint_in_pool
+from .fingerprints import BlockPageIndex
+from .frontier import LinkFrontier
+from .http_fetcher import HttpFetcher, blocked_reason, conditional_headers, needs_browser, response_validators
+from .live_stats import FINAL_STATUSES, LiveStatsPublisher, clear_live_stats
+from .metrics import metrics
+from .proxy_pool import ProxyPool
+from .resource_policy import BlockedRequestCounter, ResourcePolicy
+from .scheduler import PolitenessScheduler, registrable_domain
+from .screenshots import ScreenshotPolicy, ScreenshotWriter
+from .write_buffer import WriteBehindBuffer
 from .models import Proxy, CrawlJob, CrawledURL, CrawlStats
+from .page_store import content_key
 
 logger = logging.getLogger(__name__)
 
-# Ensure the screenshots directory exists
-SCREENSHOTS_DIR = os.path.join(settings.BASE_DIR, 'static', 'screenshots')
-os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+@dataclass
+class ProxySyncResult:
+    """Outcome of a WebShare sync"""
+    added: int = 0
+    updated: int = 0
+    removed: int = 0  # Marked stale
+    total: int = 0  # Proxies listed by WebShare
+    error: str = None  # Set when the listing could not be fetched; nothing is changed then
+    
+    @property
+    def ok(self):
+        return self.error is None
+    
+    def __str__(self):
+        if not self.ok:
+            return f"sync failed: {self.error}"
+        return f"{self.total} proxies ({self.added} added, {self.updated} updated, {self.removed} removed)"
 
 class WebshareProxyService:
     """Service to interact with WebShare API for proxy management"""
     
     API_BASE_URL = "https://proxy.webshare.io/api/v2/proxy/list/"
     API_KEY = ""  # This should be in environment variables
+    MAX_PAGE_SIZE = 100  # Largest page the list API serves
+    
+    @classmethod
+    def get_api_url(cls):
+        return getattr(settings, 'WEBSHARE_API_URL', None) or cls.API_BASE_URL
     
     @classmethod
     def get_headers(cls):
         return {
-            "Authorization": f"Token {cls.API_KEY}"
+            "Authorization": f"Token {cls.API_KEY or getattr(settings, 'WEBSHARE_API_KEY', '')}"
         }
     
     @classmethod
-    def fetch_proxies(cls, page=1, page_size=25, countries=None):
-        """Fetch proxies from WebShare API with optional country filtering"""
-        url = f"{cls.API_BASE_URL}?mode=direct&page={page}&page_size={page_size}"
+    def _page_params(cls, page, page_size, countries):
+        params = {'mode': 'direct', 'page': page, 'page_size': page_size}
         
         # Add country filtering if provided
         if countries:
             # For WebShare API, country filtering is done like country_code=US,GB,CA
             if isinstance(countries, list):
-                countries_str = ','.join(countries)
-            else:
-                countries_str = countries
-            url += f"&country_code={countries_str}"
-            
+                countries = ','.join(countries)
+            params['country_code'] = countries
+        return params
+    
+    @classmethod
+    def _fetch_page(cls, client, page, page_size=MAX_PAGE_SIZE, countries=None):
+        """Fetch one page of the proxy list; raises httpx.HTTPError on failure"""
+        response = client.get(cls.get_api_url(), params=cls._page_params(page, page_size, countries))
+        response.raise_for_status()
+        return response.json()
+    
+    @classmethod
+    def fetch_proxies(cls, page=1, page_size=25, countries=None):
+        """Fetch proxies from WebShare API with optional country filtering"""
         try:
-            response = requests.get(url, headers=cls.get_headers())
-            response.raise_for_status()
-            data = response.json()
-            return data.get('results', [])
-        except requests.RequestException as e:
+            with httpx.Client(headers=cls.get_headers(), timeout=30) as client:
+                return cls._fetch_page(client, page, page_size, countries).get('results', [])
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Error fetching proxies: {str(e)}")
             return []
     
+    @classmethod
+    def fetch_all_proxies(cls, countries=None, max_workers=None):
+        """
+        Fetch every page of the proxy list.
+        
+        The first page gives the total count; the remaining pages are fetched
+        concurrently over one pooled client. Raises httpx.HTTPError if any
+        page fails, so a partial listing is never mistaken for the full one.
+        """
+        max_workers = max_workers or getattr(settings, 'WEBSHARE_SYNC_CONCURRENCY', 4)
+        limits = httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers)
+        
+        with httpx.Client(headers=cls.get_headers(), timeout=30, limits=limits) as client:
+            first = cls._fetch_page(client, 1, cls.MAX_PAGE_SIZE, countries)
+            proxies = list(first.get('results', []))
+            pages = -(-first.get('count', 0) // cls.MAX_PAGE_SIZE)
+            
+            if pages > 1:
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webshare-sync') as executor:
+                    # map keeps page order and re-raises the first failure
+                    for data in executor.map(
+                        lambda page: cls._fetch_page(client, page, cls.MAX_PAGE_SIZE, countries),
+                        range(2, pages + 1)
+                    ):
+                        proxies.extend(data.get('results', []))
+        
+        return proxies
+    
     @classmethod
     def get_available_countries(cls):
         """Get list of available countries from current proxies"""
         countries = Proxy.objects.filter(
-            is_blocked=False
+            is_blocked=False,
+            is_stale=False
         ).values_list('country_code', flat=True).distinct()
         
         # Return only non-empty country codes
@@ -69,100 +137,69 @@ class WebshareProxyService:
     
     @classmethod
     def sync_proxies(cls):
-        """Sync proxies from WebShare API to local database"""
-        proxies = cls.fetch_proxies(page_size=100)
-        
-        for proxy_data in proxies:
-            # Check if proxy already exists in the database
-            proxy, created = Proxy.objects.update_or_create(
-                ip_address=proxy_data.get('proxy_address'),
-                port=proxy_data.get('port'),
-                defaults={
-                    'username': proxy_data.get('username'),
-                    'password': proxy_data.get('password'),
-                    'country_code': proxy_data.get('country_code'),
-                }
-            )
-            
-        return len(proxies)
-    
-    @classmethod
-    def get_available_proxy(cls, countries=None, reshuffle=False, used_proxies=None):
         """
-        Get an available proxy using different selection strategies
-        
-        Args:
-            countries: Optional list or comma-separated string of country codes to filter by
-            reshuffle: If True, use round-robin selection instead of least recently used
-            used_proxies: List of proxy IDs already used in this session (for round-robin)
+        Sync proxies from WebShare API to local database.
         
-        Returns:
-            A Proxy object or None if no proxies are available
+        Every listed proxy is upserted in bulk on its address; proxies that
+        are no longer listed are marked stale rather than deleted, so their
+        crawl history is kept and they come back if WebShare lists them again.
         """
-        # Create base query for unblocked proxies
-        query = Proxy.objects.filter(is_blocked=False)
+        try:
+            listed = cls.fetch_all_proxies()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error syncing proxies: {str(e)}")
+            return ProxySyncResult(error=str(e))
         
-        # Add country filtering if provided
-        if countries:
-            if isinstance(countries, str):
-                # Split comma-separated string into list
-                countries = [c.strip() for c in countries.split(',') if c.strip()]
-            
-            if countries:  # Only filter if we have valid countries
-                query = query.filter(country_code__in=countries)
+        now = timezone.now()
+        rows = {}
+        for proxy_data in listed:
+            key = (proxy_data.get('proxy_address'), proxy_data.get('port'))
+            if not all(key):
+                continue
+            rows[key] = Proxy(
+                ip_address=key[0],
+                port=key[1],
+                username=proxy_data.get('username') or '',
+                password=proxy_data.get('password') or '',
+                country_code=proxy_data.get('country_code'),
+                is_stale=False,
+                synced_at=now,
+            )
         
-        # No available proxies? Try unblocking some that have been in cooloff long enough
-        if not query.exists():
-            cooloff_time = timezone.now() - timedelta(minutes=5)
-            blocked_query = Proxy.objects.filter(is_blocked=True, blocked_at__lt=cooloff_time)
-            
-            # Apply country filtering to blocked proxies too
-            if countries and isinstance(countries, list) and countries:
-                blocked_query = blocked_query.filter(country_code__in=countries)
-                
-            blocked_proxies = blocked_query.all()
-            
-            for proxy in blocked_proxies:
-                proxy.is_blocked = False
-                proxy.blocked_at = None
-                proxy.save(update_fields=['is_blocked', 'blocked_at'])
+        result = ProxySyncResult(total=len(rows))
+        with transaction.atomic():
+            existing = {
+                (p['ip_address'], p['port']): p
+                for p in Proxy.objects.values('ip_address', 'port', 'username', 'password', 'country_code', 'is_stale')
+            }
+            for key, proxy in rows.items():
+                current = existing.get(key)
+                if current is None:
+                    result.added += 1
+                elif (current['username'], current['password'], current['country_code'], current['is_stale']) != (
+                        proxy.username, proxy.password, proxy.country_code, False):
+                    result.updated += 1
             
-            # Refresh the query with newly unblocked proxies
-            query = Proxy.objects.filter(is_blocked=False)
-            if countries and isinstance(countries, list) and countries:
-                query = query.filter(country_code__in=countries)
-        
-        # Apply different selection strategies based on reshuffle flag
-        if not query.exists():
-            return None
+            Proxy.objects.bulk_create(
+                rows.values(),
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['ip_address', 'port'],
+                update_fields=['username', 'password', 'country_code', 'is_stale', 'synced_at'],
+            )
             
-        if reshuffle:
-            # Round-robin: exclude recently used proxies if possible
-            if used_proxies and len(used_proxies) < query.count():
-                available_proxies = query.exclude(id__in=used_proxies)
-                # If we've exhausted all proxies, reset and use all again
-                if not available_proxies.exists():
-                    available_proxies = query
-            else:
-                available_proxies = query
-                
-            # For round-robin, order randomly rather than by last_used
-            proxy = available_proxies.order_by('?').first()
-        else:
-            # Default: Use least-recently used proxy
-            proxy = query.order_by('last_used').first()
+            # Anything not listed this time has been replaced or removed upstream
+            result.removed = Proxy.objects.filter(is_stale=False).exclude(synced_at=now).update(is_stale=True)
         
-        # Update last_used timestamp
-        if proxy:
-            proxy.last_used = timezone.now()
-            proxy.save(update_fields=['last_used'])
-            
-        return proxy
+        logger.info(f"Synced WebShare proxies: {result}")
+        return result
 
 class CrawlerService:
     """Service for crawling URLs with proxy rotation"""
     
-    def __init__(self, job_id, debug_mode=False):
+    def __init__(self, job_id, debug_mode=False, browser_pool=None, scheduler=None, http_fetcher=None,
+                 screenshot_writer=None, write_buffer=None, proxy_pool=None, block_pages=None, frontier=None,
+                 cancellation=None, live_stats=None, revive_killed=True):
         self.job_id = job_id
         self.job = None
         self.stats = None
@@ -170,8 +207,26 @@ class CrawlerService:
         self.current_rate = 1.0  # Start conservatively with 1 request per second
         self.debug_mode = debug_mode
         self.current_url_id = None  # ID of the URL currently being processed
-        self.page_screenshot = None  # Base64-encoded screenshot
-        self.used_proxies = []  # Track proxies used for round-robin rotation
+        self.page_screenshot = None  # Path of the latest screenshot
+        self.proxy_pool = proxy_pool  # Shared in-memory proxy pool; created on demand if not given
+        self._owns_proxy_pool = False
+        self.browser_pool = browser_pool  # Shared pool; created on demand if not given
+        self._owns_browser_pool = False
+        self.http_fetcher = http_fetcher  # Shared HTTP client pool; created on demand if not given
+        self._owns_http_fetcher = False
+        self.screenshot_writer = screenshot_writer  # Shared background writer; created on demand if not given
+        self._owns_screenshot_writer = False
+        self.scheduler = scheduler or PolitenessScheduler()  # Per-domain request pacing
+        self.writes = write_buffer or WriteBehindBuffer(job_id=job_id)  # Batches per-URL database writes
+        self._owns_write_buffer = write_buffer is None
+        self.block_pages = block_pages or BlockPageIndex()  # Block page fingerprints seen in this job
+        self.hit_block_page = False  # The last crawl_url got a block page; the URL should go back in the queue
+        self.last_failure = None  # 'timeout' or 'block' when the last crawl_url failed that way
+        self.attempt_proxy = None  # Proxy the last crawl_url went through, even if it was dropped since
+        self.frontier = frontier  # Link-following jobs only; loaded by process_job if not given
+        self.cancellation = cancellation  # Set when the job is killed; created by process_job if not given
+        self.live_stats = live_stats  # Publishes flushed counters to the dashboard; created by process_job if not given
+        self.revive_killed = revive_killed  # Whether process_job runs a killed job again; supervisors never do
     
     @sync_to_async
     def _init_job_and_stats(self):
@@ -179,29 +234,37 @@ class CrawlerService:
         self.job = CrawlJob.objects.get(id=self.job_id)
         self.stats, created = CrawlStats.objects.get_or_create(job=self.job)
         logger.info(f"Initialized job {self.job_id} and stats (created: {created})")
+    
+    @sync_to_async
+    def _load_frontier(self):
+        """Load the seen-set of a link-following job"""
+        if self.frontier is None:
+            self.frontier = LinkFrontier.for_job(self.job)
         
     def calculate_content_hash(self, content):
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
+        return content_key(content)
     
-    @sync_to_async
-    def _get_available_proxy(self):
-        """Get an available proxy in async context, using country filtering if specified"""
+    async def _get_available_proxy(self):
+        """Get an available proxy from the in-memory pool, using country filtering if specified"""
+        if self.proxy_pool is None:
+            self.proxy_pool = await ProxyPool().start()
+            self._owns_proxy_pool = True
+        
         # Get proxy countries from job if set
         countries = self.job.proxy_countries if self.job and self.job.proxy_countries else None
         reshuffle = self.job.reshuffle_proxies if self.job else False
+        strategy = self.job.proxy_selection if self.job else 'lru'
         
-        # Get a proxy using the appropriate strategy
-        proxy = WebshareProxyService.get_available_proxy(
-            countries=countries,
-            reshuffle=reshuffle,
-            used_proxies=self.used_proxies if reshuffle else None
-        )
-        
-        # Track this proxy for round-robin if we're reshuffling
-        if proxy and reshuffle and proxy.id not in self.used_proxies:
-            self.used_proxies.append(proxy.id)
-            
-        return proxy
+        # Next proxy in rotation when reshuffling, else picked by the job's selection strategy
+        return self.proxy_pool.acquire(countries=countries, reshuffle=reshuffle, strategy=strategy)
+    
+    def _proxy_timeout(self, is_retry):
+        """Seconds to wait for a response: 2 minutes for retries, else 30 seconds or less for proxies known to be fast"""
+        if is_retry:
+            return 120
+        if self.proxy_pool and self.current_proxy:
+            return self.proxy_pool.timeout_for(self.current_proxy, 30)
+        return 30
     
     @sync_to_async
     def _update_job_status(self, status, cooloff_until=None):
@@ -210,63 +273,88 @@ class CrawlerService:
         if cooloff_until:
             self.job.cooloff_until = cooloff_until
         self.job.save(update_fields=['status', 'cooloff_until'] if cooloff_until else ['status'])
+        if self.live_stats:
+            self.live_stats.publish_status(status, cooloff_until)
     
-    @sync_to_async
-    def _update_job_progress(self, success):
-        """Update job progress in async context"""
+    async def _update_job_progress(self, success):
+        """Count a processed URL on the job"""
         if success:
             self.job.urls_processed += 1
-            self.job.save(update_fields=['urls_processed'])
+            self.writes.increment(CrawlJob, self.job_id, urls_processed=1)
             
-    @sync_to_async
-    def _update_rate(self, new_rate):
+    def _adjust_rate(self, url, factor):
+        """Scale the crawl rate of the URL's domain and record it on the job"""
+        self.current_rate = self.scheduler.adjust(url, factor)
+        self.job.current_rate = self.current_rate
+        self.writes.set_values(CrawlJob, self.job_id, current_rate=self.current_rate)
+    
+    async def _update_rate(self, url, factor):
         """Update crawl rate in async context"""
-        self.current_rate = new_rate
-        self.job.current_rate = new_rate
-        self.job.save(update_fields=['current_rate'])
+        self._adjust_rate(url, factor)
     
-    @sync_to_async
-    def _update_proxy_stats(self, proxy=None):
-        """Update proxy stats in async context"""
+    async def _update_proxy_stats(self, proxy=None):
+        """Record the proxy in use on the job stats"""
         self.stats.current_proxy = proxy
-        self.stats.save(update_fields=['current_proxy'])
+        self.writes.set_values(CrawlStats, self.stats.id, current_proxy=proxy)
     
-    @sync_to_async
-    def _mark_proxy_blocked(self):
-        """Mark current proxy as blocked in async context"""
+    async def _mark_proxy_blocked(self):
+        """Mark current proxy as blocked"""
+        self._mark_proxy_blocked_sync()
+    
+    def _mark_proxy_blocked_sync(self):
+        """Mark current proxy as blocked; the pool brings it back after its cooldown"""
         if self.current_proxy:
-            self.current_proxy.is_blocked = True
-            self.current_proxy.blocked_at = timezone.now()
-            self.current_proxy.save(update_fields=['is_blocked', 'blocked_at'])
+            self.proxy_pool.mark_blocked(self.current_proxy)
             
             self.job.rate_limit_hits += 1
             self.stats.blocked_proxies_count += 1
-            self.job.save(update_fields=['rate_limit_hits'])
-            self.stats.save(update_fields=['blocked_proxies_count'])
+            self.writes.increment(CrawlJob, self.job_id, rate_limit_hits=1)
+            self.writes.increment(CrawlStats, self.stats.id, blocked_proxies_count=1)
     
-    @sync_to_async
-    def _update_url_pre_crawl(self, crawled_url):
-        """Update URL before crawling in async context"""
+    async def _update_blocked_stats(self, blocked):
+        """Add requests skipped by the resource policy to the job stats"""
+        self.writes.increment(
+            CrawlStats, self.stats.id,
+            blocked_requests=blocked.requests,
+            blocked_bytes=blocked.bytes
+        )
+    
+    async def _update_url_pre_crawl(self, crawled_url):
+        """Record the proxy used for a URL"""
         self.current_url_id = crawled_url.id
         crawled_url.proxy_used = self.current_proxy
-        crawled_url.save(update_fields=['proxy_used'])
+        self.writes.record_url(crawled_url, ['proxy_used'])
         return crawled_url
     
-    @sync_to_async
-    def _update_url_post_crawl(self, crawled_url, content, content_hash, status_code, structured_content=None):
-        """Update URL after successful crawl in async context"""
-        crawled_url.content = content
+    async def _update_url_post_crawl(self, crawled_url, content, content_hash, status_code, structured_content=None,
+                                     fetched_via='browser', validators=None, fingerprint=None):
+        """Record a successful crawl of a URL"""
+        # The HTML goes to the page store; the URL keeps its key
+        self.writes.store_page(content_hash, content)
+        crawled_url.page_id = content_hash
         crawled_url.content_hash = content_hash
         crawled_url.status_code = status_code
+        crawled_url.fetched_via = fetched_via
         crawled_url.crawled_at = timezone.now()
         crawled_url.retry_count = 0
         crawled_url.retry_status = 'success'
+        crawled_url.unchanged = False
+        crawled_url.simhash = fingerprint
+        
+        # Validators of this response replace those of the previous page, even when it sent none
+        validators = validators or {}
+        crawled_url.etag = validators.get('etag')
+        crawled_url.last_modified = validators.get('last_modified')
+        
+        fields = ['page_id', 'content_hash', 'status_code', 'fetched_via', 'crawled_at', 'retry_count', 'retry_status',
+                  'unchanged', 'etag', 'last_modified', 'simhash']
         
         # Save structured content if available
         if structured_content:
             crawled_url.structured_content = json.dumps(structured_content, ensure_ascii=False)
+            fields.append('structured_content')
             
-        crawled_url.save()
+        self.writes.record_url(crawled_url, fields)
         
         # Clear current URL ID after successful crawl
         self.current_url_id = None
@@ -275,131 +363,386 @@ class CrawlerService:
         # Update stats
         self.stats.successful_requests += 1
         self.stats.last_request_time = timezone.now()
-        self.stats.save(update_fields=['successful_requests', 'last_request_time'])
+        self.writes.increment(CrawlStats, self.stats.id, successful_requests=1)
+        self.writes.set_values(CrawlStats, self.stats.id, last_request_time=self.stats.last_request_time)
     
-    @sync_to_async
-    def _update_url_retry(self, crawled_url, is_blocking=False, is_timeout=False, screenshot_path=None):
-        """Update URL retry count in async context"""
+    async def _update_url_unchanged(self, crawled_url, fetched_via, validators=None):
+        """Record a recrawl that found the stored page unchanged"""
+        crawled_url.fetched_via = fetched_via
+        crawled_url.crawled_at = timezone.now()
+        crawled_url.retry_count = 0
+        crawled_url.retry_status = 'success'
+        crawled_url.unchanged = True
+        
+        fields = ['fetched_via', 'crawled_at', 'retry_count', 'retry_status', 'unchanged']
+        
+        # A 304 may carry fresh validators; keep the stored ones otherwise
+        for field, value in (validators or {}).items():
+            if value:
+                setattr(crawled_url, field, value)
+                fields.append(field)
+        
+        self.writes.record_url(crawled_url, fields)
+        self.current_url_id = None
+        
+        self.stats.successful_requests += 1
+        self.stats.unchanged_requests += 1
+        self.stats.last_request_time = timezone.now()
+        self.writes.increment(CrawlStats, self.stats.id, successful_requests=1, unchanged_requests=1)
+        self.writes.set_values(CrawlStats, self.stats.id, last_request_time=self.stats.last_request_time)
+    
+    async def _update_url_retry(self, crawled_url, is_blocking=False, is_timeout=False, screenshot_path=None):
+        """Record a failed attempt at a URL"""
         crawled_url.retry_count += 1
         
-        # If it's a timeout, mark for retry
-        if is_timeout:
-            crawled_url.retry_status = 'timeout'
-        elif crawled_url.retry_status == 'retry_pending' and crawled_url.retry_count >= 2:
+        if self.proxy_pool and self.current_proxy:
+            self.proxy_pool.record_failure(self.current_proxy, timeout=is_timeout)
+        
+        if crawled_url.retry_status == 'retry_pending' and crawled_url.retry_count >= 2:
             # If this was already a retry attempt and it failed again, mark as failed
             crawled_url.retry_status = 'failed'
+        elif is_timeout:
+            # If it's a timeout, mark for retry
+            crawled_url.retry_status = 'timeout'
+        if is_timeout:
+            self.last_failure = 'timeout'
         
         # If we have a screenshot, save its path
         if screenshot_path:
             crawled_url.screenshot_path = screenshot_path
         
-        crawled_url.save(update_fields=['retry_count', 'retry_status', 'screenshot_path'] 
-                         if screenshot_path else ['retry_count', 'retry_status'])
+        self.writes.record_url(crawled_url, ['retry_count', 'retry_status', 'screenshot_path']
+                               if screenshot_path else ['retry_count', 'retry_status'])
         
         if is_blocking and crawled_url.retry_count >= 3:
             # After 3 retries with same content, assume we're blocked
-            self._mark_proxy_blocked()
+            await self._mark_proxy_blocked()
             
-            # Adjust crawl rate more conservatively
-            self.current_rate = max(0.2, self.current_rate * 0.5)
-            self.job.current_rate = self.current_rate
-            self.job.save(update_fields=['current_rate'])
+            # Crawl this domain more conservatively
+            self._adjust_rate(crawled_url.url, 0.5)
         
         # Update stats for failed request
         self.stats.failed_requests += 1
-        self.stats.save(update_fields=['failed_requests'])
-    
-    @sync_to_async
-    def _get_pending_urls(self):
-        """Get pending URLs for processing in async context"""
-        return list(self.job.urls.filter(
-            content__isnull=True, 
-            retry_status__in=['pending', 'retry_pending']
-        ).order_by('id'))
+        self.writes.increment(CrawlStats, self.stats.id, failed_requests=1)
     
-    @sync_to_async
-    def _get_timeout_urls(self):
-        """Get URLs that timed out and need retry"""
-        return list(self.job.urls.filter(retry_status='timeout').order_by('id'))
-    
-    @sync_to_async
-    def _mark_url_for_retry(self, crawled_url):
+    async def _mark_url_for_retry(self, crawled_url):
         """Mark a URL as ready for retry"""
         crawled_url.retry_status = 'retry_pending'
-        crawled_url.save(update_fields=['retry_status'])
+        self.writes.record_url(crawled_url, ['retry_status'])
         return crawled_url
     
-    @sync_to_async
-    def _check_if_killed(self):
-        """Check if the job has been marked as killed"""
-        # Refresh the job from the database to get the latest status
-        job = CrawlJob.objects.get(id=self.job_id)
-        return job.status == 'killed'
+    async def _mark_url_failed(self, crawled_url):
+        """Give up on a URL after its last attempt, so it counts towards the job's failed URLs"""
+        if crawled_url.retry_status != 'failed':
+            crawled_url.retry_status = 'failed'
+            self.writes.record_url(crawled_url, ['retry_status'])
     
-    @sync_to_async
-    def _save_screenshot(self, url_id, screenshot_data):
-        """Save screenshot data for a URL"""
-        self.page_screenshot = screenshot_data
+    async def _take_screenshot(self, page, crawled_url):
+        """
+        Capture the page as the job's screenshot policy says and queue the
+        bytes for writing; returns the relative path, or None.
+        """
+        if page is None:
+            return None
         
-        # Also save to disk
-        timestamp = int(time.time())
-        filename = f"screenshot_{url_id}_{timestamp}.png"
-        filepath = os.path.join(SCREENSHOTS_DIR, filename)
+        policy = ScreenshotPolicy.for_job(self.job)
+        try:
+            with metrics.timer('crawler_screenshot_seconds', job=self.job_id):
+                screenshot_data = await page.screenshot(**policy.options)
+        except Exception as e:
+            logger.error(f"Error taking screenshot of {crawled_url.url}: {str(e)}")
+            return None
         
-        # Decode base64 and save to file
-        with open(filepath, 'wb') as f:
-            f.write(base64.b64decode(screenshot_data.split(',')[1]))
+        if self.screenshot_writer is None:
+            self.screenshot_writer = ScreenshotWriter()
+            self._owns_screenshot_writer = True
         
-        # Return the relative path to be saved in the database
-        return f"screenshots/{filename}"
+        self.page_screenshot = self.screenshot_writer.submit(crawled_url.id, screenshot_data, policy.extension)
+        return self.page_screenshot
     
-    async def setup_browser(self):
-        """Set up a Playwright browser with proxy"""
-        playwright = await async_playwright().start()
-        
+    async def setup_proxy(self):
+        """Pick a proxy for the next request, entering cooloff if none is available"""
         if not self.current_proxy:
             self.current_proxy = await self._get_available_proxy()
             if not self.current_proxy:
                 await self._update_job_status('cooloff', timezone.now() + timedelta(minutes=5))
-                return None, None
+                return None
+            self.attempt_proxy = self.current_proxy
             
             await self._update_proxy_stats(self.current_proxy)
         
-        # Configure browser with proxy
+        return self.current_proxy
+    
+    async def setup_browser(self):
+        """Pick a proxy and open a fresh browser context for it from the pool"""
+        if not await self.setup_proxy():
+            return None
+        
+        # Configure the proxy on the context so pooled browsers can be reused
         proxy_config = {
             "server": f"http://{self.current_proxy.ip_address}:{self.current_proxy.port}",
             "username": self.current_proxy.username,
             "password": self.current_proxy.password
         }
         
-        # Launch browser with headless mode based on debug setting
-        browser_options = {
-            "headless": not self.debug_mode,  # Run non-headless in debug mode
-            "proxy": proxy_config
-        }
-        
-        browser = await playwright.chromium.launch(**browser_options)
+        if self.browser_pool is None:
+            self.browser_pool = BrowserPool(headless=not self.debug_mode, job_id=self.job_id)
+            self._owns_browser_pool = True
         
         # Create context with viewport settings
-        context_options = {"viewport": {"width": 1280, "height": 800}}
-        context = await browser.new_context(**context_options)
+        return await self.browser_pool.acquire_context(
+            proxy=proxy_config,
+            viewport={"width": 1280, "height": 800}
+        )
+    
+    async def close_pools(self):
+        """Close the browser pool, HTTP clients, screenshot writer and proxy pool if this service created them"""
+        if self.browser_pool and self._owns_browser_pool:
+            await self.browser_pool.close()
+            self.browser_pool = None
+            self._owns_browser_pool = False
+        if self.http_fetcher and self._owns_http_fetcher:
+            await self.http_fetcher.close()
+            self.http_fetcher = None
+            self._owns_http_fetcher = False
+        if self.screenshot_writer and self._owns_screenshot_writer:
+            await self.screenshot_writer.close()
+            self.screenshot_writer = None
+            self._owns_screenshot_writer = False
+        if self.proxy_pool and self._owns_proxy_pool:
+            await self.proxy_pool.close()
+            self.proxy_pool = None
+            self._owns_proxy_pool = False
+    
+    async def _record_success(self, crawled_url, content, status_code, structured_content, response_time,
+                              fetched_via, screenshot_path=None, latency=None, validators=None, fingerprint=None):
+        """Save a fetched page, unless it repeats the previous content or looks like a known block page"""
+        content_hash = self.calculate_content_hash(content)
         
-        return playwright, browser
+        if crawled_url.page_id == content_hash:
+            # A recrawl got the very page that is already stored
+            return await self._record_unchanged(crawled_url, response_time, fetched_via, latency, validators)
+        
+        reason = self._block_page_reason(crawled_url, status_code, content, structured_content, fingerprint)
+        if reason:
+            await self._handle_block_page(crawled_url, reason, screenshot_path)
+            return False
+        
+        # Time to first response feeds the proxy's health score
+        if self.proxy_pool and self.current_proxy:
+            self.proxy_pool.record_success(self.current_proxy, latency if latency is not None else response_time)
+        
+        # Save the successful response with structured content
+        await self._update_url_post_crawl(
+            crawled_url, 
+            content, 
+            content_hash, 
+            status_code,
+            structured_content=structured_content,
+            fetched_via=fetched_via,
+            validators=validators,
+            fingerprint=fingerprint
+        )
+        
+        await self._record_response_time(crawled_url, response_time)
+        
+        if self.frontier:
+            self._add_links(crawled_url, structured_content)
+        return True
+    
+    def _add_links(self, crawled_url, structured_content):
+        """Queue the new same-site links of a crawled page for insertion into the job"""
+        new_urls = self.frontier.discover(crawled_url, structured_content)
+        if new_urls:
+            self.writes.add_urls(new_urls)
+            logger.debug(f"Found {len(new_urls)} new URLs on {crawled_url.url}")
+    
+    def _block_page_reason(self, crawled_url, status_code, content, structured_content, fingerprint):
+        """Why a response is a block page rather than the page asked for, or None"""
+        domain = registrable_domain(crawled_url.url)
+        if self.block_pages.matches(domain, fingerprint):
+            return "near a known block page"
+        
+        reason = blocked_reason(status_code, content)
+        if reason:
+            # Later variants of this page, with other tokens in them, are caught by fingerprint
+            self.block_pages.add(domain, fingerprint)
+            return reason
+        
+        text = (structured_content or {}).get('text_content') or ''
+        if self.block_pages.observe(domain, crawled_url.id, fingerprint, len(text)):
+            return "same short page served for several URLs"
+        return None
+    
+    async def _handle_block_page(self, crawled_url, reason, screenshot_path=None):
+        """Burn the proxy that got a block page and send the URL back to the queue"""
+        logger.warning(f"Block page for {crawled_url.url} through proxy {self.current_proxy}: {reason}")
+        self.hit_block_page = True
+        self.last_failure = 'block'
+        
+        await self._update_url_retry(crawled_url, screenshot_path=screenshot_path)
+        if crawled_url.retry_count >= getattr(settings, 'CRAWLER_MAX_URL_ATTEMPTS', 3):
+            crawled_url.retry_status = 'failed'
+            self.writes.record_url(crawled_url, ['retry_status'])
+        
+        self.stats.block_pages += 1
+        self.writes.increment(CrawlStats, self.stats.id, block_pages=1)
+        
+        # Don't wait for three strikes: this proxy is burned for the site
+        await self._mark_proxy_blocked()
+        self._adjust_rate(crawled_url.url, 0.5)
+        self.current_proxy = None
+        await self._update_proxy_stats(None)
+    
+    async def _record_unchanged(self, crawled_url, response_time, fetched_via, latency=None, validators=None):
+        """Keep the stored page of a URL whose recrawl found it unchanged"""
+        if self.proxy_pool and self.current_proxy:
+            self.proxy_pool.record_success(self.current_proxy, latency if latency is not None else response_time)
+        
+        await self._update_url_unchanged(crawled_url, fetched_via, validators)
+        await self._record_response_time(crawled_url, response_time)
+        return True
+    
+    async def _record_response_time(self, crawled_url, response_time):
+        """Fold a successful response into the job's average and the domain's rate"""
+        # Totals rather than an average, so every worker and process adds to the same mean
+        self.stats.response_time_total += response_time
+        self.stats.response_count += 1
+        self.writes.increment(CrawlStats, self.stats.id, response_time_total=response_time, response_count=1)
+        
+        # If successful, slightly increase the domain's rate every 10 successes on it
+        if self.scheduler.record_success(crawled_url.url):
+            await self._update_rate(crawled_url.url, 1.1)
     
     async def crawl_url(self, crawled_url, is_retry=False):
-        """Crawl a single URL with the current proxy"""
+        """Crawl a single URL with the current proxy, over HTTP or in a browser per the job's fetch mode"""
         # Always select a new proxy for each attempt (including retries)
         self.current_proxy = None
-        playwright, browser = await self.setup_browser()
+        self.attempt_proxy = None
+        self.hit_block_page = False
+        self.last_failure = None
         
-        if not browser:
+        success = None
+        fetch_mode = self.job.fetch_mode if self.job else 'browser'
+        if fetch_mode != 'browser':
+            success = await self._crawl_url_http(crawled_url, is_retry, allow_fallback=(fetch_mode == 'auto'))
+        
+        # The browser reuses the proxy picked for the HTTP attempt, if any
+        if success is None:
+            success = await self._crawl_url_browser(crawled_url, is_retry)
+        
+        self._count_attempt(crawled_url, success)
+        return success
+    
+    def _count_attempt(self, crawled_url, success):
+        """Count a crawl attempt in the metrics by outcome, proxy and domain"""
+        if success:
+            outcome = 'success'
+        elif self.last_failure:
+            outcome = self.last_failure
+        elif self.attempt_proxy is None:
+            outcome = 'no_proxy'
+        else:
+            outcome = 'error'
+        metrics.inc('crawler_requests_total', job=self.job_id, outcome=outcome)
+        metrics.inc('crawler_domain_requests_total', job=self.job_id, domain=registrable_domain(crawled_url.url),
+                    outcome=outcome)
+        if self.attempt_proxy:
+            proxy = f"{self.attempt_proxy.ip_address}:{self.attempt_proxy.port}"
+            metrics.inc('crawler_proxy_requests_total', job=self.job_id, proxy=proxy, outcome=outcome)
+    
+    async def _crawl_url_http(self, crawled_url, is_retry=False, allow_fallback=True):
+        """
+        Fetch a URL with the pooled HTTP client.
+        
+        Returns True or False like crawl_url, or None when the response needs a
+        browser and `allow_fallback` is set.
+        """
+        if not await self.setup_proxy():
             return False
         
+        if self.http_fetcher is None:
+            self.http_fetcher = HttpFetcher()
+            self._owns_http_fetcher = True
+        
+        crawled_url = await self._update_url_pre_crawl(crawled_url)
+        await self.scheduler.acquire_proxy(self.current_proxy.id)
+        
+        timeout = self._proxy_timeout(is_retry)  # Same budget as browser navigation
+        revalidate = conditional_headers(crawled_url)
+        start_time = time.time()
+        
         try:
+            with metrics.timer('crawler_navigation_seconds', job=self.job_id, via='http'):
+                result = await self.http_fetcher.fetch(crawled_url.url, self.current_proxy, timeout=timeout,
+                                                       headers=revalidate)
+        except httpx.TimeoutException as e:
+            logger.warning(f"HTTP timeout for URL {crawled_url.url}: {str(e)}")
+            await self._update_url_retry(crawled_url, is_timeout=True)
+            await self._update_rate(crawled_url.url, 0.8)
+            return False
+        except httpx.HTTPError as e:
+            logger.error(f"HTTP error fetching {crawled_url.url}: {str(e)}")
+            if allow_fallback:
+                return None
+            await self._update_url_retry(crawled_url)
+            return False
+        
+        response_time = time.time() - start_time
+        metrics.inc('crawler_responses_total', job=self.job_id, status_code=result.status_code)
+        
+        if revalidate and result.status_code == 304:
+            # Not modified: nothing was downloaded and nothing needs parsing
+            return await self._record_unchanged(crawled_url, response_time, 'http',
+                                                validators=response_validators(result.headers))
+        
+        reason = needs_browser(result)
+        if reason and allow_fallback:
+            logger.info(f"Escalating {crawled_url.url} to browser: {reason}")
+            return None
+        
+        # Parsing is CPU-bound, keep it off the event loop
+        with metrics.timer('crawler_extraction_seconds', job=self.job_id):
+            structured_content, fingerprint = await extract_in_pool(result.text, result.url)
+        
+        return await self._record_success(
+            crawled_url,
+            result.text,
+            result.status_code,
+            structured_content,
+            response_time,
+            fetched_via='http',
+            validators=response_validators(result.headers),
+            fingerprint=fingerprint
+        )
+    
+    async def _crawl_url_browser(self, crawled_url, is_retry=False):
+        """Crawl a single URL in a pooled browser context"""
+        context = await self.setup_browser()
+        
+        if not context:
+            return False
+        
+        page = None
+        blocked = BlockedRequestCounter()
+        screenshots = ScreenshotPolicy.for_job(self.job)
+        try:
+            # Skip images, fonts, media and trackers as the job's resource policy says
+            await ResourcePolicy.for_job(self.job).install(context, blocked)
+            
+            # Pace requests through the same proxy if a per-proxy rate is configured
+            await self.scheduler.acquire_proxy(self.current_proxy.id)
+            
             # Update the URL status
             crawled_url = await self._update_url_pre_crawl(crawled_url)
             
-            page = await browser.new_page()
+            page = await context.new_page()
+            
+            # On a recrawl, revalidate the stored page; subresources load as usual
+            revalidate = conditional_headers(crawled_url)
+            if revalidate:
+                # Playwright matches the normalised URL, which can differ from the stored one; the handler picks the navigation
+                await page.route('**/*', self._revalidation_handler(page, revalidate))
             
             # Add debug delay if in debug mode (artificial delay for better visibility)
             if self.debug_mode:
@@ -409,35 +752,36 @@ class CrawlerService:
             
             # Navigate to the URL
             # Use longer timeout for retry attempts
-            timeout = 120000 if is_retry else 30000  # 2 minutes for retry, 30 seconds otherwise
+            timeout = self._proxy_timeout(is_retry) * 1000
             
             try:
                 logger.info(f"Starting navigation to {crawled_url.url}")
                 
                 # In debug mode, wait longer between actions
-                if self.debug_mode:
+                if self.debug_mode and screenshots.enabled:
                     # Don't reduce the timeout in debug mode - give it the full time
                     # Take an early screenshot before navigation
-                    if page:
-                        try:
-                            screenshot_data = await page.screenshot(type='png', full_page=True)
-                            await self._save_screenshot(
-                                crawled_url.id, 
-                                f"data:image/png;base64,{base64.b64encode(screenshot_data).decode('utf-8')}"
-                            )
-                            logger.info("Took pre-navigation screenshot")
-                            await asyncio.sleep(2)  # Give time to see the screenshot
-                        except Exception as e:
-                            logger.error(f"Error taking pre-navigation screenshot: {str(e)}")
+                    if await self._take_screenshot(page, crawled_url):
+                        logger.info("Took pre-navigation screenshot")
+                        await asyncio.sleep(2)  # Give time to see the screenshot
                 
                 # Modified navigation to be more robust
-                response = await page.goto(
-                    crawled_url.url, 
-                    wait_until='domcontentloaded',  # Changed from networkidle to load faster
-                    timeout=timeout
-                )
+                with metrics.timer('crawler_navigation_seconds', job=self.job_id, via='browser'):
+                    response = await page.goto(
+                        crawled_url.url, 
+                        wait_until='domcontentloaded',  # Changed from networkidle to load faster
+                        timeout=timeout
+                    )
+                latency = time.time() - start_time
                 
                 logger.info(f"Initial navigation completed with status: {response.status if response else 'None'}")
+                if response:
+                    metrics.inc('crawler_responses_total', job=self.job_id, status_code=response.status)
+                
+                if revalidate and response and response.status == 304:
+                    # Not modified: keep the stored page, no rendering or extraction
+                    return await self._record_unchanged(crawled_url, latency, 'browser', latency,
+                                                        response_validators(response.headers))
                 
                 # After basic navigation, wait for network to become idle with a separate timeout
                 if self.debug_mode:
@@ -446,13 +790,11 @@ class CrawlerService:
                         await asyncio.sleep(2)
                         logger.info("Waiting for network idle...")
                         # Take a screenshot after initial load but before network idle
-                        screenshot_data = await page.screenshot(type='png', full_page=True)
-                        await self._save_screenshot(
-                            crawled_url.id, 
-                            f"data:image/png;base64,{base64.b64encode(screenshot_data).decode('utf-8')}"
-                        )
+                        if screenshots.enabled:
+                            await self._take_screenshot(page, crawled_url)
                         # Wait for network idle separately with longer timeout
-                        await page.wait_for_load_state('networkidle', timeout=timeout)
+                        with metrics.timer('crawler_networkidle_wait_seconds', job=self.job_id):
+                            await page.wait_for_load_state('networkidle', timeout=timeout)
                         logger.info("Network idle reached")
                         await asyncio.sleep(3)  # Extra time to see the final state
                     except Exception as e:
@@ -460,61 +802,59 @@ class CrawlerService:
                 else:
                     try:
                         # For non-debug mode, still wait for network idle but with shorter timeout
-                        await page.wait_for_load_state('networkidle', timeout=15000)
+                        with metrics.timer('crawler_networkidle_wait_seconds', job=self.job_id):
+                            await page.wait_for_load_state('networkidle', timeout=15000)
                     except Exception as e:
                         logger.warning(f"Network idle timeout in regular mode: {str(e)}")
                 
-                # Take a final screenshot regardless of network idle status
-                if page:
-                    screenshot_data = await page.screenshot(type='png', full_page=True)
-                    screenshot_path = await self._save_screenshot(
-                        crawled_url.id, 
-                        f"data:image/png;base64,{base64.b64encode(screenshot_data).decode('utf-8')}"
-                    )
+                # Take a final screenshot regardless of network idle status, if
+                # the job keeps screenshots of successful pages
+                screenshot_path = None
+                if screenshots.on_success:
+                    screenshot_path = await self._take_screenshot(page, crawled_url)
                 
                 # Calculate response time
                 response_time = time.time() - start_time
                 
                 if response:
                     status_code = response.status
-                    content = await page.content()
+                    extract_in_browser = getattr(settings, 'CRAWLER_EXTRACT_IN_BROWSER', False)
                     
-                    # Extract structured content for easier processing
-                    structured_content = await self._extract_content(page)
+                    if extract_in_browser:
+                        content, structured_content, fingerprint = await self._extract_in_browser(page)
+                    else:
+                        content = await page.content()
                     
-                    # Check if content is useful (not a 404 or blocked page)
-                    # If previous content hash exists, compare with new hash
-                    content_hash = self.calculate_content_hash(content)
+                    # Capture challenge and block pages while they are open
+                    if (screenshot_path is None and screenshots.on_failure
+                            and blocked_reason(status_code, content)):
+                        screenshot_path = await self._take_screenshot(page, crawled_url)
                     
-                    if crawled_url.content_hash and crawled_url.content_hash == content_hash:
-                        # Same content as before, might be a block page
-                        await self._update_url_retry(crawled_url, is_blocking=True, screenshot_path=screenshot_path)
-                        return False
+                    if not extract_in_browser:
+                        page_url = page.url
+                        if not self.debug_mode:
+                            # Hand the browser back before parsing; extraction runs in the process pool
+                            await self.browser_pool.release_context(context)
+                            context = page = None
+                        with metrics.timer('crawler_extraction_seconds', job=self.job_id):
+                            structured_content, fingerprint = await extract_in_pool(content, page_url)
                     
-                    # Save the successful response with structured content
-                    await self._update_url_post_crawl(
-                        crawled_url, 
-                        content, 
-                        content_hash, 
+                    return await self._record_success(
+                        crawled_url,
+                        content,
                         status_code,
-                        structured_content=structured_content
+                        structured_content,
+                        response_time,
+                        fetched_via='browser',
+                        screenshot_path=screenshot_path,
+                        latency=latency,
+                        validators=response_validators(response.headers),
+                        fingerprint=fingerprint
                     )
-                    
-                    # Update average response time
-                    if self.stats.avg_response_time == 0:
-                        self.stats.avg_response_time = response_time
-                    else:
-                        self.stats.avg_response_time = (self.stats.avg_response_time + response_time) / 2
-                    await sync_to_async(self.stats.save)(update_fields=['avg_response_time'])
-                    
-                    # If successful, slightly increase rate if we've had 10+ successful requests
-                    if self.stats.successful_requests % 10 == 0:
-                        new_rate = min(5.0, self.current_rate * 1.1)  # Cap at 5 req/sec
-                        await self._update_rate(new_rate)
-                    
-                    return True
                 else:
                     # Failed to get a response
+                    if screenshot_path is None and screenshots.on_failure:
+                        screenshot_path = await self._take_screenshot(page, crawled_url)
                     await self._update_url_retry(crawled_url, screenshot_path=screenshot_path)
                     return False
             except Exception as e:
@@ -523,18 +863,11 @@ class CrawlerService:
                 
                 # Take a screenshot before handling the error
                 screenshot_path = None
-                if page:
-                    try:
-                        screenshot_data = await page.screenshot(type='png', full_page=True)
-                        screenshot_path = await self._save_screenshot(
-                            crawled_url.id, 
-                            f"data:image/png;base64,{base64.b64encode(screenshot_data).decode('utf-8')}"
-                        )
-                        # In debug mode, add extra delay to see the error state
-                        if self.debug_mode:
-                            await asyncio.sleep(3)
-                    except Exception as screenshot_error:
-                        logger.error(f"Error taking error screenshot: {str(screenshot_error)}")
+                if screenshots.on_failure:
+                    screenshot_path = await self._take_screenshot(page, crawled_url)
+                    # In debug mode, add extra delay to see the error state
+                    if screenshot_path and self.debug_mode:
+                        await asyncio.sleep(3)
                 
                 # Explicitly check for timeout
                 if "timeout" in str(e).lower():
@@ -551,18 +884,11 @@ class CrawlerService:
             
             # Try to take a screenshot if possible
             screenshot_path = None
-            try:
-                if page:
-                    screenshot_data = await page.screenshot(type='png', full_page=True)
-                    screenshot_path = await self._save_screenshot(
-                        crawled_url.id, 
-                        f"data:image/png;base64,{base64.b64encode(screenshot_data).decode('utf-8')}"
-                    )
-                    # In debug mode, wait a bit to show the error state
-                    if self.debug_mode:
-                        await asyncio.sleep(2)
-            except:
-                logger.error("Failed to take error screenshot")
+            if screenshots.on_failure:
+                screenshot_path = await self._take_screenshot(page, crawled_url)
+                # In debug mode, wait a bit to show the error state
+                if screenshot_path and self.debug_mode:
+                    await asyncio.sleep(2)
             
             # Check if this was a timeout
             is_timeout = "timeout" in str(e).lower()
@@ -570,9 +896,8 @@ class CrawlerService:
             
             # Check if this might be a rate limit or blocking issue
             if "timeout" in str(e).lower() or "navigation failed" in str(e).lower():
-                # Potential rate limit - slow down
-                new_rate = max(0.2, self.current_rate * 0.8)
-                await self._update_rate(new_rate)
+                # Potential rate limit - slow down this domain
+                await self._update_rate(crawled_url.url, 0.8)
                 
                 # If multiple consecutive failures, mark proxy as blocked
                 if crawled_url.retry_count >= 3:
@@ -586,85 +911,107 @@ class CrawlerService:
             if self.debug_mode:
                 await asyncio.sleep(5)  # 5 second delay before closing in debug mode
                 
-            # Close browser and playwright
-            if browser:
-                await browser.close()
-            if playwright:
-                await playwright.stop()
+            # Close the context unless it was handed back early; the browser stays in the pool for the next URL
+            if context is not None:
+                await self.browser_pool.release_context(context)
+            
+            if blocked.requests:
+                await self._update_blocked_stats(blocked)
     
     async def process_job(self):
         """Process all URLs in the job"""
         # Initialize job and stats
         await self._init_job_and_stats()
+        await self._load_frontier()
+        
+        # Running a killed job again takes back the kill, unless it was killed after a supervisor claimed it
+        if self.job.status == 'killed':
+            if not self.revive_killed:
+                logger.info(f"Job {self.job_id} was killed before it started")
+                return
+            clear_kill(self.job_id)
+        self.cancellation = await JobCancellation(self.job_id).start()
+        
+        # Dashboards follow the counters this crawler writes without querying them
+        if self.live_stats is None:
+            self.live_stats = LiveStatsPublisher(self.job, self.stats)
+            self.writes.listeners.append(self.live_stats.record_flush)
         
         # Update job status
         await self._update_job_status('running')
         
-        # Get all pending URLs
-        urls = await self._get_pending_urls()
+        # Per-URL results are written in batches
+        await self.writes.start()
         
-        # Process URLs - first pass
-        for url in urls:
-            # Check if job has been killed
-            if await self._check_if_killed():
-                logger.info(f"Job {self.job_id} was killed. Stopping.")
-                break
-                
+        # URLs are leased from the job, so other crawler processes can share it;
+        # buffered results are written before their leases are released
+        dispatcher = await WorkDispatcher(self.job_id, before_release=self.writes.flush,
+                                          grows=self.frontier is not None).start()
+        
+        try:
+            # A kill cancels the loop, and with it the crawl in progress
+            await self.cancellation.run(self._crawl_urls(dispatcher))
+            
+            # Job completed - only mark as completed if it wasn't killed
+            await self.writes.flush()
+            if dispatcher.drained and not self.cancellation.is_set:
+                await self._update_job_status('completed')
+        finally:
+            # Write whatever is still buffered, also when the job was killed or failed
+            if self._owns_write_buffer:
+                await self.writes.close()
+            await dispatcher.close()
+            await self.cancellation.close()
+            await self.close_pools()
+            # Once the job has stopped, dashboards read its counts from the database
+            if self.cancellation.is_set or self.job.status in FINAL_STATUSES:
+                clear_live_stats(self.job_id)
+    
+    async def _crawl_urls(self, dispatcher):
+        """Crawl URLs from the dispatcher until it runs dry"""
+        while True:
             if self.job.status == 'cooloff':
                 # Wait for cooloff period to complete
                 if self.job.cooloff_until and self.job.cooloff_until > timezone.now():
                     wait_time = (self.job.cooloff_until - timezone.now()).total_seconds()
                     await asyncio.sleep(wait_time)
                 
-                # Check if job was killed during cooloff
-                if await self._check_if_killed():
-                    logger.info(f"Job {self.job_id} was killed during cooloff. Stopping.")
-                    break
-                
                 # Reset cooloff status
                 await self._update_job_status('running')
             
-            # Process the URL
-            success = await self.crawl_url(url)
+            item = await dispatcher.next()
+            if item is None:
+                break
+            url, is_retry = item
             
-            # Update job progress
-            await self._update_job_progress(success)
+            # Wait for the URL's domain to allow another request; retries
+            # take two tokens so they go at half the domain's rate
+            await self.scheduler.acquire(url.url, cost=2 if is_retry else 1)
             
-            # Respect the current rate limit
-            await asyncio.sleep(1 / self.current_rate)
-        
-        # Get URLs that timed out during the first pass
-        timeout_urls = await self._get_timeout_urls()
-        
-        if timeout_urls and not await self._check_if_killed():
-            logger.info(f"Starting second pass for {len(timeout_urls)} timed-out URLs with extended timeout")
+            # Process the URL; timed-out URLs come back once with an extended timeout
+            success = await self.crawl_url(url, is_retry=is_retry)
             
-            # Mark all timeout URLs as pending for retry
-            for url in timeout_urls:
-                await self._mark_url_for_retry(url)
+            if not success and self.job.status == 'cooloff':
+                # No proxy was available, try this URL again after the cooloff
+                await dispatcher.requeue(url, is_retry=is_retry)
+                continue
             
-            # Process URLs with extended timeout - second pass
-            for url in timeout_urls:
-                # Check if job has been killed
-                if await self._check_if_killed():
-                    logger.info(f"Job {self.job_id} was killed during retry phase. Stopping.")
-                    break
-                
-                # Process the URL with extended timeout
-                success = await self.crawl_url(url, is_retry=True)
-                
-                # Only update progress if we had a new success
-                if success:
-                    await self._update_job_progress(success)
-                
-                # Use a slower rate for retries to be extra careful
-                retry_rate = max(0.5, self.current_rate * 0.5)
-                await asyncio.sleep(1 / retry_rate)
-        
-        # Job completed - only mark as completed if it wasn't killed
-        if not await self._check_if_killed():
-            await self._update_job_status('completed')
+            if not success and self.hit_block_page and url.retry_status != 'failed':
+                # The proxy got a block page and was taken out; try again through another one
+                await dispatcher.requeue(url, is_retry=is_retry)
+                continue
+            
+            # Timed-out URLs get one more attempt; other failures are final
+            retry = not success and url.retry_status == 'timeout'
+            if retry and not is_retry:
+                await self._mark_url_for_retry(url)
+            elif not success:
+                await self._mark_url_failed(url)
+            await dispatcher.complete(url, success, retry=retry)
             
+            # Update job progress
+            await self._update_job_progress(success)
+    
     @sync_to_async
     def get_current_url_status(self):
         """Get the status of the currently processing URL"""
@@ -681,132 +1028,92 @@ class CrawlerService:
                 return None
         return None
 
+    @staticmethod
+    def _revalidation_handler(page, headers):
+        """
+        Route handler that adds conditional headers to the navigation of the
+        page itself only: not to subresources, frames or redirect targets
+        """
+        async def handler(route):
+            request = route.request
+            if (request.is_navigation_request() and request.frame == page.main_frame
+                    and request.redirected_from is None):
+                await route.continue_(headers={**request.headers, **headers})
+            else:
+                await route.fallback()
+        return handler
+    
+    async def _extract_in_browser(self, page):
+        """
+        Extract structured content with a script in the live page, parsing
+        the HTML in the process pool instead if the script fails.
+        
+        Returns (html, structured_content, fingerprint).
+        """
+        with metrics.timer('crawler_extraction_seconds', job=self.job_id):
+            # HTML and structured content come back in a single round trip
+            content, structured_content = await self._extract_content(page)
+            if structured_content is None:
+                structured_content, fingerprint = await extract_in_pool(content, page.url)
+                return content, structured_content, fingerprint
+        fingerprint = await fingerprint_in_pool(structured_content.get('text_content'))
+        return content, structured_content, fingerprint
+    
     async def _extract_content(self, page):
-        """Extract structured content from a page"""
+        """
+        Extract the page HTML and its structured content in one evaluate.
+        
+        Returns (html, structured_content); structured_content is None if the
+        extraction script failed.
+        """
         try:
-            # Basic structured data
-            structured_data = {
-                'title': await page.title(),
-                'url': page.url,
-                'timestamp': timezone.now().isoformat(),
-                'text_content': '',
-                'meta': {},
-                'links': [],
-                'images': [],
-                'tables': []
-            }
-            
-            # Extract meta tags
-            meta_tags = await page.evaluate("""() => {
-                const metaTags = {};
-                document.querySelectorAll('meta').forEach(tag => {
-                    const name = tag.getAttribute('name') || tag.getAttribute('property');
-                    const content = tag.getAttribute('content');
-                    if (name && content) {
-                        metaTags[name] = content;
-                    }
-                });
-                return metaTags;
-            }""")
-            structured_data['meta'] = meta_tags
-            
-            # Extract main text content (visible text nodes)
-            text_content = await page.evaluate("""() => {
-                function getVisibleText(node) {
-                    let text = '';
-                    if (node.nodeType === Node.TEXT_NODE) {
-                        return node.textContent.trim();
-                    } else if (node.nodeType === Node.ELEMENT_NODE) {
-                        const style = window.getComputedStyle(node);
-                        const isHidden = style.display === 'none' || style.visibility === 'hidden';
-                        if (!isHidden) {
-                            if (node.tagName === 'P' || node.tagName === 'H1' || node.tagName === 'H2' || 
-                                node.tagName === 'H3' || node.tagName === 'H4' || node.tagName === 'H5' || 
-                                node.tagName === 'DIV' || node.tagName === 'SPAN' || node.tagName === 'LI') {
-                                let nodeText = '';
-                                for (let child of node.childNodes) {
-                                    nodeText += ' ' + getVisibleText(child);
-                                }
-                                return nodeText.trim();
-                            } else {
-                                let childrenText = '';
-                                for (let child of node.childNodes) {
-                                    childrenText += ' ' + getVisibleText(child);
-                                }
-                                return childrenText.trim();
-                            }
-                        }
-                    }
-                    return '';
-                }
-                
-                // Get visible text from body, skipping script and style elements
-                const text = getVisibleText(document.body)
-                    .replace(/\\s+/g, ' ')
-                    .trim();
-                return text;
-            }""")
-            structured_data['text_content'] = text_content
-            
-            # Extract links
-            links = await page.evaluate("""() => {
-                return Array.from(document.querySelectorAll('a[href]')).map(a => {
-                    return {
-                        text: a.textContent.trim(),
-                        href: a.href,
-                        title: a.title || '',
-                    };
-                });
-            }""")
-            structured_data['links'] = links
-            
-            # Extract images
-            images = await page.evaluate("""() => {
-                return Array.from(document.querySelectorAll('img')).map(img => {
-                    return {
-                        src: img.src,
-                        alt: img.alt || '',
-                        width: img.width,
-                        height: img.height
-                    };
-                });
-            }""")
-            structured_data['images'] = images
-            
-            # Extract tables
-            tables = await page.evaluate("""() => {
-                return Array.from(document.querySelectorAll('table')).map(table => {
-                    const rows = Array.from(table.querySelectorAll('tr')).map(row => {
-                        const cells = Array.from(row.querySelectorAll('td, th')).map(cell => {
-                            return cell.textContent.trim();
-                        });
-                        return cells;
-                    });
-                    return rows;
-                });
-            }""")
-            structured_data['tables'] = tables
-            
-            return structured_data
+            data = await page.evaluate(PAGE_EXTRACTION_SCRIPT, extraction_limits())
         except Exception as e:
             logger.error(f"Error extracting content: {str(e)}")
-            return None
+            return await page.content(), None
+        
+        structured_data = {
+            'title': data['title'],
+            'url': data['url'],
+            'timestamp': timezone.now().isoformat(),
+            'text_content': data['text_content'],
+            'meta': data['meta'],
+            'links': data['links'],
+            'images': data['images'],
+            'tables': data['tables']
+        }
+        return data['html'], structured_data
 
 class ParallelCrawlerService:
     """Service for crawling URLs with multiple workers and proxy rotation"""
     
-    def __init__(self, job_id, debug_mode=False, worker_count=3):
+    def __init__(self, job_id, debug_mode=False, worker_count=3, browser_pool=None, revive_killed=True):
         self.job_id = job_id
         self.job = None
         self.worker_count = max(1, min(worker_count, 20))  # Ensure worker count is between 1 and 20
         self.debug_mode = debug_mode
         self.workers = []  # Will store worker instances
-        self.used_proxies = []  # For tracking used proxies in round-robin mode
+        self.proxy_pool = None  # In-memory proxy pool shared by all workers
+        self.browser_pool = browser_pool  # Shared by all workers of this job; created if not given
+        self._owns_browser_pool = browser_pool is None
+        self.dispatcher = None  # Hands out each URL to exactly one worker
+        self.scheduler = PolitenessScheduler()  # Per-domain pacing shared by all workers
+        self.http_fetcher = None  # HTTP client pool shared by all workers
+        self.screenshot_writer = None  # Background screenshot writes shared by all workers
+        self.writes = WriteBehindBuffer(job_id=job_id)  # Batched database writes of all workers
+        self.block_pages = BlockPageIndex()  # Block pages learned by any worker are recognised by all
+        self.frontier = None  # Seen-set of a link-following job, shared by all workers
+        self.concurrency = None  # Adaptive limits on the requests in flight; worker_count is its ceiling
+        self.cancellation = None  # Set when the job is killed; watched once for all workers
+        self.live_stats = None  # Publishes the counters all workers write to the dashboard
+        self.revive_killed = revive_killed  # Whether process_job runs a killed job again; supervisors never do
+        self.stats_id = None
         
     @sync_to_async
     def _init_job(self):
         """Initialize job object"""
         self.job = CrawlJob.objects.get(id=self.job_id)
+        self.frontier = LinkFrontier.for_job(self.job)
         logger.info(f"Initialized parallel job {self.job_id} with {self.worker_count} workers")
         
     @sync_to_async
@@ -816,39 +1123,31 @@ class ParallelCrawlerService:
         if cooloff_until:
             self.job.cooloff_until = cooloff_until
         self.job.save(update_fields=['status', 'cooloff_until'] if cooloff_until else ['status'])
+        if self.live_stats:
+            self.live_stats.publish_status(status, cooloff_until)
     
-    @sync_to_async
-    def _get_pending_urls(self):
-        """Get a batch of pending URLs"""
-        # Get URLs that haven't been processed yet
-        return list(CrawledURL.objects.filter(
-            job_id=self.job_id,
-            content__isnull=True,
-            retry_status='pending'
-        ).values_list('id', flat=True)[:100])
-    
-    @sync_to_async
-    def _get_timeout_urls(self):
-        """Get URLs that timed out and need retry"""
-        return list(CrawledURL.objects.filter(job_id=self.job_id, retry_status='timeout').values_list('id', flat=True))
+    async def _mark_url_for_retry(self, crawled_url):
+        """Mark URL for retry"""
+        crawled_url.retry_status = 'retry_pending'
+        self.writes.record_url(crawled_url, ['retry_status'])
     
-    @sync_to_async
-    def _mark_url_for_retry(self, url_id):
-        """Mark URL for retry in async context"""
-        CrawledURL.objects.filter(id=url_id).update(retry_status='retry_pending')
+    async def _mark_url_failed(self, crawled_url):
+        """Give up on a URL after its last attempt, so it counts towards the job's failed URLs"""
+        if crawled_url.retry_status != 'failed':
+            crawled_url.retry_status = 'failed'
+            self.writes.record_url(crawled_url, ['retry_status'])
     
-    @sync_to_async
-    def _check_if_killed(self):
-        """Check if job has been killed in async context"""
-        job = CrawlJob.objects.get(id=self.job_id)
-        return job.status == 'killed'
+    async def _record_failed_attempt(self, crawled_url):
+        """Count an attempt that failed before the crawler could record it, and give up on the URL"""
+        crawled_url.retry_count += 1
+        crawled_url.retry_status = 'failed'
+        self.writes.record_url(crawled_url, ['retry_count', 'retry_status'])
     
-    @sync_to_async
-    def _update_job_progress(self, success):
-        """Update job progress in async context"""
+    async def _update_job_progress(self, success):
+        """Count a processed URL on the job"""
         if success:
-            # Use F() to handle concurrent updates
-            CrawlJob.objects.filter(id=self.job_id).update(urls_processed=F('urls_processed') + 1)
+            # Buffered as an F() increment, so concurrent workers never lose counts
+            self.writes.increment(CrawlJob, self.job_id, urls_processed=1)
     
     @sync_to_async
     def _init_stats(self):
@@ -858,154 +1157,175 @@ class ParallelCrawlerService:
             logger.info(f"Created new stats for job {self.job_id}")
         return stats
     
-    @sync_to_async
-    def _get_available_proxy(self):
-        """Get an available proxy that respects job settings"""
-        countries = self.job.proxy_countries if self.job else None
-        reshuffle = self.job.reshuffle_proxies if self.job else False
-        
-        proxy = WebshareProxyService.get_available_proxy(
-            countries=countries,
-            reshuffle=reshuffle,
-            used_proxies=self.used_proxies if reshuffle else None
-        )
-        
-        # Track used proxies for round-robin mode
-        if proxy and reshuffle and proxy.id not in self.used_proxies:
-            self.used_proxies.append(proxy.id)
-            
-        return proxy
+    def _record_concurrency(self, controller, changed=True):
+        """Keep the job's concurrency limit and its recent changes on the stats"""
+        self.writes.set_values(CrawlStats, self.stats_id, concurrency_limit=controller.job.limit,
+                               concurrency_log=controller.log_json)
+        if changed:
+            self.writes.increment(CrawlStats, self.stats_id, concurrency_changes=1)
+    
+    async def _crawl_within_limits(self, worker_service, url, is_retry):
+        """Crawl a URL once the job and its domain have room, and report how it went to the controller"""
+        slot = await self.concurrency.acquire(url.url)
+        started = time.monotonic()
+        outcome = 'error'
+        try:
+            success = await worker_service.crawl_url(url, is_retry=is_retry)
+            if success:
+                outcome = 'success'
+            elif worker_service.last_failure:
+                outcome = worker_service.last_failure
+            elif worker_service.job.status == 'cooloff':
+                # No proxy was free; that says nothing about the site
+                outcome = None
+            return success
+        except asyncio.CancelledError:
+            # The job was killed or the crawler is stopping, which says nothing about the site either
+            outcome = None
+            raise
+        finally:
+            await self.concurrency.release(slot, time.monotonic() - started, outcome)
+    
+    async def _wait_for_cooloff(self, worker_service):
+        """Sleep until the job's cooloff period is over"""
+        cooloff_until = worker_service.job.cooloff_until
+        if cooloff_until and cooloff_until > timezone.now():
+            await asyncio.sleep((cooloff_until - timezone.now()).total_seconds())
+        await worker_service._update_job_status('running')
     
     async def worker(self, worker_id):
-        """Worker process that crawls URLs"""
+        """Worker process that crawls URLs handed out by the dispatcher"""
         logger.info(f"Starting worker {worker_id} for job {self.job_id}")
         
-        # Create a worker-specific crawler service
-        worker_service = CrawlerService(self.job_id, debug_mode=self.debug_mode)
+        # Create a worker-specific crawler service backed by the shared browser pool
+        worker_service = CrawlerService(
+            self.job_id,
+            debug_mode=self.debug_mode,
+            browser_pool=self.browser_pool,
+            scheduler=self.scheduler,
+            http_fetcher=self.http_fetcher,
+            screenshot_writer=self.screenshot_writer,
+            write_buffer=self.writes,
+            proxy_pool=self.proxy_pool,
+            block_pages=self.block_pages,
+            frontier=self.frontier,
+            cancellation=self.cancellation,
+            live_stats=self.live_stats
+        )
         
         # Initialize the worker service
         await worker_service._init_job_and_stats()
         
-        # If we're using reshuffle mode, override the worker's proxy selection
-        # to use our centralized proxy management
-        if self.job and self.job.reshuffle_proxies:
-            # Replace the worker's _get_available_proxy method with our own
-            worker_service._original_get_proxy = worker_service._get_available_proxy
-            worker_service._get_available_proxy = self._get_available_proxy
-        
         self.workers.append(worker_service)
         
         while True:
-            # Check if the job has been killed
-            if await self._check_if_killed():
-                logger.info(f"Worker {worker_id} stopping because job was killed")
-                break
-                
-            # Get an available URL to process
-            url_id = None
-            
-            # Try to get a pending URL first
-            pending_urls = await self._get_pending_urls()
-            if pending_urls:
-                url_id = pending_urls[0]
-            
-            # If no pending URLs, try timeout URLs
-            if url_id is None:
-                timeout_urls = await self._get_timeout_urls()
-                if timeout_urls:
-                    url_id = timeout_urls[0]
-                    # Mark it as retry_pending so other workers don't grab it
-                    await self._mark_url_for_retry(url_id)
-            
-            # If we have a URL to process, crawl it
-            if url_id:
-                try:
-                    url = await sync_to_async(CrawledURL.objects.get)(id=url_id)
-                    success = await worker_service.crawl_url(url)
-                    
-                    # Update the main job's progress counter
-                    if success:
-                        await self._update_job_progress(True)
-                        
-                except Exception as e:
-                    logger.exception(f"Worker {worker_id} error processing URL {url_id}: {str(e)}")
-            else:
-                # No URLs to process, check if we're done
-                if await sync_to_async(self.job.__class__.objects.get)(id=self.job_id).urls_processed >= await sync_to_async(lambda: self.job.urls_total)():
-                    logger.info(f"Worker {worker_id} finishing - all URLs processed")
-                    break
-                
-                # Wait briefly before checking again
-                await asyncio.sleep(1)
-        
-        logger.info(f"Worker {worker_id} finished for job {self.job_id}")
-    
-    async def retry_processor(self):
-        """Process URLs that need to be retried"""
-        logger.info(f"Starting retry processor for job {self.job_id}")
-        
-        while True:
-            # Check if the job has been killed
-            if await self._check_if_killed():
-                logger.info(f"Retry processor stopping because job was killed")
+            item = await self.dispatcher.next()
+            if item is None:
+                logger.info(f"Worker {worker_id} finishing - all URLs processed")
                 break
             
-            # Get URLs that need to be retried
-            retry_urls = await sync_to_async(list)(CrawledURL.objects.filter(
-                job_id=self.job_id,
-                retry_status='retry_pending'
-            ))
+            url, is_retry = item
+            try:
+                await self.scheduler.acquire(url.url, cost=2 if is_retry else 1)
+                success = await self._crawl_within_limits(worker_service, url, is_retry)
+            except Exception as e:
+                logger.exception(f"Worker {worker_id} error processing URL {url.id}: {str(e)}")
+                # Count the attempt and fail the URL, so it is not claimed again forever
+                await self._record_failed_attempt(url)
+                await self.dispatcher.complete(url, False)
+                continue
+            
+            # No proxy was available: put the URL back and sit out the cooloff
+            if not success and worker_service.job.status == 'cooloff':
+                await self.dispatcher.requeue(url, is_retry=is_retry)
+                await self._wait_for_cooloff(worker_service)
+                continue
             
-            if retry_urls:
-                logger.info(f"Found {len(retry_urls)} URLs to retry for job {self.job_id}")
-                
-                # Pick an available worker
-                if self.workers:
-                    # Simple round-robin for now
-                    for i, url in enumerate(retry_urls):
-                        worker = self.workers[i % len(self.workers)]
-                        await worker.crawl_url(url, is_retry=True)
+            # The proxy got a block page and was taken out: try again through another one
+            if not success and worker_service.hit_block_page and url.retry_status != 'failed':
+                await self.dispatcher.requeue(url, is_retry=is_retry)
+                continue
+            
+            # Timed-out URLs get one more attempt with the extended timeout; other failures are final
+            retry = not success and url.retry_status == 'timeout'
+            if retry and not is_retry:
+                await self._mark_url_for_retry(url)
+            elif not success:
+                await self._mark_url_failed(url)
             
-            # Wait before checking again
-            await asyncio.sleep(5)
+            await self.dispatcher.complete(url, success, retry=retry)
+            
+            # Update the main job's progress counter
+            if success:
+                await self._update_job_progress(True)
         
-        logger.info(f"Retry processor finished for job {self.job_id}")
+        logger.info(f"Worker {worker_id} finished for job {self.job_id}")
     
     async def process_job(self):
         """Main method to process a parallel crawl job"""
         # Initialize the job
         await self._init_job()
         
+        # Running a killed job again takes back the kill, unless it was killed after a supervisor claimed it
+        if self.job.status == 'killed':
+            if not self.revive_killed:
+                logger.info(f"Job {self.job_id} was killed before it started")
+                return
+            clear_kill(self.job_id)
+        self.cancellation = await JobCancellation(self.job_id).start()
+        
         # Update job status to running
         await self._update_job_status('running')
         
+        # One pool of long-lived browsers serves every worker
+        if self._owns_browser_pool:
+            self.browser_pool = await BrowserPool(headless=not self.debug_mode, job_id=self.job_id).start()
+        self.http_fetcher = HttpFetcher()
+        self.screenshot_writer = ScreenshotWriter()
+        self.proxy_pool = await ProxyPool().start()
+        await self.writes.start()
+        self.dispatcher = await WorkDispatcher(self.job_id, before_release=self.writes.flush,
+                                               grows=self.frontier is not None).start()
+        
         try:
             # Initialize stats
-            await self._init_stats()
+            stats = await self._init_stats()
+            self.stats_id = stats.id
+            self.live_stats = LiveStatsPublisher(self.job, stats)
+            self.writes.listeners.append(self.live_stats.record_flush)
+            self.concurrency = ConcurrencyController(self.worker_count, on_change=self._record_concurrency)
+            self._record_concurrency(self.concurrency, changed=False)
             
-            # Create worker tasks
+            # Create worker tasks and wait until the dispatcher has drained
             worker_tasks = []
             for i in range(self.worker_count):
                 worker_tasks.append(asyncio.create_task(self.worker(i + 1)))
             
-            # Create retry processor task
-            retry_task = asyncio.create_task(self.retry_processor())
+            # A kill cancels every worker, and with them the crawls in progress
+            await self.cancellation.run(asyncio.gather(*worker_tasks))
             
-            # Wait for all workers to complete
-            await asyncio.gather(*worker_tasks)
-            
-            # Cancel the retry processor when workers are done
-            retry_task.cancel()
-            
-            # Mark job as completed if all URLs have been processed
-            job = await sync_to_async(CrawlJob.objects.get)(id=self.job_id)
-            if job.urls_processed >= job.urls_total:
+            # Only mark as completed if the job wasn't killed
+            await self.writes.flush()
+            if self.dispatcher.drained and not self.cancellation.is_set:
+                logger.info(f"Parallel job {self.job_id} drained: {len(self.dispatcher.done)} succeeded, "
+                            f"{len(self.dispatcher.failed)} failed")
                 await self._update_job_status('completed')
-            else:
-                await self._update_job_status('failed')
                 
         except Exception as e:
             logger.exception(f"Error in parallel job {self.job_id}: {str(e)}")
             await self._update_job_status('failed')
+        finally:
+            # Write whatever is still buffered, also when the job was killed or failed
+            await self.writes.close()
+            await self.dispatcher.close()
+            await self.cancellation.close()
+            if self._owns_browser_pool:
+                await self.browser_pool.close()
+            await self.http_fetcher.close()
+            await self.screenshot_writer.close()
+            await self.proxy_pool.close()
+            # Once the job has stopped, dashboards read its counts from the database
+            if self.cancellation.is_set or self.job.status in FINAL_STATUSES:
+                clear_live_stats(self.job_id)
             
-        logger.info(f"Parallel job {self.job_id} finished") 
\ No newline at end of file
+        logger.info(f"Parallel job {self.job_id} finished") 
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import signal
+import django
+
+logger = logging.getLogger(__name__)
+
+# Only Django and the standard library are imported at module level: crawler
+# processes are spawned, and import this module before Django is set up
+
+
+def run_job(job, workers):
+    """
+    Crawl a job in this process with `workers` workers until it is done.
+
+    SIGTERM cancels the crawl, so it writes its buffered results and releases
+    its URL leases before returning; the job stays running for whichever
+    process carries on. Returns False if the crawl was stopped that way.
+    """
+    from .services import CrawlerService, ParallelCrawlerService
+
+    if workers > 1:
+        crawler = ParallelCrawlerService(job.id, debug_mode=job.debug_mode, worker_count=workers)
+    else:
+        crawler = CrawlerService(job.id, debug_mode=job.debug_mode)
+
+    async def run():
+        task = asyncio.create_task(crawler.process_job())
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            logger.info(f"Crawler for job {job.id} stopped by SIGTERM")
+            return False
+        return True
+
+    return asyncio.run(run())
+
+
+def run_shard(job_id, workers, extract_processes=None):
+    """Entry point of one of the crawler processes started by run_crawler --processes"""
+    # Ctrl-C reaches the whole process group; the parent passes it on as SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
+
+    from django.conf import settings
+    from .extraction import shutdown_extraction_pool
+    from .metrics import metrics
+    from .models import CrawlJob
+
+    if extract_processes:
+        # Processes of one job share the CPUs rather than each taking them all
+        settings.CRAWLER_EXTRACT_PROCESSES = extract_processes
+    metrics.start()
+    try:
+        run_job(CrawlJob.objects.get(id=job_id), workers)
+    finally:
+        shutdown_extraction_pool()
+        metrics.retire()
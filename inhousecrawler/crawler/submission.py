@@ -0,0 +1,101 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from django.conf import settings
+from .frontier import MAX_URL_LENGTH, normalize_url, url_key
+from .models import CrawledURL, CrawlJob
+
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_REJECTS = 100  # Rejected lines listed individually; the rest are only counted
+
+
+@dataclass
+class SubmissionResult:
+    """Outcome of importing the URLs of a job"""
+    accepted: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    rejected_lines: list = field(default_factory=list)  # (line number, reason, line) of the first rejects
+
+    def reject(self, line_number, reason, line):
+        self.rejected += 1
+        if len(self.rejected_lines) < MAX_REPORTED_REJECTS:
+            self.rejected_lines.append((line_number, reason, line[:200]))
+
+    def __str__(self):
+        return f"{self.accepted} URLs accepted, {self.duplicates} duplicates skipped, {self.rejected} lines rejected"
+
+
+def _line_url(line):
+    """
+    The URL on one input line: plain text, an NDJSON string, or an NDJSON
+    object with a "url" key. Raises ValueError for malformed JSON.
+    """
+    if not isinstance(line, str):
+        # Already parsed, from a JSON array
+        return line.get('url') if isinstance(line, dict) else None
+
+    line = line.strip()
+    if line.startswith(('{', '"')):
+        value = json.loads(line)
+        if isinstance(value, dict):
+            value = value.get('url')
+        return value if isinstance(value, str) else None
+    return line
+
+
+def import_urls(job, lines, batch_size=None):
+    """
+    Add URLs to a new job from an iterable of input lines, streaming.
+
+    Lines are plain URLs or NDJSON; blank lines and lines starting with '#'
+    are skipped. URLs are normalized and deduplicated by a 64-bit hash of
+    the normalized URL, and inserted `batch_size` rows at a time, each batch
+    in its own short transaction. The job's urls_total is set at the end.
+    """
+    batch_size = batch_size or getattr(settings, 'CRAWLER_SUBMIT_BATCH_SIZE', 1000)
+    result = SubmissionResult()
+    seen = set()
+    batch = []
+
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        try:
+            raw = _line_url(line)
+        except ValueError:
+            result.reject(line_number, 'invalid JSON', line.strip())
+            continue
+        if isinstance(raw, str) and (not raw.strip() or raw.lstrip().startswith('#')):
+            continue
+
+        url = normalize_url(raw) if isinstance(raw, str) else None
+        if url is None:
+            result.reject(line_number, 'not an http(s) URL', str(raw if raw is not None else line).strip())
+            continue
+        if len(url) > MAX_URL_LENGTH:
+            result.reject(line_number, 'URL too long', url)
+            continue
+
+        key = url_key(url)
+        short_key = int(key[:16], 16)
+        if short_key in seen:
+            result.duplicates += 1
+            continue
+        seen.add(short_key)
+
+        batch.append(CrawledURL(job=job, url=url, url_key=key))
+        if len(batch) >= batch_size:
+            CrawledURL.objects.bulk_create(batch)
+            result.accepted += len(batch)
+            batch = []
+
+    if batch:
+        CrawledURL.objects.bulk_create(batch)
+        result.accepted += len(batch)
+
+    CrawlJob.objects.filter(pk=job.pk).update(urls_total=result.accepted)
+    job.urls_total = result.accepted
+    logger.info(f"Job {job.id}: {result}")
+    return result
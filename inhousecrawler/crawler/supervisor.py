@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from .browser_pool import BrowserPool
+from .dispatcher import make_worker_id
+from .models import CrawlJob
+from .services import CrawlerService, ParallelCrawlerService
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlSupervisor:
+    """
+    Long-lived process that runs crawl jobs.
+
+    Picks up queued jobs, and running jobs whose supervisor stopped sending
+    heartbeats (it crashed or was killed), and runs up to `max_jobs` of them
+    at once on one event loop. Jobs run by run_crawler have no supervisor
+    and are left alone.
+    Jobs share one browser pool, and their workers together stay within
+    `max_workers`; a job asking for more workers than that gets the whole
+    budget.
+
+    Every `poll_interval` seconds the supervisor stamps heartbeat_at on its
+    jobs, reaps finished ones and starts new ones. On stop(), its jobs are
+    interrupted and queued again for the next supervisor.
+    """
+
+    def __init__(self, max_jobs=None, max_workers=None, poll_interval=None, stale_after=None):
+        self.supervisor_id = make_worker_id()
+        self.max_jobs = max_jobs or getattr(settings, 'CRAWLER_SUPERVISOR_MAX_JOBS', 4)
+        self.max_workers = max_workers or getattr(settings, 'CRAWLER_SUPERVISOR_MAX_WORKERS', 20)
+        self.poll_interval = poll_interval or getattr(settings, 'CRAWLER_SUPERVISOR_POLL_SECONDS', 5)
+        self.stale_after = stale_after or getattr(settings, 'CRAWLER_SUPERVISOR_STALE_SECONDS', 60)
+        self.browser_pool = None  # Shared by every job that is not in debug mode
+        self.jobs = {}  # job id -> (task, workers)
+        self._stop = None
+
+    @property
+    def workers_in_use(self):
+        return sum(workers for _, workers in self.jobs.values())
+
+    def stop(self):
+        """Ask run() to interrupt its jobs and return"""
+        if self._stop is not None:
+            self._stop.set()
+
+    def _runnable(self):
+        """Queued jobs, and running jobs whose supervisor has gone quiet"""
+        stale = timezone.now() - timedelta(seconds=self.stale_after)
+        return CrawlJob.objects.filter(
+            Q(status='queued')
+            | Q(status__in=['running', 'cooloff'], supervisor_id__isnull=False)
+            & (Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=stale))
+        )
+
+    @sync_to_async
+    def _candidates(self, limit):
+        # Interrupted jobs resume before new ones start
+        resumed_first = Case(When(status='queued', then=Value(1)), default=Value(0), output_field=IntegerField())
+        return list(self._runnable().exclude(id__in=list(self.jobs))
+                    .order_by(resumed_first, 'created_at')[:limit])
+
+    @sync_to_async
+    def _claim(self, job):
+        """Take a job, unless another supervisor took it first"""
+        # Marked running in the same update, so a queued job is no longer runnable for anyone else
+        return self._runnable().filter(id=job.id).update(
+            status=Case(When(status='queued', then=Value('running')), default=F('status')),
+            supervisor_id=self.supervisor_id,
+            heartbeat_at=timezone.now()
+        ) == 1
+
+    @sync_to_async
+    def _heartbeat(self):
+        if self.jobs:
+            CrawlJob.objects.filter(id__in=list(self.jobs), supervisor_id=self.supervisor_id).update(
+                heartbeat_at=timezone.now()
+            )
+
+    @sync_to_async
+    def _mark_failed(self, job_id):
+        CrawlJob.objects.filter(id=job_id, status__in=['running', 'cooloff']).update(status='failed')
+
+    @sync_to_async
+    def _requeue(self, job_ids):
+        """Hand interrupted jobs to the next supervisor right away"""
+        return CrawlJob.objects.filter(id__in=job_ids, status__in=['running', 'cooloff']).update(
+            status='queued',
+            heartbeat_at=None,
+            supervisor_id=None
+        )
+
+    def _workers_for(self, job):
+        return max(1, min(job.parallel_workers, self.max_workers))
+
+    async def _run_job(self, job, workers):
+        # Debug jobs show their browser, so they get their own headed pool
+        browser_pool = None if job.debug_mode else self.browser_pool
+        if workers > 1:
+            crawler = ParallelCrawlerService(job.id, debug_mode=job.debug_mode, worker_count=workers,
+                                             browser_pool=browser_pool, revive_killed=False)
+        else:
+            crawler = CrawlerService(job.id, debug_mode=job.debug_mode, browser_pool=browser_pool,
+                                     revive_killed=False)
+        await crawler.process_job()
+
+    async def _start_jobs(self):
+        free = self.max_jobs - len(self.jobs)
+        if free <= 0:
+            return
+
+        for job in await self._candidates(free):
+            workers = self._workers_for(job)
+            if self.jobs and self.workers_in_use + workers > self.max_workers:
+                # Wait for running jobs to free enough workers
+                break
+            if not await self._claim(job):
+                continue
+
+            resumed = job.status != 'queued'
+            logger.info(f"Supervisor {self.supervisor_id} {'resuming' if resumed else 'starting'} "
+                        f"job {job.id} with {workers} workers")
+            self.jobs[job.id] = (asyncio.create_task(self._run_job(job, workers)), workers)
+
+    async def _reap_jobs(self):
+        for job_id, (task, _) in list(self.jobs.items()):
+            if not task.done():
+                continue
+            del self.jobs[job_id]
+            if not task.cancelled() and task.exception():
+                logger.error(f"Job {job_id} crashed: {task.exception()!r}")
+                await self._mark_failed(job_id)
+            else:
+                logger.info(f"Job {job_id} finished")
+
+    async def _poll(self):
+        await self._heartbeat()
+        await self._reap_jobs()
+        await self._start_jobs()
+        logger.debug(f"Supervisor {self.supervisor_id} heartbeat: {len(self.jobs)} jobs, "
+                     f"{self.workers_in_use}/{self.max_workers} workers")
+
+    async def run(self):
+        """Run jobs until stop() is called"""
+        self._stop = asyncio.Event()
+        self.browser_pool = await BrowserPool().start()
+        logger.info(f"Supervisor {self.supervisor_id} started (max_jobs={self.max_jobs}, "
+                    f"max_workers={self.max_workers}, browsers={self.browser_pool.size})")
+        try:
+            while not self._stop.is_set():
+                try:
+                    await self._poll()
+                except Exception as e:
+                    logger.exception(f"Supervisor poll failed: {str(e)}")
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._shutdown()
+
+    async def _shutdown(self):
+        await self._reap_jobs()
+        job_ids = list(self.jobs)
+        tasks = [task for task, _ in self.jobs.values()]
+        for task in tasks:
+            task.cancel()
+        # Crawlers flush their writes and release their URL leases as they unwind
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.jobs.clear()
+
+        if job_ids:
+            requeued = await self._requeue(job_ids)
+            logger.info(f"Supervisor {self.supervisor_id} queued {requeued} interrupted jobs again")
+        await self.browser_pool.close()
+        logger.info(f"Supervisor {self.supervisor_id} stopped")
@@ -1,66 +1,87 @@
 from django.shortcuts import render
+import hmac
 import json
-import asyncio
-import threading
 import logging
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.http import JsonResponse, HttpResponse, QueryDict, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.contrib import messages
+from django.core.exceptions import RequestDataTooBig
+from django.core.handlers.asgi import ASGIRequest
 from django.urls import reverse
-from django.db.models import F
+from django.db.models import F, Count, Q
 from django.conf import settings
 from asgiref.sync import sync_to_async
 from .models import CrawlJob, CrawledURL, CrawlStats, Proxy
-from .forms import URLSubmissionForm
-from .services import WebshareProxyService, CrawlerService
+from .forms import JobOptionsForm, URLSubmissionForm
+from .live_stats import JobStatsFeed
+from .metrics import collect as collect_metrics
+from .services import WebshareProxyService
+from .submission import import_urls
 import time
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+def _create_job(form, data):
+    """Create a pending job from validated job options; `data` carries debug_mode and parallel_workers"""
+    debug_mode = data.get('debug_mode') not in (None, False, '', 'false', '0')
+    
+    # Get parallel workers (default to 1 if not valid)
+    try:
+        parallel_workers = int(data.get('parallel_workers', 1))
+        # Ensure it's between 1 and 20
+        parallel_workers = max(1, min(20, parallel_workers))
+    except (ValueError, TypeError):
+        parallel_workers = 1
+    
+    job = CrawlJob.objects.create(
+        status='pending',
+        debug_mode=debug_mode,
+        parallel_workers=parallel_workers,
+        proxy_countries=form.cleaned_data.get('proxy_countries'),
+        reshuffle_proxies=form.cleaned_data.get('reshuffle_proxies', False),
+        proxy_selection=form.cleaned_data.get('proxy_selection') or 'lru',
+        fetch_mode=form.cleaned_data.get('fetch_mode') or 'browser',
+        blocked_resource_types=form.cleaned_data.get('blocked_resource_types'),
+        screenshot_mode=form.cleaned_data.get('screenshot_mode') or 'on_failure',
+        screenshot_format=form.cleaned_data.get('screenshot_format') or 'png',
+        screenshot_quality=form.cleaned_data.get('screenshot_quality') or 80,
+        follow_links=form.cleaned_data.get('follow_links', False),
+        max_depth=form.cleaned_data.get('max_depth') or 2,
+        max_pages=form.cleaned_data.get('max_pages'),
+        include_patterns=form.cleaned_data.get('include_patterns'),
+        exclude_patterns=form.cleaned_data.get('exclude_patterns')
+    )
+    
+    # Create stats object
+    CrawlStats.objects.create(job=job)
+    return job
+
 def home(request):
     """Home page with URL submission form"""
     if request.method == 'POST':
-        form = URLSubmissionForm(request.POST)
+        form = URLSubmissionForm(request.POST, request.FILES)
         if form.is_valid():
             # Create a new crawl job
-            debug_mode = 'debug_mode' in request.POST
-            
-            # Get parallel workers (default to 1 if not valid)
-            try:
-                parallel_workers = int(request.POST.get('parallel_workers', 1))
-                # Ensure it's between 1 and 20
-                parallel_workers = max(1, min(20, parallel_workers))
-            except (ValueError, TypeError):
-                parallel_workers = 1
-                
-            job = CrawlJob.objects.create(
-                status='pending',
-                debug_mode=debug_mode,
-                parallel_workers=parallel_workers,
-                proxy_countries=form.cleaned_data.get('proxy_countries'),
-                reshuffle_proxies=form.cleaned_data.get('reshuffle_proxies', False)
-            )
+            job = _create_job(form, request.POST)
             
-            # Create CrawledURL objects for each URL
-            urls = form.cleaned_data['urls']
-            job.urls_total = len(urls)
-            job.save()
+            # URLs are streamed into the job in batches, from the file if one was uploaded
+            urls_file = form.cleaned_data.get('urls_file')
+            result = import_urls(job, urls_file if urls_file else form.cleaned_data['urls'].splitlines())
             
-            # Create CrawledURL objects
-            crawled_urls = [
-                CrawledURL(job=job, url=url)
-                for url in urls
-            ]
-            CrawledURL.objects.bulk_create(crawled_urls)
-            
-            # Create stats object
-            CrawlStats.objects.create(job=job)
-            
-            # Redirect to the dashboard
-            return redirect('dashboard', job_id=job.id)
+            if not result.accepted:
+                job.delete()
+                form.add_error(None, f"No valid URLs were submitted ({result})")
+            else:
+                if result.rejected or result.duplicates:
+                    rejected = '; '.join(f"line {number}: {reason}" for number, reason, _ in result.rejected_lines[:5])
+                    messages.warning(request, f"{result}{'. ' + rejected if rejected else ''}")
+                
+                # Redirect to the dashboard
+                return redirect('dashboard', job_id=job.id)
     else:
         form = URLSubmissionForm()
     
@@ -72,44 +93,102 @@ def home(request):
         'recent_jobs': recent_jobs,
     })
 
+def _has_api_key(request):
+    """Whether the request carries CRAWLER_API_KEY as a bearer token"""
+    api_key = getattr(settings, 'CRAWLER_API_KEY', '')
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(api_key) and scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), api_key.encode())
+
+@csrf_exempt
+def submit_job(request):
+    """
+    API endpoint for creating a job with many URLs.
+    
+    Accepts NDJSON or plain text (one URL per line, job options in the
+    query string), a JSON object with a "urls" list and the job options,
+    or a multipart form with a "urls_file" upload. NDJSON and files are
+    read line by line as they stream in and are the way to submit large
+    lists; a JSON body is parsed whole, so it is limited to
+    DATA_UPLOAD_MAX_MEMORY_SIZE.
+    
+    Requests need CRAWLER_API_KEY as a bearer token, or a CSRF token like
+    the forms of the site, so other sites cannot submit jobs through a
+    visitor's browser.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    if not _has_api_key(request):
+        # Checked here rather than by the middleware, which cannot tell scripts with the key apart
+        if CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {}) is not None:
+            return JsonResponse({'error': 'An API key or a CSRF token is required'}, status=403)
+    
+    content_type = request.content_type
+    if content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except RequestDataTooBig:
+            return JsonResponse({
+                'error': 'JSON body too large; submit large URL lists as NDJSON or a "urls_file" upload'
+            }, status=413)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return JsonResponse({'error': f'Invalid JSON: {e}'}, status=400)
+        if not isinstance(data, dict) or not isinstance(data.get('urls'), list):
+            return JsonResponse({'error': 'Expected an object with a "urls" list'}, status=400)
+        options, lines = data, data['urls']
+    elif content_type == 'multipart/form-data':
+        if 'urls_file' not in request.FILES:
+            return JsonResponse({'error': 'Missing "urls_file" upload'}, status=400)
+        options, lines = request.POST, request.FILES['urls_file']
+    else:
+        # NDJSON or text, read straight from the request stream
+        options, lines = request.GET, request
+    
+    # Options left out take the defaults of the submission form
+    defaults = {name: field.initial for name, field in JobOptionsForm.base_fields.items() if field.initial is not None}
+    if isinstance(options, QueryDict):
+        options = options.copy()
+        for name, value in defaults.items():
+            options.setdefault(name, value)
+    else:
+        options = {**defaults, **options}
+    
+    form = JobOptionsForm(options)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Invalid job options', 'fields': form.errors}, status=400)
+    
+    job = _create_job(form, options)
+    result = import_urls(job, lines)
+    
+    response = {
+        'accepted': result.accepted,
+        'duplicates': result.duplicates,
+        'rejected': result.rejected,
+        'rejected_lines': [
+            {'line': number, 'reason': reason, 'content': line}
+            for number, reason, line in result.rejected_lines
+        ],
+    }
+    if not result.accepted:
+        job.delete()
+        response['error'] = 'No valid URLs were submitted'
+        return JsonResponse(response, status=400)
+    
+    response.update({
+        'job_id': job.id,
+        'urls_total': job.urls_total,
+        'dashboard_url': request.build_absolute_uri(reverse('dashboard', args=[job.id])),
+    })
+    return JsonResponse(response, status=201)
+
 def dashboard(request, job_id):
     """Dashboard for monitoring a crawl job"""
     job = get_object_or_404(CrawlJob, id=job_id)
     
-    # Check if we need to start the job
+    # Starting only queues the job; a run_supervisor process picks it up
     if job.status == 'pending' and 'start' in request.GET:
-        # Start the job asynchronously
-        # In a production environment, this would use Celery or similar
-        # For simplicity, we'll run it in a separate thread
-        def run_job():
-            # Create a new event loop for this thread
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                # Run the crawler in this thread's event loop
-                # Use the parallel crawler service if parallel_workers > 1
-                if job.parallel_workers > 1:
-                    from .services import ParallelCrawlerService
-                    loop.run_until_complete(ParallelCrawlerService(
-                        job_id, 
-                        debug_mode=job.debug_mode,
-                        worker_count=job.parallel_workers
-                    ).process_job())
-                else:
-                    # Use the regular crawler service for a single worker
-                    loop.run_until_complete(CrawlerService(
-                        job_id, 
-                        debug_mode=job.debug_mode
-                    ).process_job())
-            except Exception as e:
-                logger.exception(f"Error running crawler: {str(e)}")
-            finally:
-                loop.close()
-        
-        thread = threading.Thread(target=run_job)
-        thread.daemon = True
-        thread.start()
+        CrawlJob.objects.filter(id=job.id, status='pending').update(status='queued')
+        messages.info(request, f'Job #{job.id} is queued and will start when a supervisor has room for it')
         
         return redirect('dashboard', job_id=job.id)
     
@@ -126,8 +205,8 @@ def kill_job(request, job_id):
     if request.method == 'POST':
         job = get_object_or_404(CrawlJob, id=job_id)
         
-        # Only kill jobs that are running or in cooloff
-        if job.status in ['running', 'cooloff']:
+        # Only kill jobs that are queued, running or in cooloff
+        if job.status in ['queued', 'running', 'cooloff']:
             job.kill()
             messages.success(request, f'Job #{job_id} has been killed')
         else:
@@ -140,8 +219,8 @@ def reset_job(request, job_id):
     if request.method == 'POST':
         job = get_object_or_404(CrawlJob, id=job_id)
         
-        # Only reset jobs that aren't running
-        if job.status not in ['running', 'cooloff']:
+        # Only reset jobs that aren't queued or running
+        if job.status not in ['queued', 'running', 'cooloff']:
             job.reset()
             messages.success(request, f'Job #{job_id} has been reset and is ready to start')
         else:
@@ -149,6 +228,20 @@ def reset_job(request, job_id):
     
     return redirect('dashboard', job_id=job_id)
 
+def recrawl_job(request, job_id):
+    """Queue every URL of a job again, revalidating the stored pages"""
+    if request.method == 'POST':
+        job = get_object_or_404(CrawlJob, id=job_id)
+        
+        # Only recrawl jobs that aren't queued or running
+        if job.status not in ['queued', 'running', 'cooloff']:
+            job.recrawl()
+            messages.success(request, f'Job #{job_id} is ready to recrawl; unchanged pages will not be downloaded again')
+        else:
+            messages.error(request, f'Cannot recrawl job #{job_id} while it is running. Kill it first.')
+    
+    return redirect('dashboard', job_id=job_id)
+
 def content_view(request, url_id):
     """View the content of a crawled URL"""
     crawled_url = get_object_or_404(CrawledURL, id=url_id)
@@ -170,19 +263,18 @@ def content_view(request, url_id):
 def sync_proxies(request):
     """Sync proxies from WebShare API"""
     if request.method == 'POST':
-        count = WebshareProxyService.sync_proxies()
-        messages.success(request, f'Successfully synced {count} proxies')
+        result = WebshareProxyService.sync_proxies()
+        if result.ok:
+            messages.success(request, f'Successfully synced {result}')
+        else:
+            messages.error(request, f'Proxy {result}')
     
     return redirect('home')
 
-@csrf_exempt
-def job_stats(request, job_id):
-    """API endpoint for getting job stats"""
-    job = get_object_or_404(CrawlJob, id=job_id)
-    
-    try:
-        stats = job.stats
-    except CrawlStats.DoesNotExist:
+def _job_stats_data(job):
+    """The job stats payload, shared by the polling endpoint and the event stream"""
+    stats = CrawlStats.objects.select_related('current_proxy').filter(job=job).first()
+    if stats is None:
         stats = CrawlStats.objects.create(job=job)
     
     # Calculate cooloff remaining time
@@ -192,6 +284,14 @@ def job_stats(request, job_id):
         if job.cooloff_until > now:
             cooloff_remaining = (job.cooloff_until - now).total_seconds()
     
+    # Seconds since the supervisor running the job last checked in
+    heartbeat_age = None
+    heartbeat_stale = False
+    if job.heartbeat_at:
+        heartbeat_age = (timezone.now() - job.heartbeat_at).total_seconds()
+        heartbeat_stale = (job.status in ['running', 'cooloff']
+                           and heartbeat_age > getattr(settings, 'CRAWLER_SUPERVISOR_STALE_SECONDS', 60))
+    
     # Get current proxy info
     current_proxy = None
     if stats.current_proxy:
@@ -209,7 +309,7 @@ def job_stats(request, job_id):
             job=job, 
             proxy_used__isnull=False,
             crawled_at__isnull=False
-        ).order_by('-crawled_at')[:job.parallel_workers*2]
+        ).select_related('proxy_used').order_by('-crawled_at')[:job.parallel_workers*2]
         
         # Extract unique proxies
         seen_ips = set()
@@ -227,11 +327,6 @@ def job_stats(request, job_id):
     # Blocked proxies count
     blocked_proxies = Proxy.objects.filter(is_blocked=True).count()
     
-    # Get retry statistics
-    timeout_urls = job.urls.filter(retry_status='timeout').count()
-    retry_pending_urls = job.urls.filter(retry_status='retry_pending').count()
-    failed_urls = job.urls.filter(retry_status='failed').count()
-    
     data = {
         'id': job.id,
         'status': job.status,
@@ -242,20 +337,64 @@ def job_stats(request, job_id):
         'current_rate': job.current_rate,
         'successful_requests': stats.successful_requests,
         'failed_requests': stats.failed_requests,
+        'blocked_requests': stats.blocked_requests,
+        'blocked_bytes': stats.blocked_bytes,
+        'unchanged_requests': stats.unchanged_requests,
+        'block_pages': stats.block_pages,
+        'concurrency_limit': stats.concurrency_limit,
+        'concurrency_changes': stats.concurrency_changes,
+        'concurrency_log': json.loads(stats.concurrency_log) if stats.concurrency_log else [],
         'avg_response_time': round(stats.avg_response_time, 3) if stats.avg_response_time else None,
         'cooloff_remaining': cooloff_remaining,
         'blocked_proxies_count': blocked_proxies,
         'current_proxy': current_proxy,
         'active_proxies': active_proxies,
         'last_updated': stats.last_request_time.isoformat() if stats.last_request_time else None,
-        'timeout_urls': timeout_urls,
-        'retry_pending_urls': retry_pending_urls,
-        'failed_urls': failed_urls,
+        'timeout_urls': job.timeout_urls,
+        'retry_pending_urls': job.retry_pending_urls,
+        'failed_urls': job.failed_urls,
+        'http_fetches': job.http_fetches,
+        'browser_fetches': job.browser_fetches,
+        'fetch_mode': job.fetch_mode,
         'debug_mode': job.debug_mode,
         'parallel_workers': job.parallel_workers,
+        'supervisor_id': job.supervisor_id,
+        'heartbeat_age': round(heartbeat_age, 1) if heartbeat_age is not None else None,
+        'heartbeat_stale': heartbeat_stale,
     }
     
-    return JsonResponse(data)
+    return data
+
+@csrf_exempt
+def job_stats(request, job_id):
+    """API endpoint for getting job stats"""
+    job = get_object_or_404(CrawlJob, id=job_id)
+    return JsonResponse(_job_stats_data(job))
+
+def job_events(request, job_id):
+    """
+    Server-Sent Events stream of a job's stats: a snapshot on connect, then
+    only the keys that changed, taken from the counters its crawlers publish
+    """
+    job = get_object_or_404(CrawlJob, id=job_id)
+    
+    def build():
+        job.refresh_from_db()
+        return _job_stats_data(job)
+    
+    # Under ASGI open streams wait on the event loop; under WSGI each holds a worker thread
+    if isinstance(request, ASGIRequest):
+        events = JobStatsFeed.astream(job.id, build)
+    else:
+        events = JobStatsFeed.stream(job.id, build)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from holding events back
+    return response
+
+def metrics(request):
+    """Crawler metrics of every crawler process, in the Prometheus text format"""
+    return HttpResponse(collect_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @csrf_exempt
 def browser_preview(request, job_id):
@@ -272,7 +411,7 @@ def browser_preview(request, job_id):
     current_url = CrawledURL.objects.filter(
         job=job,
         retry_status__in=['pending', 'retry_pending'],
-        content__isnull=True
+        page__isnull=True
     ).first()
     
     if job.status == 'running' and current_url:
@@ -361,7 +500,7 @@ def export_job_content(request, job_id, content_type='structured'):
         else:
             # Export all raw HTML as a list of objects
             data = []
-            for url in job.urls.all():
+            for url in job.urls.select_related('page'):
                 data.append({
                     'url': url.url,
                     'status_code': url.status_code,
@@ -382,10 +521,10 @@ def _stream_job_content(job, content_type):
     # Start with opening bracket
     yield '['
     
-    urls = job.urls.all()
-    total = urls.count()
+    # URLs without structured content fall back to their HTML, so fetch the pages along
+    urls = job.urls.select_related('page')
     
-    for i, url in enumerate(urls):
+    for i, url in enumerate(urls.iterator(chunk_size=100)):
         if content_type == 'structured' and url.structured_content:
             try:
                 # Just use the structured content directly (it's already JSON)
@@ -420,12 +559,11 @@ def export_progress(request, job_id):
     
     # For structured content export, only count URLs that have structured_content
     export_type = request.GET.get('type', 'raw')
+    total_urls = job.urls_total
     if export_type == 'structured':
-        total_urls = job.urls.count()
-        processed_urls = job.urls.filter(structured_content__isnull=False).count()
+        processed_urls = job.urls_with_structured_content
     else:
-        total_urls = job.urls.count()
-        processed_urls = job.urls.filter(content__isnull=False).count()
+        processed_urls = job.urls_with_content
     
     data = {
         'total': total_urls,
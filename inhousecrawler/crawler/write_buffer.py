@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .frontier import save_urls
+from .metrics import metrics
+from .models import CrawledURL, CrawlJob
+from .page_store import save_pages
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Collects the crawler's per-URL writes and applies them in batches.
+
+    URL field changes are snapshotted when recorded and written with
+    bulk_update, along with the changes they make to the job's counts of
+    URLs per state; counters are summed and applied as F() increments, so
+    workers never overwrite each other's counts; plain values keep the
+    last one recorded. Everything pending is written in one transaction
+    every `max_items` URLs or `flush_interval` seconds, whichever comes
+    first, and on flush() and close().
+
+    Page HTML is kept as text until the flush, which compresses it into the
+    page store ahead of the URLs that refer to it. URLs discovered by a
+    link-following job are inserted in the same transaction.
+
+    Recording is cheap and safe from both the event loop and the
+    sync_to_async thread; only flushing touches the database. Listeners
+    are called with the counters and values of each flush once it has
+    committed.
+    """
+
+    def __init__(self, max_items=None, flush_interval=None, job_id=None):
+        self.job_id = job_id  # Labels the flush timings in the metrics
+        self.max_items = max_items or getattr(settings, 'CRAWLER_WRITE_BUFFER_SIZE', 50)
+        self.flush_interval = (flush_interval or getattr(settings, 'CRAWLER_WRITE_FLUSH_MS', 500)) / 1000
+        self._lock = threading.Lock()
+        self._flush_lock = None
+        self._urls = {}  # CrawledURL id -> {field: value}
+        self._pages = {}  # content key -> HTML
+        self._new_urls = []  # Unsaved CrawledURLs found by following links
+        self._counters = defaultdict(dict)  # (model, pk) -> {field: delta}
+        self._values = defaultdict(dict)  # (model, pk) -> {field: value}
+        self.listeners = []  # Called with (counters, values) after each flush
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def pending(self):
+        return len(self._urls)
+
+    async def start(self):
+        """Start flushing in the background"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        """Stop the background flush and write everything still pending"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def record_url(self, crawled_url, fields):
+        """Queue the current values of some fields of a CrawledURL"""
+        values = {field: getattr(crawled_url, field) for field in fields}
+        with self._lock:
+            self._urls.setdefault(crawled_url.id, {}).update(values)
+            # Taken under the same lock, so the counts are written in the same flush as the URL
+            changes = crawled_url.take_counter_changes()
+            if changes:
+                counters = self._counters[(CrawlJob, crawled_url.job_id)]
+                for field, delta in changes.items():
+                    counters[field] = counters.get(field, 0) + delta
+            full = len(self._urls) >= self.max_items
+        if full:
+            self._notify()
+
+    def store_page(self, key, content):
+        """Queue a page for the page store"""
+        with self._lock:
+            self._pages[key] = content
+
+    def add_urls(self, crawled_urls):
+        """Queue new URLs for insertion"""
+        with self._lock:
+            self._new_urls.extend(crawled_urls)
+
+    def increment(self, model, pk, **deltas):
+        """Queue counter increments on a row"""
+        with self._lock:
+            counters = self._counters[(model, pk)]
+            for field, delta in deltas.items():
+                counters[field] = counters.get(field, 0) + delta
+
+    def set_values(self, model, pk, **values):
+        """Queue plain field values on a row; the last value recorded wins"""
+        with self._lock:
+            self._values[(model, pk)].update(values)
+
+    def _notify(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing crawler writes: {str(e)}")
+
+    async def flush(self):
+        """Write everything pending now"""
+        if self._flush_lock is None:
+            await sync_to_async(self.flush_sync)()
+            return
+        # One flush at a time keeps writes to the same URL in order
+        async with self._flush_lock:
+            await sync_to_async(self.flush_sync)()
+
+    def _take(self):
+        with self._lock:
+            taken = (self._pages, self._urls, self._new_urls, self._counters, self._values)
+            self._pages, self._urls, self._new_urls = {}, {}, []
+            self._counters, self._values = defaultdict(dict), defaultdict(dict)
+        return taken
+
+    def _restore(self, pages, urls, new_urls, counters, values):
+        """Put back writes that failed, under anything recorded since"""
+        with self._lock:
+            self._pages = {**pages, **self._pages}
+            self._new_urls = new_urls + self._new_urls
+            for url_id, fields in urls.items():
+                self._urls[url_id] = {**fields, **self._urls.get(url_id, {})}
+            for key, deltas in counters.items():
+                for field, delta in deltas.items():
+                    self._counters[key][field] = self._counters[key].get(field, 0) + delta
+            for key, fields in values.items():
+                self._values[key] = {**fields, **self._values.get(key, {})}
+
+    def flush_sync(self):
+        """Write everything pending in one transaction; returns the number of URLs written"""
+        pages, urls, new_urls, counters, values = self._take()
+        if not pages and not urls and not new_urls and not counters and not values:
+            return 0
+
+        try:
+            with metrics.timer('crawler_db_flush_seconds', job=self.job_id), transaction.atomic():
+                # Pages first: the URLs below refer to them
+                save_pages(pages)
+
+                # bulk_update needs one field list per call, so group URLs by the fields they changed
+                groups = defaultdict(list)
+                for url_id, fields in urls.items():
+                    groups[tuple(sorted(fields))].append(CrawledURL(id=url_id, **fields))
+                for field_names, objs in groups.items():
+                    CrawledURL.objects.bulk_update(objs, field_names)
+
+                for key in set(counters) | set(values):
+                    model, pk = key
+                    update = {field: F(field) + delta for field, delta in counters.get(key, {}).items()}
+                    update.update(values.get(key, {}))
+                    if update:
+                        model.objects.filter(pk=pk).update(**update)
+
+                save_urls(new_urls)
+        except Exception:
+            self._restore(pages, urls, new_urls, counters, values)
+            raise
+
+        for listener in self.listeners:
+            try:
+                listener(counters, values)
+            except Exception as e:
+                logger.error(f"Error in write buffer listener: {str(e)}")
+        return len(urls)
@@ -79,6 +79,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Crawler processes write concurrently: take the write lock when a
+            # transaction starts, and wait for it rather than failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -144,13 +150,109 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'httpx': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 
 # WebShare API settings
 WEBSHARE_API_KEY = ''  # This should be in environment variables
 WEBSHARE_EMAIL = ''
+WEBSHARE_API_URL = None  # Proxy list endpoint; unset uses the public WebShare API
+WEBSHARE_SYNC_CONCURRENCY = 4  # Proxy list pages fetched at once during a sync
 
 
 # Crawler settings
 CRAWLER_COOLOFF_MINUTES = 5
+CRAWLER_PROXY_SYNC_SECONDS = 30  # How often the in-memory proxy pool syncs with the Proxy table
+CRAWLER_PROXY_HEALTH_ALPHA = 0.2  # Weight of the newest outcome in a proxy's health averages
+CRAWLER_PROXY_BLOCK_WINDOW = 3600  # Seconds a block counts against a proxy's health score
+CRAWLER_PROXY_TIMEOUT_FACTOR = 4  # First attempts through a proxy time out after this many times its average latency...
+CRAWLER_PROXY_MIN_TIMEOUT = 10  # ...but never sooner than this many seconds, nor later than 30
+
+# Browser pool settings
+CRAWLER_BROWSER_POOL_SIZE = 2  # Chromium instances shared by all workers of a job
+CRAWLER_BROWSER_MAX_PAGES = 100  # Recycle a browser after this many pages
+CRAWLER_BROWSER_IDLE_TIMEOUT = 300  # Close a browser after this many idle seconds
+
+# Supervisor settings (python manage.py run_supervisor)
+CRAWLER_SUPERVISOR_MAX_JOBS = 4  # Jobs one supervisor runs at once
+CRAWLER_SUPERVISOR_MAX_WORKERS = 20  # Workers across all of those jobs
+CRAWLER_SUPERVISOR_POLL_SECONDS = 5  # Heartbeat and job pickup interval
+CRAWLER_SUPERVISOR_STALE_SECONDS = 60  # Running jobs without a heartbeat this long are resumed by another supervisor
+
+# Adaptive concurrency of parallel jobs: parallel_workers is the ceiling
+CRAWLER_CONCURRENCY_INITIAL = 2  # Requests in flight when a job starts
+CRAWLER_DOMAIN_CONCURRENCY_INITIAL = 2  # Requests in flight per site when it is first seen
+CRAWLER_DOMAIN_CONCURRENCY_MAX = 8  # Never more than this per site
+CRAWLER_CONCURRENCY_WINDOW = 20  # Requests judged together before a limit grows
+CRAWLER_CONCURRENCY_TARGET_P95 = 15.0  # Limits grow while the p95 seconds per URL stay under this...
+CRAWLER_CONCURRENCY_TARGET_ERROR_RATE = 0.1  # ...and the share of failed requests under this
+CRAWLER_CONCURRENCY_BACKOFF = 0.5  # Limits are multiplied by this on a timeout or block page
+
+# Killing a job drops a marker file here; crawlers on every host must see the same directory
+CRAWLER_CONTROL_DIR = BASE_DIR / 'run'
+CRAWLER_KILL_POLL_SECONDS = 0.5  # How often crawlers look for it
+
+# Live job stats: crawlers publish their counters to CRAWLER_CONTROL_DIR and dashboards stream them
+CRAWLER_LIVE_STATS_SECONDS = 1  # How often the event stream sends what changed
+CRAWLER_LIVE_STATS_REFRESH_SECONDS = 10  # How often it rebuilds the full stats from the database
+CRAWLER_LIVE_STATS_STREAM_SECONDS = 300  # Longest a stream holds a WSGI worker before the browser reconnects
+
+# Metrics: crawler processes write theirs to CRAWLER_CONTROL_DIR and /metrics serves them to Prometheus
+CRAWLER_METRICS_SECONDS = 5  # How often each crawler process writes its metrics
+
+# Work dispatcher settings
+CRAWLER_DISPATCH_CHUNK_SIZE = 100  # URLs leased from the frontier per claim
+CRAWLER_LEASE_SECONDS = 180  # URL leases not renewed within this time can be reclaimed
+CRAWLER_MAX_URL_ATTEMPTS = 3  # URLs are not claimed again after this many attempts
+
+# Per-URL results and counters are buffered and written in batches
+CRAWLER_WRITE_BUFFER_SIZE = 50  # Flush after this many URLs...
+CRAWLER_WRITE_FLUSH_MS = 500  # ...or this many milliseconds, whichever comes first
+CRAWLER_PAGE_COMPRESSION_LEVEL = 6  # zlib level for page HTML in the page store
+
+# Block page detection by SimHash of the page text
+CRAWLER_SIMHASH_THRESHOLD = 3  # Pages this many bits or fewer from a known block page are block pages
+CRAWLER_BLOCK_PAGE_MIN_URLS = 3  # Short near-identical text on this many URLs of a site is a block page...
+CRAWLER_BLOCK_PAGE_MAX_CHARS = 2000  # ...if its text is no longer than this
+
+# Link following: URLs are normalized and checked against a seen-set before joining a job
+CRAWLER_STRIP_QUERY_PARAMS = [  # Query parameters dropped from URLs (shell-style patterns)
+    'utm_*', 'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_gl', 'ref_src',
+]
+CRAWLER_FRONTIER_EXACT_LIMIT = 200000  # URLs kept exactly in the seen-set; beyond this only a Bloom filter is kept...
+CRAWLER_FRONTIER_ERROR_RATE = 0.0001  # ...which skips about this share of new URLs as already seen
+
+# Bulk URL submission
+CRAWLER_SUBMIT_BATCH_SIZE = 1000  # Submitted URLs inserted per transaction
+CRAWLER_API_KEY = ''  # Lets scripts call POST /api/jobs/ without a CSRF token; should be in environment variables
+
+# Politeness settings (requests per second, per registrable domain)
+CRAWLER_HOST_RATE = 1.0  # Starting rate for every domain
+CRAWLER_HOST_MIN_RATE = 0.2
+CRAWLER_HOST_MAX_RATE = 5.0
+CRAWLER_HOST_BURST = 1.0  # Requests a domain may receive back to back
+CRAWLER_PROXY_RATE = None  # Optional cap on requests per second through a single proxy
+
+# HTTP fetch settings (used by the 'http' and 'auto' fetch modes)
+CRAWLER_HTTP_MAX_CLIENTS = 50  # Keep-alive clients kept open, one per proxy
+CRAWLER_HTTP_MAX_CONNECTIONS = 20  # Connections per client
+CRAWLER_HTTP_MIN_TEXT_CHARS = 200  # 'auto' opens a browser for pages with less visible text
+
+# Structured content is parsed from the page HTML with lxml on a process pool,
+# so browsers are handed back as soon as the HTML is read
+CRAWLER_EXTRACT_IN_BROWSER = False  # Extract with a script in the live page instead
+CRAWLER_EXTRACT_PROCESSES = None  # Pool size; defaults to the number of CPUs
+
+# Structured content caps per page
+CRAWLER_EXTRACT_MAX_LINKS = 2000
+CRAWLER_EXTRACT_MAX_IMAGES = 500
+CRAWLER_EXTRACT_MAX_TABLES = 50
+CRAWLER_EXTRACT_MAX_TABLE_ROWS = 1000  # Rows kept per table
+
+# Screenshots are written to static/screenshots on background threads
+CRAWLER_SCREENSHOT_WRITERS = 2